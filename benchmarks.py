@@ -0,0 +1,863 @@
+# Benchmarks for the Library Inventory and Logging System
+"""
+    Measures how the library system performs as its data grows.
+    Usage: python benchmarks.py <benchmark> [options]   (python benchmarks.py -h lists the benchmarks)
+    Every benchmark runs on synthetic data inside a temporary directory, so the real data files are never touched.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# library_system keeps its data files in the working directory, so the benchmarks work inside a scratch
+# directory (WORK_DIR), which main() creates and removes when they are done
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+START_DIR = os.getcwd()  # Where --json and --baseline paths are relative to
+WORK_DIR = None
+sys.path.insert(0, REPO_DIR)
+import library_system
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+PURPOSES = ['visit', 'borrow', 'return']
+
+# Synthetic data
+
+def make_logbook(size):
+    """
+    Builds a synthetic logbook with the given number of entries.
+
+    Args:
+        size (int): The number of log entries.
+
+    Returns:
+        dict: Log entries keyed by Log_ID, in the same shape as library_system.logbook.
+    """
+    return {
+        f'L{i + 1}': {
+            'Person Name': f'Person {i % 5000}',
+            'Date': f'{i % 28 + 1} {MONTHS[i // 28 % 12]} {2020 + i // 336 % 5}',
+            'Time': f'{i % 12 + 1}:{i % 60:02d} {"AM" if i % 2 else "PM"}',
+            'Purpose': PURPOSES[i % 3]
+        }
+        for i in range(size)
+    }
+
+def make_books(size):
+    """
+    Builds a synthetic catalogue with the given number of books, all available.
+
+    Args:
+        size (int): The number of books.
+
+    Returns:
+        dict: Books keyed by book ID, in the same shape as library_system.books.
+    """
+    return {
+        f'B{i + 1}': {
+            'Title': f'Title {i}',
+            'Author': f'Author {i % 1000}',
+            'Date Published': f'{i % 28 + 1} {MONTHS[i % 12]} {1900 + i % 120}',
+            'Status': 'Available',
+            'List of Borrowers': []
+        }
+        for i in range(size)
+    }
+
+# Helpers
+
+def timed(function, *args):
+    """
+    Runs a function once and measures how long it took.
+
+    Returns:
+        tuple: The function's return value and the elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def peak_memory(function, *args):
+    """
+    Runs a function once and measures the peak memory it allocated.
+
+    Returns:
+        tuple: The function's return value and the peak allocation in MB.
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return result, tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+def retained_memory(function, *args):
+    """
+    Runs a function once and measures the memory still allocated by it while its result is kept.
+
+    Returns:
+        tuple: The function's return value and the retained allocation in MB.
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return result, tracemalloc.get_traced_memory()[0] / 1e6
+    finally:
+        tracemalloc.stop()
+
+def print_table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+# Benchmarks
+
+def loop_statistics(logbook):
+    """
+    Counts the logbook the way a report would without the columns: one Python loop over every entry.
+    """
+    purposes, days, hours, borrowers, parsed = {}, {}, [0] * 24, {}, {}
+    for entry in logbook.values():
+        if entry['Time'] not in parsed:
+            parsed[entry['Time']] = datetime.datetime.strptime(entry['Time'], '%I:%M %p').hour
+        purposes[entry['Purpose']] = purposes.get(entry['Purpose'], 0) + 1
+        days[entry['Date']] = days.get(entry['Date'], 0) + 1
+        hours[parsed[entry['Time']]] += 1
+        if entry['Purpose'] == 'borrow':
+            borrowers[entry['Person Name']] = borrowers.get(entry['Person Name'], 0) + 1
+    return purposes, days, hours, sorted(borrowers.items(), key=lambda item: -item[1])[:10]
+
+def bench_analytics(args):
+    """
+    Compares the logbook statistics counted by a loop over the entries with the columnar copy of the logbook:
+    the time to build the columns once, then the time of each report over them.
+    """
+    rows = []
+    for size in args.sizes:
+        logbook = {log_id: library_system.LogEntry.from_dict(entry) for log_id, entry in make_logbook(size).items()}
+        _, loop_time = timed(loop_statistics, logbook)
+        columns = library_system.LogColumns()
+        _, build_time = timed(columns.rebuild, logbook)
+        summary, summary_time = timed(columns.summary)
+        assert summary['Entries'] == size
+        rows.append([size, 'numpy' if library_system.numpy is not None else 'array',
+                     f'{loop_time:.3f}', f'{build_time:.3f}', f'{summary_time:.4f}'])
+    print_table(['entries', 'columns', 'loop (s)', 'build (s)', 'report (s)'], rows)
+
+def print_fields(rows):
+    """
+    Prints rows the way the listings used to: one print() per field.
+    """
+    for row in rows:
+        print("-----------------------------------")
+        print(f"Book ID: {row['Book_ID']}")
+        print(f"Title: {row['Title']}")
+        print(f"Author: {row['Author']}")
+        print(f"Date Published: {row['Date Published']}")
+        print(f"Status: {row['Status']}")
+        print("-----------------------------------")
+
+def bench_output(args):
+    """
+    Compares printing every stored book with one print() per field against print_rows, which writes
+    a batch of rendered rows at once, and against exporting the books to CSV and JSONL.
+    Printed output goes to a file in the scratch directory, so the terminal's own speed is left out.
+    """
+    rows = []
+    for size in args.sizes:
+        library_system.books.clear()
+        library_system.books.update(make_books(size))
+        columns = library_system.LISTING_COLUMNS['all_books']
+        stdout = sys.stdout
+        with open(os.path.join(WORK_DIR, 'output.txt'), 'w') as sys.stdout:
+            _, print_time = timed(print_fields, library_system.library.all_books())
+            _, batch_time = timed(library_system.print_rows, library_system.library.all_books(), columns, 0)
+        sys.stdout = stdout
+        _, csv_time = timed(library_system.export_listing, 'all_books', os.path.join(WORK_DIR, 'books.csv'))
+        _, jsonl_time = timed(library_system.export_listing, 'all_books', os.path.join(WORK_DIR, 'books.jsonl'))
+        rows.append([size, f'{print_time:.3f}', f'{batch_time:.3f}', f'{csv_time:.3f}', f'{jsonl_time:.3f}'])
+    print_table(['books', 'print per field (s)', 'print_rows (s)', 'export csv (s)', 'export jsonl (s)'], rows)
+
+def bench_parsing(args):
+    """
+    Compares parsing the dates and times of a logbook of size entries with datetime.strptime, with the
+    hand-written parsers alone (fast_parse_date / fast_parse_time) and with parse_date / parse_time and their cache.
+    """
+    rows = []
+    for size in args.sizes:
+        entries = list(make_logbook(size).values())
+        dates = [entry['Date'] for entry in entries]
+        times = [entry['Time'] for entry in entries]
+        for kind, values, strptime_format, fast, cached in (
+                ('date', dates, '%d %b %Y', library_system.fast_parse_date, library_system.parse_date),
+                ('time', times, '%I:%M %p', library_system.fast_parse_time, library_system.parse_time)):
+            _, strptime_time = timed(lambda: [datetime.datetime.strptime(value, strptime_format) for value in values])
+            _, fast_time = timed(lambda: [fast(value) for value in values])
+            cached.cache_clear()
+            _, cached_time = timed(lambda: [cached(value) for value in values])
+            rows.append([size, kind, len(set(values)), f'{strptime_time:.3f}', f'{fast_time:.3f}', f'{cached_time:.3f}',
+                         f'{strptime_time / cached_time:.0f}x'])
+    print_table(['values', 'kind', 'distinct', 'strptime (s)', 'fast parser (s)', 'cached (s)', 'speedup'], rows)
+
+def bench_records(args):
+    """
+    Compares the memory held by a logbook of size entries and a catalogue of size books once loaded,
+    as dictionaries (as they used to be kept) and as compact records.
+    """
+    rows = []
+    for size in args.sizes:
+        for name, data in (('logbook', make_logbook(size)), ('books', make_books(size))):
+            data_file = os.path.join(WORK_DIR, f'{name}.txt')
+            library_system.save_data(data, data_file)
+            del data
+            for kind, record_type in (('dict', None), ('record', library_system.RECORD_TYPES[name])):
+                library_system.date_values.clear()
+                library_system.date_strings.clear()
+                (loaded, memory), load_time = timed(retained_memory, library_system.load_data, data_file, None, record_type)
+                rows.append([size, name, kind, f'{memory:.1f}', f'{memory * 1e6 / size:.0f}', f'{load_time:.2f}'])
+                del loaded
+    print_table(['records', 'dataset', 'kept as', 'memory (MB)', 'bytes/record', 'load (s)'], rows)
+
+def make_titled_books(size, seed=0):
+    """
+    Builds a synthetic catalogue whose titles and authors are made of words, for the search benchmark.
+    Word frequencies are skewed, so some words are in many titles and most are in few.
+    """
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(20000)]
+    names = [w.capitalize() for w in words[:5000]]
+    return {
+        f'B{i + 1}': library_system.Book(
+            ' '.join(words[int(rng.paretovariate(1.2)) % len(words)] for _ in range(rng.randint(1, 5))).capitalize(),
+            f'{rng.choice(names)} {rng.choice(names)}',
+            f'{i % 28 + 1} {MONTHS[i % 12]} {1900 + i % 120}')
+        for i in range(size)
+    }
+
+def bench_search(args):
+    """
+    Compares finding books by words of their title or author with a scan of every book (what search_rows does)
+    against the search index, for a word that is in the index, a misspelled word and a two-word query.
+    """
+    rows = []
+    for size in args.sizes:
+        books = make_titled_books(size)
+        sample = list(books.values())[size // 2]
+        word = library_system.tokenize(sample['Title'])[-1]
+        typo = word[:-2] + word[-1] + word[-2] if len(word) > 3 else word + 'e'
+        queries = {'word': word, 'typo': typo, 'two words': f"{word} {library_system.tokenize(sample['Author'])[0]}"}
+        index = library_system.SearchIndex()
+        _, build_time = timed(index.rebuild, books)
+        for kind, query in queries.items():
+            _, scan_time = timed(lambda: [book_id for book_id, book in books.items()
+                                          if query.lower() in book['Title'].lower() or query.lower() in book['Author'].lower()])
+            results, search_time = timed(index.search, query)
+            rows.append([size, kind, f'{build_time:.2f}', f'{scan_time * 1000:.1f}', f'{search_time * 1000:.2f}', len(results)])
+    print_table(['books', 'query', 'index build (s)', 'scan (ms)', 'search (ms)', 'results'], rows)
+
+def bench_serializers(args):
+    """
+    Compares save_data/load_data for each serializer against the old str()/eval() path.
+    """
+    data_file = os.path.join(WORK_DIR, 'serializers.txt')
+    rows = []
+    for size in args.sizes:
+        data = make_logbook(size)
+        _, save_time = timed(library_system.encrypt_and_save, str(data), library_system.get_key(), data_file)
+        _, load_time = timed(lambda: eval(library_system.load_and_decrypt(data_file, library_system.get_key())))
+        rows.append([size, 'str/eval', f'{save_time:.3f}', f'{load_time:.3f}', f'{os.path.getsize(data_file) / 1e6:.1f}'])
+        for serializer in sorted(library_system.SERIALIZERS):
+            _, save_time = timed(library_system.save_data, data, data_file, serializer)
+            loaded, load_time = timed(library_system.load_data, data_file)
+            assert loaded == data
+            rows.append([size, serializer, f'{save_time:.3f}', f'{load_time:.3f}', f'{os.path.getsize(data_file) / 1e6:.1f}'])
+    print_table(['records', 'format', 'save (s)', 'load (s)', 'file (MB)'], rows)
+
+# Python code run in a fresh interpreter by bench_startup, printing how long the import and the first accesses took
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import library_system
+imported = time.perf_counter()
+{access}
+print(imported - start, time.perf_counter() - imported)
+"""
+
+def bench_startup(args):
+    """
+    Measures how long it takes to import library_system and to run a command that only touches the books,
+    compared with one that touches every dataset, on a catalogue of size / 10 books and a logbook of size entries.
+    """
+    rows = []
+    for size in args.sizes:
+        data_dir = tempfile.mkdtemp(dir=WORK_DIR)
+        os.chdir(data_dir)
+        library_system.save_key(library_system.get_key(), library_system.key_file)
+        library_system.use_storage(library_system.FlatFileBackend())
+        library_system.save_data(make_books(size // 10), library_system.ENCRYPTED_BOOKS_FILE)
+        library_system.save_data({}, library_system.ENCRYPTED_BORROW_LIST_FILE)
+        library_system.save_data(make_logbook(size), library_system.ENCRYPTED_LOGBOOK_FILE)
+        for command, access in (('import only', ''),
+                                ('books only', 'len(library_system.books)'),
+                                ('all datasets', 'len(library_system.books), len(library_system.borrow_list), len(library_system.logbook)')):
+            timings = []
+            for _ in range(3):
+                output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(access=access)], cwd=data_dir,
+                                        env=dict(os.environ, PYTHONPATH=REPO_DIR), capture_output=True, text=True, check=True)
+                timings.append([float(value) for value in output.stdout.split()[-2:]])
+            import_time, access_time = min(timings, key=sum)
+            rows.append([size, command, f'{import_time:.3f}', f'{access_time:.3f}'])
+    os.chdir(WORK_DIR)
+    print_table(['log entries', 'command', 'import (s)', 'first access (s)'], rows)
+
+def bench_cipher(args):
+    """
+    Compares encrypting and decrypting many small records (person names) with a new Fernet object per call,
+    as encrypt/decrypt used to, against the shared cipher one by one and in batches.
+    """
+    from cryptography.fernet import Fernet
+    key = library_system.get_key()
+    cipher = library_system.get_cipher(key)
+    rows = []
+    for size in args.sizes:
+        names = [f'Person {i}' for i in range(size)]
+        tokens, old_encrypt = timed(lambda: [Fernet(key).encrypt(name.encode()) for name in names])
+        _, old_decrypt = timed(lambda: [Fernet(key).decrypt(token) for token in tokens])
+        _, shared_encrypt = timed(lambda: [cipher.encrypt(name) for name in names])
+        _, shared_decrypt = timed(lambda: [cipher.decrypt(token) for token in tokens])
+        tokens, batch_encrypt = timed(cipher.encrypt_many, names)
+        decrypted, batch_decrypt = timed(cipher.decrypt_many, tokens)
+        assert decrypted[-1] == names[-1].encode()
+        for path, encrypt_time, decrypt_time in (('Fernet per call', old_encrypt, old_decrypt),
+                                                 ('shared cipher', shared_encrypt, shared_decrypt),
+                                                 ('batch', batch_encrypt, batch_decrypt)):
+            rows.append([size, path, f'{encrypt_time:.3f}', f'{decrypt_time:.3f}', f'{size / (encrypt_time + decrypt_time):,.0f}'])
+    print_table(['records', 'path', 'encrypt (s)', 'decrypt (s)', 'round trips/s'], rows)
+
+def bench_streaming(args):
+    """
+    Compares the peak memory of saving and reading a logbook as one encrypted token (the old file format)
+    against the chunked file format, and against streaming its records without building a dictionary.
+    """
+    data_file = os.path.join(WORK_DIR, 'streaming.txt')
+    cipher = library_system.get_cipher()
+    rows = []
+    for size in args.sizes:
+        data = make_logbook(size)
+        _, save_peak = peak_memory(lambda: library_system.encrypt_and_save(library_system.serialize(data), cipher, data_file))
+        _, load_peak = peak_memory(lambda: library_system.deserialize(library_system.load_and_decrypt_bytes(data_file, cipher)))
+        rows.append([size, 'single token', f'{save_peak:.1f}', f'{load_peak:.1f}', '-'])
+        _, save_peak = peak_memory(library_system.save_data, data, data_file)
+        _, load_peak = peak_memory(library_system.load_data, data_file)
+        count, stream_peak = peak_memory(lambda: sum(1 for _ in library_system.iter_data(data_file)))
+        assert count == size
+        rows.append([size, 'chunked', f'{save_peak:.1f}', f'{load_peak:.1f}', f'{stream_peak:.1f}'])
+    print_table(['records', 'format', 'save peak (MB)', 'load peak (MB)', 'stream peak (MB)'], rows)
+
+def walk_circulation(books, borrow_list, logbook):
+    """
+    Counts the circulation summary the way a report would without the counters: by walking the borrow list,
+    the books and the logbook.
+    """
+    borrows, loans, visits = {}, {}, {}
+    for entry in borrow_list.values():
+        borrows[entry['Book_ID']] = borrows.get(entry['Book_ID'], 0) + 1
+    for book in books.values():
+        if book['Status'] == 'Unavailable' and book['List of Borrowers']:
+            person = logbook[book['List of Borrowers'][-1]]['Person Name']
+            loans[person] = loans.get(person, 0) + 1
+    for entry in logbook.values():
+        if entry['Purpose'] == 'visit':
+            visits[entry['Date']] = visits.get(entry['Date'], 0) + 1
+    return borrows, loans, visits
+
+def bench_circulation(args):
+    """
+    Compares the circulation summary counted by walking the records with reading it from the saved counters:
+    the time to count the counters from the records once (as rebuild-stats does), to load them back from
+    storage, and to read the summary from them.
+    """
+    rows = []
+    for size in args.sizes:
+        data = dict(zip(('books', 'borrow_list', 'logbook'), make_library(size)))
+        (borrows, loans, visits), walk_time = timed(walk_circulation, *data.values())
+        os.chdir(tempfile.mkdtemp(dir=WORK_DIR))
+        library_system.save_key(library_system.get_key(), library_system.key_file)
+        library_system.use_storage(library_system.STORAGE_BACKENDS[args.backend]())
+        for name, records in data.items():
+            library_system.storage.save(name, records)
+        for name in data:
+            library_system.library.count(name)
+        library_system.book_index.find_by_title('')
+        _, rebuild_time = timed(library_system.library.rebuild_circulation_stats)
+        library_system.circulation_stats.reset()
+        _, load_time = timed(library_system.circulation_stats.load)
+        summary, summary_time = timed(library_system.library.circulation_summary)
+        assert (summary['Borrows'], summary['Loans'], summary['Visits']) == \
+            (sum(borrows.values()), sum(loans.values()), sum(visits.values()))
+        os.chdir(WORK_DIR)
+        rows.append([size, f'{walk_time:.3f}', f'{rebuild_time:.3f}', f'{load_time:.3f}', f'{summary_time * 1e3:.2f}'])
+    print_table(['entries', 'walk (s)', 'rebuild (s)', 'load counters (s)', 'summary (ms)'], rows)
+
+def bench_durability(args):
+    """
+    Measures what each DURABILITY level costs: saving a logbook snapshot of size entries, appending single
+    records to its journal (without compacting it), and committing single log entries to SQLite.
+    """
+    appends = 500
+    default = library_system.DURABILITY
+    rows = []
+    for size in args.sizes:
+        data = make_logbook(size)
+        for level in library_system.DURABILITY_LEVELS:
+            library_system.DURABILITY = level
+            data_dir = tempfile.mkdtemp(dir=WORK_DIR)
+            data_file = os.path.join(data_dir, 'logbook.txt')
+            _, snapshot_time = timed(library_system.save_data, data, data_file)
+            minimum, library_system.JOURNAL_COMPACT_MIN_BYTES = library_system.JOURNAL_COMPACT_MIN_BYTES, float('inf')
+            _, journal_time = timed(lambda: [library_system.save_record(data, data_file, f'L{i + 1}') for i in range(appends)])
+            library_system.JOURNAL_COMPACT_MIN_BYTES = minimum
+            backend = library_system.SQLiteBackend(os.path.join(data_dir, 'library.db'))
+            _, sqlite_time = timed(lambda: [backend.save_record('logbook', data, f'L{i + 1}') for i in range(appends)])
+            backend.connection.close()
+            rows.append([size, level, f'{snapshot_time:.3f}', f'{journal_time / appends * 1e6:.0f}', f'{sqlite_time / appends * 1e6:.0f}'])
+    library_system.DURABILITY = default
+    print_table(['records', 'durability', 'snapshot save (s)', 'journal append (us)', 'sqlite commit (us)'], rows)
+
+def bench_flush(args):
+    """
+    Measures borrow and return operations through LibraryService (each changes books, borrow_list and logbook)
+    on a catalogue of size / 10 books and a logbook of size entries, flushing after every operation
+    against flushing in the background with a delay, which coalesces many operations into one flush.
+    """
+    rows = []
+    for size in args.sizes:
+        for delay in (None, 0.05):
+            data_dir = tempfile.mkdtemp(dir=WORK_DIR)
+            os.chdir(data_dir)
+            library_system.save_key(library_system.get_key(), library_system.key_file)
+            library_system.use_storage(library_system.STORAGE_BACKENDS[args.backend]())
+            library_system.storage.save('books', make_books(max(size // 10, 100)))
+            library_system.storage.save('borrow_list', {})
+            library_system.storage.save('logbook', make_logbook(size))
+            library_system.use_storage(library_system.STORAGE_BACKENDS[args.backend]())
+            library_system.library.count('logbook')
+            manager = library_system.flush_manager
+            manager.delay, manager.flushes = delay, 0
+            start = time.perf_counter()
+            for i in range(args.operations):
+                book = i // 2 % 100
+                if i % 2 == 0:
+                    library_system.library.borrow('Person', '2 Jan 2024', '10:00 AM', f'Title {book}', f'Author {book}', '9 Jan 2024')
+                else:
+                    library_system.library.return_book('Person', '3 Jan 2024', '11:00 AM', f'Title {book}', f'Author {book}')
+            elapsed = time.perf_counter() - start
+            _, close_time = timed(library_system.library.close)
+            manager.delay = library_system.FLUSH_DELAY
+            rows.append([size, 'per operation' if delay is None else f'{delay}s delay', f'{args.operations / elapsed:,.0f}',
+                         f'{elapsed / args.operations * 1e6:.0f}', manager.flushes, f'{close_time:.3f}'])
+    os.chdir(WORK_DIR)
+    print_table(['log entries', 'flush', 'ops/s', 'us/op', 'flushes', 'final flush (s)'], rows)
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values fall.
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def run_desk(address, desk, operations, latencies, book_count):
+    """
+    One circulation desk of bench_server: sends its share of a mixed workload to the server, one request at a time,
+    and records the latency of every read and write.
+    Three in five operations look up one of the book_count books, one logs a visit and one borrows or returns
+    the desk's own book.
+    """
+    reader, writer = await asyncio.open_unix_connection(address, limit=2 ** 24)
+    title, author = f'Title {desk}', f'Author {desk % 1000}'
+    borrowed = False
+    for i in range(operations):
+        if i % 5 < 3:
+            kind, method, args = 'read', 'get_book', [f'Title {(desk * 7919 + i) % book_count}']
+        elif i % 5 == 3:
+            kind, method, args = 'write', 'visit', [f'Person {desk}', '2 Jan 2024', '10:00 AM']
+        elif borrowed:
+            kind, method, args = 'write', 'return_book', [f'Person {desk}', '3 Jan 2024', '11:00 AM', title, author]
+        else:
+            kind, method, args = 'write', 'borrow', [f'Person {desk}', '2 Jan 2024', '10:00 AM', title, author, '9 Jan 2024']
+        start = time.perf_counter()
+        writer.write(json.dumps({'id': i, 'method': method, 'args': args}).encode() + b"\n")
+        response = json.loads(await reader.readline())
+        latencies[kind].append(time.perf_counter() - start)
+        assert 'error' not in response, response
+        if method in ('borrow', 'return_book'):
+            borrowed = not borrowed
+    writer.close()
+
+async def run_load(address, clients, operations, book_count):
+    latencies = {'read': [], 'write': []}
+    start = time.perf_counter()
+    await asyncio.gather(*(run_desk(address, desk, operations // clients, latencies, book_count) for desk in range(clients)))
+    return latencies, time.perf_counter() - start
+
+def bench_instrumentation(args):
+    """
+    Measures what the instrumentation costs: size encryptions of small records and size service lookups
+    with it off (nothing is wrapped) and on (every call is timed into a counter and a histogram).
+    """
+    cipher = library_system.get_cipher(library_system.get_key())
+    names = [f'Person {i}' for i in range(max(args.sizes))]
+    service = library_system.LibraryService()
+    rows = []
+    for size in args.sizes:
+        for name, call in (('encrypt', lambda: [cipher.encrypt(name) for name in names[:size]]),
+                           ('service.find_book', lambda: [service.find_book('Title', 'Author') for _ in range(size)])):
+            _, off_time = timed(call)
+            library_system.instrumentation.enable()
+            try:
+                _, on_time = timed(call)
+            finally:
+                library_system.instrumentation.disable()
+                library_system.instrumentation.reset()
+            rows.append([size, name, f'{off_time:.3f}', f'{on_time:.3f}', f'{(on_time - off_time) * 1e6 / size:.2f}'])
+    print_table(['calls', 'timer', 'off (s)', 'on (s)', 'overhead (us/call)'], rows)
+
+def bench_server(args):
+    """
+    Runs the library server on a catalogue of size / 10 books and a logbook of size entries, and drives it
+    with --clients concurrent desks sending --operations requests in total. Reports the throughput and the
+    latency percentiles, with group commit off (one commit per write) and on (WRITE_BATCH_SIZE).
+    """
+    rows = []
+    for size in args.sizes:
+        for batch_size in (1, library_system.WRITE_BATCH_SIZE):
+            data_dir = tempfile.mkdtemp(dir=WORK_DIR)
+            os.chdir(data_dir)
+            library_system.save_key(library_system.get_key(), library_system.key_file)
+            library_system.use_storage(library_system.STORAGE_BACKENDS[args.backend]())
+            book_count = max(size // 10, args.clients)
+            library_system.storage.save('books', make_books(book_count))
+            library_system.storage.save('borrow_list', {})
+            library_system.storage.save('logbook', make_logbook(size))
+            address = os.path.join(data_dir, 'library.sock')
+            server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'library_system.py'), '--backend', args.backend,
+                                       'serve', '--address', address, '--batch-size', str(batch_size)],
+                                      cwd=data_dir, stdout=subprocess.DEVNULL)
+            try:
+                while not os.path.exists(address):
+                    time.sleep(0.05)
+                latencies, elapsed = asyncio.run(run_load(address, args.clients, args.operations, book_count))
+            finally:
+                server.terminate()
+                server.wait()
+            every = sorted(latencies['read'] + latencies['write'])
+            writes = sorted(latencies['write'])
+            rows.append([size, batch_size, args.clients, f'{len(every) / elapsed:,.0f}', f'{percentile(every, 0.5) * 1e3:.2f}',
+                         f'{percentile(every, 0.99) * 1e3:.2f}', f'{percentile(writes, 0.99) * 1e3:.2f}'])
+    os.chdir(WORK_DIR)
+    print_table(['log entries', 'batch', 'clients', 'ops/s', 'p50 (ms)', 'p99 (ms)', 'write p99 (ms)'], rows)
+
+# Mixed workload: each operation and its weight (out of 100) in bench_workload
+WORKLOAD_MIX = (('visit', 30), ('borrow', 15), ('return', 15), ('view_book', 20),
+                ('transactions_per_day', 10), ('view_pending', 5), ('overdue_loans', 5))
+
+def make_library(size, seed=0):
+    """
+    Builds a consistent synthetic library with a seeded random generator, so every run builds the same data:
+    a catalogue of size / 10 books (at least 100) and a logbook of size visits, borrows and returns spread over
+    the days from 1 Jan 2020, with a borrow entry for every borrow and the books of open loans unavailable.
+
+    Args:
+        size (int): The number of log entries.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        tuple: books, borrow_list and logbook, as dictionaries of records.
+    """
+    rng = random.Random(seed)
+    books = {
+        f'B{i + 1}': library_system.Book(f'Title {i}', f'Author {i % 1000}', f'{i % 28 + 1} {MONTHS[i % 12]} {1900 + i % 120}')
+        for i in range(max(size // 10, 100))
+    }
+    people = [f'Person {i}' for i in range(max(size // 20, 10))]
+    available = list(books)
+    open_loans = []  # (book ID, borrower)
+    borrow_list, logbook = {}, {}
+    first_day = datetime.date(2020, 1, 1).toordinal()
+    days = max(size // 500, 30)
+    for i in range(size):
+        day = first_day + i * days // size
+        hour = rng.randint(8, 17)
+        time_str = f'{hour % 12 or 12}:{rng.randrange(60):02d} {"AM" if hour < 12 else "PM"}'
+        log_id = f'L{i + 1}'
+        roll = rng.random()
+        if roll < 0.2 and available:
+            position = rng.randrange(len(available))
+            available[position], available[-1] = available[-1], available[position]
+            book_id = available.pop()
+            person = rng.choice(people)
+            logbook[log_id] = library_system.LogEntry(person, library_system.format_date(day), time_str, 'borrow')
+            borrow_list[f'BL{len(borrow_list) + 1}'] = library_system.BorrowEntry(book_id, log_id, library_system.format_date(day + 14))
+            books[book_id]['Status'] = 'Unavailable'
+            books[book_id]['List of Borrowers'].append(log_id)
+            open_loans.append((book_id, person))
+        elif roll < 0.4 and open_loans:
+            position = rng.randrange(len(open_loans))
+            open_loans[position], open_loans[-1] = open_loans[-1], open_loans[position]
+            book_id, person = open_loans.pop()
+            logbook[log_id] = library_system.LogEntry(person, library_system.format_date(day), time_str, 'return')
+            books[book_id]['Status'] = 'Available'
+            available.append(book_id)
+        else:
+            logbook[log_id] = library_system.LogEntry(rng.choice(people), library_system.format_date(day), time_str, 'visit')
+    return books, borrow_list, logbook
+
+def data_file_sizes():
+    """
+    Returns the size in bytes of every data file of the storage backend in use, in the working directory.
+    """
+    if library_system.storage.name == 'sqlite':
+        paths = [library_system.SQLITE_FILE, library_system.SQLITE_FILE + '-wal']
+    else:
+        paths = [path for data_file in library_system.DATA_FILES.values() for path in (data_file, library_system.journal_path(data_file))]
+    return {path: os.path.getsize(path) for path in paths if os.path.exists(path)}
+
+def run_workload(books, logbook, operations, seed):
+    """
+    Runs a seeded mix of operations (WORKLOAD_MIX) through LibraryService, starting from the state of
+    the generated data, and records the latency of every operation.
+
+    Returns:
+        tuple: The latencies in seconds of each operation, and the total elapsed time.
+    """
+    rng = random.Random(seed + 1)
+    service = library_system.library
+    titles = [(book['Title'], book['Author']) for book in books.values()]
+    available = [(book['Title'], book['Author']) for book in books.values() if book['Status'] == 'Available']
+    open_loans = [(logbook[book['List of Borrowers'][-1]]['Person Name'], book['Title'], book['Author'])
+                  for book in books.values() if book['Status'] == 'Unavailable']
+    history = list(dict.fromkeys(entry['Date'] for entry in logbook.values()))
+    today_ordinal = library_system.parse_date(history[-1]) + 1
+    today = library_system.format_date(today_ordinal)
+    return_date = library_system.format_date(today_ordinal + 14)
+    names, weights = zip(*WORKLOAD_MIX)
+    latencies = {name: [] for name in names}
+    start = time.perf_counter()
+    for name in rng.choices(names, weights, k=operations):
+        if name == 'borrow' and not available or name == 'return' and not open_loans:
+            name = 'visit'
+        person = f'Person {rng.randrange(1000)}'
+        operation_start = time.perf_counter()
+        if name == 'visit':
+            service.visit(person, today, '10:00 AM')
+        elif name == 'borrow':
+            title, author = available.pop(rng.randrange(len(available)))
+            service.borrow(person, today, '10:30 AM', title, author, return_date)
+            open_loans.append((person, title, author))
+        elif name == 'return':
+            person, title, author = open_loans.pop(rng.randrange(len(open_loans)))
+            service.return_book(person, today, '11:00 AM', title, author)
+            available.append((title, author))
+        elif name == 'view_book':
+            service.get_book(rng.choice(titles)[0])
+        elif name == 'transactions_per_day':
+            service.transactions_on(rng.choice(history))
+        elif name == 'view_pending':
+            service.pending_books()
+        else:
+            service.overdue_loans(today)
+        latencies[name].append(time.perf_counter() - operation_start)
+    return latencies, time.perf_counter() - start
+
+def latency_summary(latencies):
+    """
+    Summarizes a list of latencies in seconds as a count and milliseconds percentiles.
+    """
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'count': 0}
+    return {
+        'count': len(latencies),
+        'mean_ms': sum(latencies) / len(latencies) * 1e3,
+        'p50_ms': percentile(latencies, 0.5) * 1e3,
+        'p95_ms': percentile(latencies, 0.95) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+        'max_ms': latencies[-1] * 1e3
+    }
+
+def workload_result(size, args):
+    """
+    Measures one size of bench_workload in a fresh data directory: saving the generated data, loading it back,
+    building the indexes, then the mixed workload.
+
+    Returns:
+        dict: The measurements, ready to be saved as JSON.
+    """
+    data_dir = tempfile.mkdtemp(dir=WORK_DIR)
+    os.chdir(data_dir)
+    library_system.save_key(library_system.get_key(), library_system.key_file)
+    library_system.use_storage(library_system.STORAGE_BACKENDS[args.backend]())
+    data = dict(zip(('books', 'borrow_list', 'logbook'), make_library(size, args.seed)))
+    save_seconds = {}
+    for name, records in data.items():
+        _, save_seconds[name] = timed(library_system.storage.save, name, records)
+    file_sizes = data_file_sizes()
+
+    library_system.use_storage(library_system.STORAGE_BACKENDS[args.backend]())
+    counts, load_peak = peak_memory(lambda: {name: library_system.library.count(name) for name in data})
+    library_system.use_storage(library_system.STORAGE_BACKENDS[args.backend]())
+    load_seconds = {}
+    for name in data:
+        _, load_seconds[name] = timed(library_system.library.count, name)
+    assert counts == {name: len(records) for name, records in data.items()}
+    # The first query of each index builds it
+    _, index_seconds = timed(lambda: (library_system.book_index.find_by_title(''), library_system.return_date_index.between(0, 0),
+                                      library_system.log_date_index.on(0), library_system.circulation_stats.load()))
+
+    latencies, elapsed = run_workload(data['books'], data['logbook'], args.operations, args.seed)
+    _, close_seconds = timed(library_system.library.close)
+    os.chdir(WORK_DIR)
+    every = [latency for operation in latencies.values() for latency in operation]
+    return {
+        'size': size,
+        'books': len(data['books']),
+        'borrow_entries': len(data['borrow_list']),
+        'file_bytes': file_sizes,
+        'save_seconds': save_seconds,
+        'load_seconds': load_seconds,
+        'load_peak_mb': load_peak,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'index_build_seconds': index_seconds,
+        'workload': {
+            'operations': len(every),
+            'seconds': elapsed,
+            'ops_per_second': len(every) / elapsed,
+            'final_flush_seconds': close_seconds,
+            'latency': latency_summary(every),
+            'latency_by_operation': {name: latency_summary(values) for name, values in latencies.items()}
+        }
+    }
+
+# Metrics compared with a baseline: (label, function reading it from a result, True if higher is better)
+BASELINE_METRICS = (
+    ('ops/s', lambda result: result['workload']['ops_per_second'], True),
+    ('p50 (ms)', lambda result: result['workload']['latency']['p50_ms'], False),
+    ('p99 (ms)', lambda result: result['workload']['latency']['p99_ms'], False),
+    ('save (s)', lambda result: sum(result['save_seconds'].values()), False),
+    ('load (s)', lambda result: sum(result['load_seconds'].values()), False),
+    ('load peak (MB)', lambda result: result['load_peak_mb'], False),
+    ('files (MB)', lambda result: sum(result['file_bytes'].values()) / 1e6, False),
+)
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    Prints every metric of a report next to the same metric of a baseline report (same sizes, backend and seed)
+    and flags the ones that got worse by more than the tolerance.
+
+    Returns:
+        int: The number of regressions.
+    """
+    baseline_results = {result['size']: result for result in baseline['results']}
+    rows = []
+    regressions = 0
+    for result in report['results']:
+        before = baseline_results.get(result['size'])
+        if before is None:
+            continue
+        for label, metric, higher_is_better in BASELINE_METRICS:
+            old, new = metric(before), metric(result)
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            regressions += worse > tolerance
+            rows.append([result['size'], label, f'{old:,.2f}', f'{new:,.2f}', f'{change:+.1%}',
+                         'REGRESSION' if worse > tolerance else ''])
+    print_table(['log entries', 'metric', 'baseline', 'current', 'change', ''], rows)
+    return regressions
+
+def bench_workload(args):
+    """
+    Runs the whole system on seeded synthetic libraries of each size: saves and loads the data, builds the
+    indexes and runs --operations operations of a mixed workload (WORKLOAD_MIX) through LibraryService.
+    Reports throughput, latency percentiles, peak memory and file sizes, optionally as JSON (--json),
+    and compares them with a baseline report (--baseline), failing if anything got worse than --tolerance.
+    """
+    report = {
+        'benchmark': 'workload',
+        'backend': args.backend,
+        'seed': args.seed,
+        'operations': args.operations,
+        'durability': library_system.DURABILITY,
+        'python': sys.version.split()[0],
+        'results': [workload_result(size, args) for size in args.sizes]
+    }
+    print_table(['log entries', 'save (s)', 'load (s)', 'load peak (MB)', 'files (MB)', 'ops/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)'],
+                [[result['size'], f"{sum(result['save_seconds'].values()):.2f}", f"{sum(result['load_seconds'].values()):.2f}",
+                  f"{result['load_peak_mb']:.1f}", f"{sum(result['file_bytes'].values()) / 1e6:.1f}",
+                  f"{result['workload']['ops_per_second']:,.0f}", f"{result['workload']['latency']['p50_ms']:.2f}",
+                  f"{result['workload']['latency']['p95_ms']:.2f}", f"{result['workload']['latency']['p99_ms']:.2f}"]
+                 for result in report['results']])
+    if args.json:
+        with open(os.path.join(START_DIR, args.json), 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Report saved to {args.json}.")
+    if args.baseline:
+        with open(os.path.join(START_DIR, args.baseline)) as file:
+            baseline = json.load(file)
+        if (baseline['backend'], baseline['seed'], baseline['operations']) != (args.backend, args.seed, args.operations):
+            print("Warning: the baseline was run with another backend, seed or number of operations.")
+        if compare_with_baseline(report, baseline, args.tolerance):
+            raise SystemExit(1)
+
+BENCHMARKS = {
+    'analytics': bench_analytics,
+    'cipher': bench_cipher,
+    'circulation': bench_circulation,
+    'durability': bench_durability,
+    'flush': bench_flush,
+    'instrumentation': bench_instrumentation,
+    'output': bench_output,
+    'parsing': bench_parsing,
+    'records': bench_records,
+    'serializers': bench_serializers,
+    'search': bench_search,
+    'server': bench_server,
+    'startup': bench_startup,
+    'streaming': bench_streaming,
+    'workload': bench_workload,
+}
+
+def main():
+    """
+    Runs the benchmark named on the command line inside a scratch directory, which is removed afterwards.
+    """
+    global WORK_DIR
+    parser = argparse.ArgumentParser(description="Library Inventory and Logging System benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000], help="number of records to benchmark with")
+    parser.add_argument('--backend', choices=sorted(library_system.STORAGE_BACKENDS), default=library_system.STORAGE_BACKEND,
+                        help="storage backend of the circulation, flush, server and workload benchmarks")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent desks of the server benchmark")
+    parser.add_argument('--operations', type=int, default=20000, help="operations run in the flush, server and workload benchmarks")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic data and workload of the workload benchmark")
+    parser.add_argument('--json', metavar='PATH', help="save the report of the workload benchmark as JSON")
+    parser.add_argument('--baseline', metavar='PATH', help="compare the workload benchmark with a report saved by --json")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="fraction a metric may get worse than the baseline before it fails")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix='library_benchmarks_') as WORK_DIR:
+        os.chdir(WORK_DIR)
+        try:
+            BENCHMARKS[args.benchmark](args)
+        finally:
+            library_system.flush_manager.close()
+            os.chdir(START_DIR)  # Leave the scratch directory so it can be removed
+
+if __name__ == "__main__":
+    main()
@@ -15,140 +15,3804 @@
 # Usage of cryptography fucntionality
 from cryptography.fernet import Fernet #Main function for encryption and decryption
 import datetime #Function within the cryptography library to help validate time and date
+import os #Used to remove journal files once they are compacted
+import ast #Safely reads files saved by older versions without using eval
+import json #Stdlib serializer for the data files
+import struct #Packs the length prefixes and numbers of the binary record format
+import argparse #Parses command line arguments
+import bisect #Searches the sorted dates of the date indexes
+import contextlib #Builds the transaction blocks of the storage backends
+import time #Timestamps the tokens of batch encryption
+import itertools #Chains the chunks of streamed files
+import csv #Reads the CSV files of bulk imports
+import sqlite3 #Database of the 'sqlite' storage backend
+import asyncio #Event loop of the library server
+import socket #Connects desks to the library server
+import threading #Flushes changes in the background
+import signal #Stops the library server cleanly
+import sys #Interns the repeated strings of records
+import collections.abc #Base class of the records, which behave like dictionaries
+import array #Columns of the logbook analytics
+import operator #Vectorized comparisons of the logbook analytics
+import io #Buffers the rows of exports
+import re #Splits titles and authors into words for the search index
+import heapq #Picks the best matches of a search
+import math #Weighs search matches by how rare their words are
+import functools #Caches parsed dates and times
+import hmac #Keys the circulation counters of each borrower without storing the name
+import hashlib #Hash of those keys
+import cProfile #Profiles the program on demand
+import pstats #Reports the profiles
+
+# msgpack is optional: when it is installed it packs the binary records, otherwise the built-in packer below is used
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# NumPy is optional: when it is installed the logbook analytics are vectorized with it, otherwise with the array module
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Generates a key for encryption
 def generate_key():
     return Fernet.generate_key()
 
-# Loads the encryption key from a file
-def load_key(key_file):
-    with open(key_file, "rb") as file:
-        return file.read()
+# Loads the encryption key from a file
+def load_key(key_file):
+    with open(key_file, "rb") as file:
+        return file.read()
+
+# Saves the encryption key to a file
+def save_key(key, key_file):
+    with atomic_write(key_file, 'fsync-dir') as file:  # Losing the key loses every file, so it is always synced
+        file.write(key)
+
+class Cipher:
+    """
+    Encrypts and decrypts with a single Fernet object, so the key is parsed and the backend set up only once per key.
+    Use get_cipher to get the shared cipher of a key instead of creating one.
+
+    Args:
+        key (bytes): The encryption key.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.fernet = Fernet(key)
+
+    def encrypt(self, data):
+        """
+        Encrypts a string or bytes.
+
+        Returns:
+            bytes: The encrypted data (a Fernet token).
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        return self.fernet.encrypt(data)
+
+    def decrypt(self, encrypted_data):
+        """
+        Decrypts a Fernet token.
+
+        Returns:
+            bytes: The decrypted data.
+        """
+        return self.fernet.decrypt(encrypted_data)
+
+    def encrypt_many(self, items):
+        """
+        Encrypts many strings or bytes at once, e.g. the records of a journal or a column of a table.
+        All tokens of a batch share one timestamp, so the clock is read once per batch instead of once per item.
+
+        Returns:
+            list: The encrypted items, in order.
+        """
+        now = int(time.time())
+        encrypt_at_time = self.fernet.encrypt_at_time
+        return [encrypt_at_time(item.encode() if isinstance(item, str) else item, now) for item in items]
+
+    def decrypt_many(self, encrypted_items):
+        """
+        Decrypts many Fernet tokens at once.
+
+        Returns:
+            list: The decrypted items as bytes, in order.
+        """
+        decrypt = self.fernet.decrypt
+        return [decrypt(item) for item in encrypted_items]
+
+# Shared ciphers, one per key
+ciphers = {}
+
+def get_cipher(key=None):
+    """
+    Returns the shared cipher of a key, creating it on first use.
+
+    Args:
+        key (bytes or Cipher): The encryption key, or a cipher which is returned as it is. Defaults to the key from get_key.
+
+    Returns:
+        Cipher: The cipher of the key.
+    """
+    if isinstance(key, Cipher):
+        return key
+    if key is None:
+        key = get_key()
+    cipher = ciphers.get(key)
+    if cipher is None:
+        cipher = ciphers[key] = Cipher(key)
+    return cipher
+
+# Encrypts data (a string or bytes) using the encryption key (or a cipher)
+def encrypt(data, key):
+    return get_cipher(key).encrypt(data)
+
+# Decrypts data using the encryption key (or a cipher)
+def decrypt(encrypted_data, key):
+    return decrypt_bytes(encrypted_data, key).decode()
+
+# Decrypts data using the encryption key (or a cipher) without decoding it into a string
+def decrypt_bytes(encrypted_data, key):
+    return get_cipher(key).decrypt(encrypted_data)
+
+# Encrypts data and save it to a file
+def encrypt_and_save(data, key, key_file):
+    encrypted_data = encrypt(data, key)
+    with atomic_write(key_file) as file:
+        file.write(encrypted_data)
+
+# Loads encrypted data from a file and decrypts it
+def load_and_decrypt(key_file, key):
+    with open(key_file, "rb") as file:
+        encrypted_data = file.read()
+    return decrypt(encrypted_data, key)
+
+# Loads encrypted data from a file and decrypts it without decoding it into a string
+def load_and_decrypt_bytes(key_file, key):
+    with open(key_file, "rb") as file:
+        encrypted_data = file.read()
+    return decrypt_bytes(encrypted_data, key)
+
+# Durable Writes
+# Files are never rewritten in place. They are written to a temporary file next to them, which then
+# replaces them with os.replace, so a crash in the middle of a save leaves the old file as it was.
+# DURABILITY sets how sure a finished save is to survive a power cut, trading safety for speed:
+#   - 'none': the operating system writes the data to disk when it sees fit
+#   - 'fsync-file': every file is flushed to disk (fsync) before it replaces the old one, and every journal append is fsynced
+#   - 'fsync-dir': the directory is fsynced too, so the rename or the new journal itself is on disk
+DURABILITY = 'fsync-file'
+DURABILITY_LEVELS = ('none', 'fsync-file', 'fsync-dir')
+TEMP_SUFFIX = '.tmp'
+
+# Flushes an open file to disk, unless durability is 'none'
+def sync_file(file, durability=None):
+    if (durability or DURABILITY) != 'none':
+        file.flush()
+        os.fsync(file.fileno())
+
+# Flushes the directory entries of the directory holding a path to disk, if durability is 'fsync-dir'
+def sync_directory(path, durability=None):
+    if (durability or DURABILITY) != 'fsync-dir':
+        return
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # Directories cannot be opened (and need no fsync) on Windows
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+@contextlib.contextmanager
+def atomic_write(path, durability=None):
+    """
+    Opens a temporary file to write in place of a file. When the with block ends, the temporary file
+    is synced as set by the durability level and replaces the file. If the block raises, the file is left untouched.
+
+    Args:
+        path (str): The path of the file to be replaced.
+        durability (str): 'none', 'fsync-file' or 'fsync-dir'. Defaults to DURABILITY.
+
+    Yields:
+        file: The temporary file, opened for writing bytes.
+    """
+    temp_path = path + TEMP_SUFFIX
+    try:
+        with open(temp_path, "wb") as file:
+            yield file
+            sync_file(file, durability)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    sync_directory(path, durability)
+
+class DataFileError(Exception):
+    """
+    Raised when a data file or journal exists but cannot be read, e.g. it is damaged or was encrypted with
+    another key. The file is left untouched, so nothing is lost by stopping.
+    """
+
+class StorageError(Exception):
+    """
+    Raised by a flush when the changes could not be saved, e.g. the disk is full. Nothing of the flush is
+    committed (files already written keep their old or their new records whole), and the changes stay in memory
+    as dirty records, so the next flush saves them again.
+    """
+
+# Chunked Files
+# Large files are written as a header line, naming the serializer the data was saved with, followed by one
+# Fernet token per line, each token encrypting at most CHUNK_SIZE bytes. Every chunk is authenticated on its own and starts with its index and a flag
+# marking the last chunk, so missing, reordered or cut off chunks are detected. Files are written and read
+# one chunk at a time, so memory use does not grow with the size of the file.
+CHUNKED_FILE_HEADER = b"LIBRARY-CHUNKED-1"
+CHUNK_SIZE = 64 * 1024
+CHUNK_PREFIX = struct.Struct('>QB')  # chunk index, 1 if it is the last chunk
+
+def write_chunks(key_file, pieces, cipher=None, serializer=None):
+    """
+    Encrypts a stream of bytes in chunks of CHUNK_SIZE and writes it to a chunked file.
+    The file is replaced atomically (see atomic_write), so it holds either the old or the new data.
+
+    Args:
+        key_file (str): The path to the file to be written.
+        pieces (iterable): The bytes to be written, in pieces of any size.
+        cipher (Cipher): The cipher to encrypt with. Defaults to the cipher of the key from get_key.
+        serializer (str): The name of the serializer of the data, recorded in the header (see file_serializer).
+    """
+    cipher = get_cipher(cipher)
+    with atomic_write(key_file) as file:
+        file.write(CHUNKED_FILE_HEADER + (b" " + serializer.encode() if serializer else b"") + b"\n")
+        buffer = bytearray()
+        index = 0
+        for piece in pieces:
+            buffer += piece
+            while len(buffer) >= CHUNK_SIZE:
+                file.write(cipher.encrypt(CHUNK_PREFIX.pack(index, 0) + buffer[:CHUNK_SIZE]) + b"\n")
+                del buffer[:CHUNK_SIZE]
+                index += 1
+        file.write(cipher.encrypt(CHUNK_PREFIX.pack(index, 1) + buffer) + b"\n")
+
+def read_chunks(key_file, cipher=None):
+    """
+    Reads and decrypts a chunked file one chunk at a time.
+
+    Args:
+        key_file (str): The path to the file to be read.
+        cipher (Cipher): The cipher to decrypt with. Defaults to the cipher of the key from get_key.
+
+    Yields:
+        bytes: The decrypted chunks, in order.
+
+    Raises:
+        ValueError: If the file is not a chunked file, or chunks are missing or out of order.
+    """
+    cipher = get_cipher(cipher)
+    with open(key_file, "rb") as file:
+        if file.readline().split()[:1] != [CHUNKED_FILE_HEADER]:
+            raise ValueError(f"{key_file} is not a chunked file")
+        expected_index = 0
+        for line in file:
+            chunk = cipher.decrypt(line.rstrip(b"\n"))
+            index, last = CHUNK_PREFIX.unpack_from(chunk)
+            if index != expected_index:
+                raise ValueError(f"{key_file} has missing or reordered chunks")
+            yield chunk[CHUNK_PREFIX.size:]
+            if last:
+                return
+            expected_index += 1
+    raise ValueError(f"{key_file} ends before its last chunk")
+
+# Checks whether a file was written by write_chunks
+def is_chunked_file(key_file):
+    with open(key_file, "rb") as file:
+        return file.read(len(CHUNKED_FILE_HEADER)) == CHUNKED_FILE_HEADER
+
+# Returns the name of the serializer recorded in the header of a chunked file, or None if the file does not
+# exist or does not name one (files saved whole, or chunked files saved before the header named it)
+def file_serializer(key_file):
+    try:
+        with open(key_file, "rb") as file:
+            header = file.readline(len(CHUNKED_FILE_HEADER) + 64).split()
+    except FileNotFoundError:
+        return None
+    if len(header) == 2 and header[0] == CHUNKED_FILE_HEADER and header[1].decode(errors='replace') in SERIALIZERS:
+        return header[1].decode()
+    return None
+
+# Serialization Module
+# Every serialized payload starts with a one byte tag naming its format, so files written in different
+# formats (including the str() dictionaries written by older versions) can all be loaded without eval.
+
+def pack_value(value, out):
+    """
+    Appends the msgpack encoding of a value to a bytearray.
+    Only the types stored by the system are supported: None, booleans, integers, floats, strings, lists, tuples,
+    dictionaries and records (packed as dictionaries).
+
+    Args:
+        value: The value to be packed.
+        out (bytearray): The buffer the encoded value is appended to.
+    """
+    if value is None:
+        out.append(0xc0)
+    elif value is True:
+        out.append(0xc3)
+    elif value is False:
+        out.append(0xc2)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -0x20 <= value < 0:
+            out.append(value & 0xff)
+        else:
+            out += b'\xd3' + struct.pack('>q', value)
+    elif isinstance(value, float):
+        out += b'\xcb' + struct.pack('>d', value)
+    elif isinstance(value, str):
+        encoded = value.encode()
+        size = len(encoded)
+        if size < 0x20:
+            out.append(0xa0 | size)
+        elif size < 0x100:
+            out += b'\xd9' + struct.pack('>B', size)
+        elif size < 0x10000:
+            out += b'\xda' + struct.pack('>H', size)
+        else:
+            out += b'\xdb' + struct.pack('>I', size)
+        out += encoded
+    elif isinstance(value, (list, tuple)):
+        size = len(value)
+        if size < 0x10:
+            out.append(0x90 | size)
+        elif size < 0x10000:
+            out += b'\xdc' + struct.pack('>H', size)
+        else:
+            out += b'\xdd' + struct.pack('>I', size)
+        for item in value:
+            pack_value(item, out)
+    elif isinstance(value, Record):
+        pack_value(value.to_dict(), out)
+    elif isinstance(value, dict):
+        size = len(value)
+        if size < 0x10:
+            out.append(0x80 | size)
+        elif size < 0x10000:
+            out += b'\xde' + struct.pack('>H', size)
+        else:
+            out += b'\xdf' + struct.pack('>I', size)
+        for item_key, item in value.items():
+            pack_value(item_key, out)
+            pack_value(item, out)
+    else:
+        raise TypeError(f"Cannot serialize value of type {type(value).__name__}")
+
+# Formats of the msgpack types of a fixed size: unsigned and signed integers, and floats
+MSGPACK_NUMBERS = {code: struct.Struct(number_format) for code, number_format in (
+    (0xcc, '>B'), (0xcd, '>H'), (0xce, '>I'), (0xcf, '>Q'),
+    (0xd0, '>b'), (0xd1, '>h'), (0xd2, '>i'), (0xd3, '>q'),
+    (0xca, '>f'), (0xcb, '>d'))}
+# Formats of the sizes of the msgpack strings, binaries, arrays and maps that are not fixed-size
+MSGPACK_SIZES = {code: struct.Struct(size_format) for code, size_format in (
+    (0xd9, '>B'), (0xda, '>H'), (0xdb, '>I'),  # str 8/16/32
+    (0xc4, '>B'), (0xc5, '>H'), (0xc6, '>I'),  # bin 8/16/32
+    (0xdc, '>H'), (0xdd, '>I'),  # array 16/32
+    (0xde, '>H'), (0xdf, '>I'))}  # map 16/32
+
+def unpack_value(data, position):
+    """
+    Decodes one msgpack value from a bytes object.
+    Every msgpack type but the extension types is decoded, so data packed by the msgpack package
+    (which picks the smallest integer and size types) can be read without it.
+
+    Args:
+        data (bytes): The encoded data.
+        position (int): The index where the value starts.
+
+    Returns:
+        tuple: The decoded value and the index right after it.
+    """
+    code = data[position]
+    position += 1
+    if code < 0x80:
+        return code, position
+    if code >= 0xe0:
+        return code - 0x100, position
+    if 0xa0 <= code <= 0xbf:
+        size = code & 0x1f
+        return data[position:position + size].decode(), position + size
+    if 0x90 <= code <= 0x9f:
+        return unpack_items(data, position, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return unpack_pairs(data, position, code & 0x0f)
+    if code == 0xc0:
+        return None, position
+    if code == 0xc2:
+        return False, position
+    if code == 0xc3:
+        return True, position
+    if code in MSGPACK_NUMBERS:
+        number = MSGPACK_NUMBERS[code]
+        return number.unpack_from(data, position)[0], position + number.size
+    if code in MSGPACK_SIZES:
+        size_format = MSGPACK_SIZES[code]
+        size = size_format.unpack_from(data, position)[0]
+        position += size_format.size
+        if code in (0xd9, 0xda, 0xdb):
+            return data[position:position + size].decode(), position + size
+        if code in (0xc4, 0xc5, 0xc6):
+            return bytes(data[position:position + size]), position + size
+        if code in (0xdc, 0xdd):
+            return unpack_items(data, position, size)
+        return unpack_pairs(data, position, size)
+    raise ValueError(f"Unsupported msgpack type code {code:#x}")
+
+# Decodes the items of a msgpack array
+def unpack_items(data, position, size):
+    items = []
+    for _ in range(size):
+        item, position = unpack_value(data, position)
+        items.append(item)
+    return items, position
+
+# Decodes the key and value pairs of a msgpack map
+def unpack_pairs(data, position, size):
+    pairs = {}
+    for _ in range(size):
+        item_key, position = unpack_value(data, position)
+        pairs[item_key], position = unpack_value(data, position)
+    return pairs, position
+
+# Packs a single value into msgpack bytes, using the msgpack package when it is installed
+def packb(value):
+    if msgpack is not None:
+        return msgpack.packb(value, default=encode_record)
+    out = bytearray()
+    pack_value(value, out)
+    return bytes(out)
+
+# Unpacks a single value from msgpack bytes, using the msgpack package when it is installed
+def unpackb(data):
+    if msgpack is not None:
+        return msgpack.unpackb(data, strict_map_key=False)
+    return unpack_value(data, 0)[0]
+
+class JSONSerializer:
+    """
+    Serializes data with the standard library json module.
+    """
+    name = 'json'
+    tag = b'J'
+    stream_tag = b'L'  # Streams are written as JSON lines, one [key, value] record per line
+
+    def dump_data(self, data):
+        return json.dumps(data, separators=(',', ':'), default=encode_record).encode()
+
+    def dump_stream(self, data):
+        for record_id, record in data.items():
+            yield json.dumps([record_id, record], separators=(',', ':'), default=encode_record).encode() + b"\n"
+
+    def load_stream(self, chunks):
+        buffer = b''
+        for chunk in chunks:
+            lines = (buffer + chunk).split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                if line:
+                    yield tuple(json.loads(line))
+        if buffer.strip():
+            yield tuple(json.loads(buffer))
+
+    def load_data(self, payload):
+        return json.loads(payload)
+
+    def dump_record(self, record):
+        return self.dump_data(record)
+
+    def load_record(self, payload):
+        return self.load_data(payload)
+
+class BinarySerializer:
+    """
+    Serializes a dictionary as a sequence of length-prefixed msgpack records.
+    Each record is a [key, value] pair preceded by its size as a 4-byte big-endian integer.
+    """
+    name = 'binary'
+    tag = b'M'
+    stream_tag = b'M'  # A stream is the same sequence of records
+
+    def dump_data(self, data):
+        return b''.join(self.dump_stream(data))
+
+    def load_data(self, payload):
+        return dict(self.load_stream([payload]))
+
+    def dump_stream(self, data):
+        for record_id, record in data.items():
+            packed = packb([record_id, record])
+            yield struct.pack('>I', len(packed)) + packed
+
+    def load_stream(self, chunks):
+        buffer = b''
+        for chunk in chunks:
+            buffer = buffer + chunk if buffer else chunk
+            position = 0
+            while len(buffer) - position >= 4:
+                size = struct.unpack_from('>I', buffer, position)[0]
+                start = position + 4
+                if len(buffer) - start < size:
+                    break
+                yield tuple(unpackb(buffer[start:start + size]))
+                position = start + size
+            buffer = buffer[position:]
+        if buffer:
+            raise ValueError("Data ends in the middle of a record")
+
+    def dump_record(self, record):
+        return packb(record)
+
+    def load_record(self, payload):
+        return unpackb(payload)
+
+SERIALIZERS = {serializer.name: serializer for serializer in (JSONSerializer(), BinarySerializer())}
+SERIALIZERS_BY_TAG = {serializer.tag: serializer for serializer in SERIALIZERS.values()}
+SERIALIZERS_BY_STREAM_TAG = {serializer.stream_tag: serializer for serializer in SERIALIZERS.values()}
+
+# Serializer used when saving: 'json' or 'binary'. None saves each data file (and its journal) with the serializer
+# it was last saved with, as recorded in its header, and new files with DEFAULT_SERIALIZER. Set with --serializer.
+SERIALIZER = None
+DEFAULT_SERIALIZER = 'json'
+
+def serialize(data, serializer=None, record=False):
+    """
+    Serializes a dictionary (or a single journal record) into tagged bytes.
+
+    Args:
+        data: The dictionary or record to be serialized.
+        serializer (str): The name of the serializer to use. Defaults to SERIALIZER, or DEFAULT_SERIALIZER.
+        record (bool): Whether data is a single journal record rather than a whole dictionary.
+
+    Returns:
+        bytes: The format tag followed by the serialized data.
+    """
+    chosen = SERIALIZERS[serializer or SERIALIZER or DEFAULT_SERIALIZER]
+    body = chosen.dump_record(data) if record else chosen.dump_data(data)
+    return chosen.tag + body
+
+def deserialize(payload, record=False):
+    """
+    Deserializes tagged bytes written by serialize.
+    Payloads without a known tag were written with str() by older versions and are read with ast.literal_eval,
+    which only accepts literals and never runs code.
+
+    Args:
+        payload (bytes): The serialized data.
+        record (bool): Whether payload is a single journal record rather than a whole dictionary.
+
+    Returns:
+        The deserialized dictionary or record.
+    """
+    chosen = SERIALIZERS_BY_TAG.get(payload[:1])
+    if chosen is None:
+        return ast.literal_eval(payload.decode())
+    body = payload[1:]
+    return chosen.load_record(body) if record else chosen.load_data(body)
+
+def serialize_stream(data, serializer=None):
+    """
+    Serializes a dictionary one record at a time.
+
+    Args:
+        data (dict): The dictionary to be serialized.
+        serializer (str): The name of the serializer to use. Defaults to SERIALIZER, or DEFAULT_SERIALIZER.
+
+    Yields:
+        bytes: The stream tag of the format, then the serialized records.
+    """
+    chosen = SERIALIZERS[serializer or SERIALIZER or DEFAULT_SERIALIZER]
+    yield chosen.stream_tag
+    yield from chosen.dump_stream(data)
+
+def deserialize_stream(chunks):
+    """
+    Deserializes a stream written by serialize_stream, reading it one chunk at a time.
+
+    Args:
+        chunks (iterable): The serialized bytes, in chunks of any size.
+
+    Yields:
+        tuple: The (key, value) records, in order.
+    """
+    chunks = iter(chunks)
+    first = b''
+    while not first:
+        first = next(chunks, None)
+        if first is None:
+            return
+    chosen = SERIALIZERS_BY_STREAM_TAG[first[:1]]
+    yield from chosen.load_stream(itertools.chain([first[1:]], chunks))
+
+# Constants for file paths
+ENCRYPTED_BOOKS_FILE = 'books.txt'
+ENCRYPTED_BORROW_LIST_FILE = 'borrow_list.txt'
+ENCRYPTED_LOGBOOK_FILE = 'logbook.txt'
+
+# Storage mode: 'snapshot' rewrites the whole encrypted file on every save, while 'journal'
+# appends every changed record to an encrypted journal next to the file (e.g. books.txt.journal)
+# and compacts the journal into a new snapshot once it gets long enough
+STORAGE_MODE = 'journal'
+JOURNAL_SUFFIX = '.journal'
+# A journal is compacted once it is this fraction of the size of its snapshot (and at least JOURNAL_COMPACT_MIN_BYTES),
+# so the snapshot is rewritten once per that many bytes of changes and the cost of a save stays constant on average
+JOURNAL_COMPACT_RATIO = 0.5
+JOURNAL_COMPACT_MIN_BYTES = 256 * 1024
+
+# Generates or loads encryption key (on first use, so importing this module does not touch any file)
+key_file = "encryption_key.key"
+key = None
+
+def get_key():
+    """
+    Returns the encryption key, loading it from key_file the first time it is needed.
+    If the key file is not present yet, a new key is generated and saved.
+
+    Returns:
+        bytes: The encryption key.
+    """
+    global key
+    if key is None:
+        try:
+            key = load_key(key_file)
+        except FileNotFoundError:
+            key = generate_key()
+            save_key(key, key_file)
+    return key
+
+# Modify the function to encrypt data before saving
+def save_data(data, key_file, serializer=None, cipher=None):
+    """
+    Encrypts and saves data from the dictionary to the specified file.
+    The records are serialized and encrypted as a stream into a chunked file, so no full copy of the data is built in memory.
+    Writing a full snapshot also compacts the file's journal, since the snapshot already holds every change in it.
+
+    Args:
+        data (dict): The data to be saved.
+        key_file (str): The path to the file where encrypted data is to be saved.
+        serializer (str): The name of the serializer to use. Defaults to SERIALIZER, or else to the serializer
+            the file was last saved with (DEFAULT_SERIALIZER for a new file).
+        cipher (Cipher): The cipher to encrypt with. Defaults to the cipher of the key from get_key.
+
+    Raises:
+        OSError: If the file cannot be written. The file is left as it was.
+    """
+    serializer = serializer or SERIALIZER or file_serializer(key_file) or DEFAULT_SERIALIZER
+    write_chunks(key_file, serialize_stream(data, serializer), cipher, serializer)
+    try:
+        os.remove(journal_path(key_file))
+    except FileNotFoundError:
+        pass
+
+# Returns the path of the journal that belongs to a data file
+def journal_path(key_file):
+    return key_file + JOURNAL_SUFFIX
+
+# Returns the size of a file, or 0 if it does not exist
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# Encrypts journal records and appends them to the journal of a file in a single write, synced as set by DURABILITY.
+# If the write fails (e.g. the disk is full) the part already written is cut off again, so the journal
+# still ends with a complete record and the next append starts on a clean line.
+def append_to_journal(records, key_file, cipher=None, serializer=None):
+    encrypted_records = get_cipher(cipher).encrypt_many([serialize(record, serializer, record=True) for record in records])
+    content = memoryview(b"".join(encrypted_record + b"\n" for encrypted_record in encrypted_records))
+    path = journal_path(key_file)
+    created = not os.path.exists(path)
+    with open(path, "ab", buffering=0) as file:
+        end = file.seek(0, os.SEEK_END)
+        try:
+            while content:
+                content = content[file.write(content):]
+            sync_file(file)
+        except BaseException:
+            file.truncate(end)
+            raise
+    if created:
+        sync_directory(path)
+
+# Loads and decrypts every record in the journal of a file
+def load_journal(key_file, cipher=None, repair=False):
+    """
+    Loads and decrypts the records appended to the journal of the specified file, oldest first.
+    Each line of the journal is one encrypted record ended by a newline. A last line without its newline was only
+    partly written (e.g. the program was closed in the middle of a save) and is ignored; with repair it is also
+    cut off the journal, so later appends start on a clean line.
+
+    Args:
+        key_file (str): The path to the data file whose journal is to be loaded.
+        cipher (Cipher): The cipher to decrypt with. Defaults to the cipher of the key from get_key.
+        repair (bool): Cut a partly written last line off the journal. Only the owner of the file should repair it.
+
+    Returns:
+        list: The journal records as (operation, record ID, record) tuples.
+
+    Raises:
+        DataFileError: If a complete record cannot be decrypted. The journal is left untouched.
+    """
+    path = journal_path(key_file)
+    try:
+        with open(path, "rb") as file:
+            content = file.read()
+    except FileNotFoundError:
+        return []
+    end = content.rfind(b"\n") + 1  # Offset just after the last complete line
+    lines = [line for line in content[:end].split(b"\n") if line.strip()]
+    cipher = get_cipher(cipher)
+    try:
+        payloads = cipher.decrypt_many(lines)
+    except Exception:
+        # Decrypt one by one to find the damaged record
+        for number, line in enumerate(lines, start=1):
+            try:
+                cipher.decrypt(line)
+            except Exception:
+                break
+        raise DataFileError(f"{path} is damaged at record {number} of {len(lines)} (or was saved with another encryption key). "
+                            f"It was left untouched; restore it from a backup, or remove it to drop its changes.")
+    if content[end:].strip() and repair:
+        print(f"Dropping the last record of {path}, which was not completely saved.")
+        with open(path, "r+b") as file:
+            file.truncate(end)
+            sync_file(file)
+    return [deserialize(payload, record=True) for payload in payloads]
+
+def save_record(data, key_file, record_id, cipher=None):
+    """
+    Saves a single record of the dictionary that was added, changed or deleted.
+    In journal mode only that record is encrypted and appended to the file's journal, so the cost of a save
+    depends on the size of the change and not on the size of the whole dictionary. Once the journal grows to
+    JOURNAL_COMPACT_RATIO of the size of the snapshot it is compacted into a new snapshot, so the save that
+    compacts takes as long as a snapshot save but, on average, a save costs the same however big the dictionary is.
+    In snapshot mode the whole dictionary is saved with save_data.
+
+    Args:
+        data (dict): The dictionary the record belongs to.
+        key_file (str): The path to the file where encrypted data is to be saved.
+        record_id (str): The ID of the record that changed. If it is no longer in data, the record is saved as deleted.
+        cipher (Cipher): The cipher to encrypt with. Defaults to the cipher of the key from get_key.
+    """
+    save_records(data, key_file, [record_id], cipher)
+
+def save_records(data, key_file, record_ids, cipher=None):
+    """
+    Saves several records of the dictionary that were added, changed or deleted, as save_record does for one.
+    In journal mode the records are appended to the journal with a single write.
+
+    Args:
+        data (dict): The dictionary the records belong to.
+        key_file (str): The path to the file where encrypted data is to be saved.
+        record_ids (list): The IDs of the records that changed.
+        cipher (Cipher): The cipher to encrypt with. Defaults to the cipher of the key from get_key.
+
+    Raises:
+        OSError: If the records cannot be written. The records are then not saved, and can be saved again.
+    """
+    if STORAGE_MODE != 'journal':
+        save_data(data, key_file, cipher=cipher)
+        return
+    records = [('set', record_id, data[record_id]) if record_id in data else ('delete', record_id, None)
+               for record_id in record_ids]
+    append_to_journal(records, key_file, cipher, SERIALIZER or file_serializer(key_file))
+    if file_size(journal_path(key_file)) >= max(JOURNAL_COMPACT_MIN_BYTES, JOURNAL_COMPACT_RATIO * file_size(key_file)):
+        save_data(data, key_file, cipher=cipher)
+
+def iter_snapshot(key_file, cipher=None):
+    """
+    Streams the records of the snapshot saved in a data file, without its journal.
+    Chunked files are read one chunk at a time; files saved whole by older versions are decrypted at once.
+
+    Args:
+        key_file (str): The path to the data file.
+        cipher (Cipher): The cipher to decrypt with. Defaults to the cipher of the key from get_key.
+
+    Returns:
+        iterable: The (record ID, record) pairs of the snapshot.
+    """
+    if is_chunked_file(key_file):
+        return deserialize_stream(read_chunks(key_file, cipher))
+    return deserialize(load_and_decrypt_bytes(key_file, get_cipher(cipher))).items()
+
+def iter_data(key_file, cipher=None):
+    """
+    Streams the records of a data file with its journal applied, yielding the same records in the same order
+    as load_data would load them, while holding only the journal and one chunk of the snapshot in memory.
+
+    Args:
+        key_file (str): The path to the data file.
+        cipher (Cipher): The cipher to decrypt with. Defaults to the cipher of the key from get_key.
+
+    Yields:
+        tuple: The (record ID, record) pairs.
+    """
+    # Final state of every record the journal touched (None if deleted), in the order load_data would leave them
+    changes = {}
+    moved = set()  # Records deleted at some point, which load_data moves after the snapshot's records
+    for operation, record_id, record in load_journal(key_file, cipher):
+        if operation == 'set' and changes.get(record_id, 0) is not None:
+            changes[record_id] = record
+        else:
+            changes.pop(record_id, None)
+            changes[record_id] = record if operation == 'set' else None
+            moved.add(record_id)
+    try:
+        snapshot = iter_snapshot(key_file, cipher)
+    except FileNotFoundError:
+        snapshot = ()
+    for record_id, record in snapshot:
+        if record_id not in changes:
+            yield record_id, record
+        elif record_id not in moved:
+            yield record_id, changes.pop(record_id)
+    for record_id, record in changes.items():
+        if record is not None:
+            yield record_id, record
+
+# Modify the functions to encrypt and decrypt data before saving and loading
+def load_data(key_file, cipher=None, record_type=None, repair=False):
+    """
+    Loads and decrypts data from the specified file into a dictionary, then replays the file's journal on top of it.
+    If the file is not found, an empty dictionary is returned.
+
+    Args:
+        key_file (str): The path to the file from which data is to be loaded.
+        cipher (Cipher): The cipher to decrypt with. Defaults to the cipher of the key from get_key.
+        record_type (type): The Record class to turn each record into as it is read. Defaults to keeping the dictionaries.
+        repair (bool): Cut a partly written last record off the file's journal (see load_journal).
+
+    Returns:
+        dict: A dictionary containing the decrypted data loaded from the file or an empty dictionary if file is not found.
+
+    Raises:
+        DataFileError: If the file exists but cannot be decrypted or read. It is not replaced by an empty file.
+    """
+    try:
+        if record_type is None:
+            data = dict(iter_snapshot(key_file, cipher))
+        else:
+            data = {record_id: record_type.from_dict(record) for record_id, record in iter_snapshot(key_file, cipher)}
+    except FileNotFoundError:
+        print("--------CREATING FILE--------")
+        data = {}
+    except Exception as e:
+        raise DataFileError(f"{key_file} could not be read ({type(e).__name__}: it is damaged or was saved with another "
+                            f"encryption key). It was left untouched; restore it from a backup, or remove it to start over.") from e
+    journal = load_journal(key_file, cipher, repair)
+    for operation, record_id, record in journal:
+        if operation == 'set':
+            data[record_id] = record if record_type is None else record_type.from_dict(record)
+        else:
+            data.pop(record_id, None)
+    return data
+
+# Records Module
+# Books, borrow entries and log entries are kept in memory as compact records rather than dictionaries.
+# A record stores its fields in __slots__ and shares every repeated value: statuses and purposes are the
+# constants below, names, times and authors are interned, and dates are stored as ordinals shared by every
+# record on the same day. Records still behave like the dictionaries they replace: record['Date'] returns
+# the date string, record['Status'] = ... sets a field, and dict(record) gives the original dictionary.
+
+class Status:
+    """
+    Statuses of a book.
+    """
+    AVAILABLE = 'Available'
+    UNAVAILABLE = 'Unavailable'
+
+class Purpose:
+    """
+    Purposes of a log entry.
+    """
+    VISIT = 'visit'
+    BORROW = 'borrow'
+    RETURN = 'return'
+
+# Value stored in records for each date string, and the date string of each ordinal stored
+date_values = {}
+date_strings = {}
+MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+def pack_date(date_str):
+    """
+    Returns the value a record stores for a date string: its ordinal if the date is written the usual way
+    ('9 Jan 2020'), so the string can be rebuilt from it, or else the string itself (e.g. '09 Jan 2020'), interned.
+    Values are cached, so every record with the same date shares one object.
+    """
+    value = date_values.get(date_str)
+    if value is None:
+        ordinal = date_to_ordinal(date_str)
+        if ordinal is not None and format_date(ordinal) != date_str:
+            ordinal = None
+        if ordinal is None:
+            value = sys.intern(date_str)
+        else:
+            value = ordinal
+            date_strings[ordinal] = date_str
+        date_values[date_str] = value
+    return value
+
+# Writes a date ordinal the usual way, e.g. '9 Jan 2020'
+def format_date(ordinal):
+    date = datetime.date.fromordinal(ordinal)
+    return f'{date.day} {MONTH_NAMES[date.month - 1]} {date.year}'
+
+# Returns the date string of a value returned by pack_date
+def unpack_date(value):
+    return date_strings[value] if type(value) is int else value
+
+# Builds a property that reads and writes a date string stored in a slot by pack_date
+def date_property(slot):
+    return property(lambda self: unpack_date(getattr(self, slot)),
+                    lambda self, date_str: setattr(self, slot, pack_date(date_str)))
+
+# Returns the record of a value that is neither a dictionary nor a record, for json.dumps and msgpack
+def encode_record(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Cannot serialize value of type {type(value).__name__}")
+
+class Record(collections.abc.Mapping):
+    """
+    Base class of the records. FIELDS maps each key of the original dictionary to the attribute holding it,
+    in the order of the constructor's arguments, and DATES maps each date key to the slot holding its packed value.
+    """
+    __slots__ = ()
+    FIELDS = {}
+    DATES = {}
+
+    @classmethod
+    def from_dict(cls, record):
+        """
+        Builds a record from a dictionary with the original keys (a record is returned as it is).
+        """
+        if isinstance(record, cls):
+            return record
+        return cls(*[record[key] for key in cls.FIELDS])
+
+    def __getitem__(self, key):
+        try:
+            attribute = self.FIELDS[key]
+        except KeyError:
+            raise KeyError(key) from None
+        return getattr(self, attribute)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, self.FIELDS[key], value)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self):
+        """
+        Returns the record as a dictionary with the original keys.
+        """
+        return {key: getattr(self, attribute) for key, attribute in self.FIELDS.items()}
+
+    def ordinal(self, key):
+        """
+        Returns the ordinal of a date field without parsing it again, or None if the date is not valid.
+        """
+        value = getattr(self, self.DATES[key])
+        return value if type(value) is int else date_to_ordinal(value)
+
+class Book(Record):
+    """
+    A book of the library inventory (a record of books).
+    """
+    __slots__ = ('title', 'author', 'published', 'status', 'borrowers')
+    FIELDS = {'Title': 'title', 'Author': 'author', 'Date Published': 'date_published', 'Status': 'status',
+              'List of Borrowers': 'borrowers'}
+    DATES = {'Date Published': 'published'}
+    date_published = date_property('published')
+
+    def __init__(self, title, author, date_published, status=Status.AVAILABLE, borrowers=None):
+        self.title = title
+        self.author = sys.intern(author)
+        self.published = pack_date(date_published)
+        self.status = sys.intern(status)
+        self.borrowers = [] if borrowers is None else borrowers  # Log_IDs of the borrows of the book
+
+class BorrowEntry(Record):
+    """
+    A loan of a book (a record of borrow_list).
+    """
+    __slots__ = ('book_id', 'log_id', 'returned')
+    FIELDS = {'Book_ID': 'book_id', 'Log_ID': 'log_id', 'Date Return': 'date_return'}
+    DATES = {'Date Return': 'returned'}
+    date_return = date_property('returned')
+
+    def __init__(self, book_id, log_id, date_return):
+        self.book_id = book_id
+        self.log_id = log_id
+        self.returned = pack_date(date_return)
+
+class LogEntry(Record):
+    """
+    A visit, borrow or return (a record of logbook).
+    """
+    __slots__ = ('person_name', 'day', 'time', 'purpose')
+    FIELDS = {'Person Name': 'person_name', 'Date': 'date', 'Time': 'time', 'Purpose': 'purpose'}
+    DATES = {'Date': 'day'}
+    date = date_property('day')
+
+    def __init__(self, person_name, date, time, purpose):
+        self.person_name = sys.intern(person_name)
+        self.day = pack_date(date)
+        self.time = sys.intern(time)
+        self.purpose = sys.intern(purpose)
+
+# Record type of each dictionary
+RECORD_TYPES = {'books': Book, 'borrow_list': BorrowEntry, 'logbook': LogEntry}
+
+# Storage Backends
+# The dictionaries are kept in memory and saved through a storage backend:
+#   - 'files': one encrypted file per dictionary (books.txt, borrow_list.txt, logbook.txt), saved as set by STORAGE_MODE
+#   - 'sqlite': a SQLite database with a table per dictionary, where only Person Name is encrypted
+STORAGE_BACKEND = 'files'
+SQLITE_FILE = 'library.db'
+
+# Names of the dictionaries and the encrypted files of the 'files' backend
+DATA_FILES = {
+    'books': ENCRYPTED_BOOKS_FILE,
+    'borrow_list': ENCRYPTED_BORROW_LIST_FILE,
+    'logbook': ENCRYPTED_LOGBOOK_FILE
+}
+
+class StorageBackend:
+    """
+    Base class of the storage backends.
+    A backend loads and saves whole dictionaries or single records, and answers the queries of the view_* reports.
+    The queries below answer from the in-memory dictionaries and indexes; backends that can run them
+    where the data is stored override them. Every query returns a list of rows (dictionaries) ready to be displayed.
+    """
+    name = None
+
+    def load(self, name):
+        raise NotImplementedError
+
+    def save(self, name, data):
+        raise NotImplementedError
+
+    def save_record(self, name, data, record_id):
+        raise NotImplementedError
+
+    def save_records(self, name, data, record_ids):
+        """
+        Saves many added or changed records of a dictionary at once, e.g. after a bulk import.
+        """
+        with self.transaction():
+            for record_id in record_ids:
+                self.save_record(name, data, record_id)
+
+    def iter_records(self, name):
+        """
+        Streams the (record ID, record) pairs of a dictionary straight from storage, without loading it in memory.
+        """
+        raise NotImplementedError
+
+    def load_counters(self):
+        """
+        Returns the saved ID counters of the IdAllocator (dictionary name -> first number not handed out yet).
+        """
+        raise NotImplementedError
+
+    def save_counters(self, counters):
+        raise NotImplementedError
+
+    def load_stats(self):
+        """
+        Returns the saved circulation counters, keyed as in CirculationStats ('borrows:B12' -> 3), or {} if none are saved.
+        """
+        raise NotImplementedError
+
+    def save_stats(self, stats, keys=None):
+        """
+        Saves the changed circulation counters, or all of them if no keys are given.
+        Keys that are no longer in stats are saved as deleted.
+        """
+        raise NotImplementedError
+
+    def transaction(self):
+        """
+        Groups the saves made inside a with block so the backend can commit them together.
+        """
+        return contextlib.nullcontext()
+
+    def pending_books(self):
+        """
+        Returns the unavailable books, each with the borrow entry of its last borrower.
+        Borrow_ID is None when that entry is missing and Last Borrower Log_ID is None when the book has no borrowers.
+        """
+        rows = []
+        for book_id in book_index.with_status(Status.UNAVAILABLE):
+            book = books[book_id]
+            row = {
+                'Book_ID': book_id,
+                'Title': book['Title'],
+                'Author': book['Author'],
+                'Date Published': book['Date Published'],
+                'Status': book['Status'],
+                'Last Borrower Log_ID': None,
+                'Borrow_ID': None,
+                'Date Return': None,
+                'Last Borrower': None
+            }
+            if book['List of Borrowers']:
+                last_borrower_id = book['List of Borrowers'][-1]
+                row['Last Borrower Log_ID'] = last_borrower_id
+                row['Borrow_ID'] = book_index.borrow_of_log(last_borrower_id)
+                if row['Borrow_ID']:
+                    row['Date Return'] = borrow_list[row['Borrow_ID']].get('Date Return')
+                    row['Last Borrower'] = logbook[last_borrower_id]['Person Name']
+            rows.append(row)
+        return rows
+
+    def borrow_entries(self, outstanding_only=False):
+        """
+        Returns all borrow entries, or only the entries of outstanding loans.
+        """
+        borrow_ids = book_index.outstanding_loans() if outstanding_only else borrow_list.keys()
+        return [self.borrow_row(borrow_id) for borrow_id in borrow_ids]
+
+    def returns_due(self, first, last):
+        """
+        Returns the borrow entries due from the first to the last date ordinal (both included), in date order.
+        """
+        return [self.borrow_row(borrow_id) for borrow_id in return_date_index.between(first, last)]
+
+    def overdue_loans(self, today):
+        """
+        Returns the outstanding loans that were due before the given date ordinal, in date order.
+        """
+        rows = []
+        for borrow_id in return_date_index.between(last=today - 1):
+            if book_index.open_loans.get(borrow_list[borrow_id]['Book_ID']) == borrow_id:
+                row = self.borrow_row(borrow_id)
+                row['Days Overdue'] = today - return_date_index.record_ordinals[borrow_id]
+                rows.append(row)
+        return rows
+
+    def transactions_on(self, ordinal):
+        """
+        Returns the log entries made on the given date ordinal.
+        """
+        return [dict(logbook[log_id], Log_ID=log_id) for log_id in log_date_index.on(ordinal)]
+
+    # Joins a borrow entry with its book and log entry
+    def borrow_row(self, borrow_id):
+        entry = borrow_list[borrow_id]
+        book = books[entry['Book_ID']]
+        return {
+            'Borrow_ID': borrow_id,
+            'Title': book['Title'],
+            'Author': book['Author'],
+            'Date Published': book['Date Published'],
+            'Status': book['Status'],
+            'Date Return': entry['Date Return'],
+            'Borrower': logbook[entry['Log_ID']]['Person Name']
+        }
+
+class FlatFileBackend(StorageBackend):
+    """
+    Stores each dictionary in its own encrypted file, saved as set by STORAGE_MODE.
+    Records saved in a transaction() block are written when the block ends, with one journal
+    append (or one snapshot) per file however many records were saved.
+    The circulation counters are written after the records they count, stamped with the sizes and times of the
+    files of those records (see stamp). Counters whose stamp does not match the files, e.g. after a crash between
+    the two writes, are not loaded, so they are counted again from the records.
+    """
+    name = 'files'
+
+    # Dictionaries the circulation counters are counted from (book statuses only change along with them)
+    STAMPED = ('borrow_list', 'logbook')
+
+    def __init__(self):
+        self.depth = 0  # How many transaction() blocks are open
+        self.pending = {}  # Dictionary name -> (dictionary, IDs of the records saved in the open transaction)
+        self.pending_stats = None  # (counters, keys) saved in the open transaction
+        self.stamp_stale = False  # Whether a stamped file was written since the counters were last stamped
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            # The in-memory dictionaries are already changed, so the saved records are written even after an error
+            if self.depth == 0:
+                pending, self.pending = self.pending, {}
+                try:
+                    for name, (data, record_ids) in pending.items():
+                        save_records(data, DATA_FILES[name], list(record_ids))
+                        self.stamp_stale = self.stamp_stale or name in self.STAMPED
+                    self.write_stats()
+                finally:
+                    self.pending_stats = None  # Saved again by the caller if the records could not be written
+
+    def stamp(self):
+        """
+        Returns the size and modification time of the snapshots, and the size of the journals, of the stamped files.
+        """
+        stamp = []
+        for name in self.STAMPED:
+            try:
+                snapshot = os.stat(DATA_FILES[name])
+                stamp.append([snapshot.st_size, snapshot.st_mtime_ns, file_size(journal_path(DATA_FILES[name]))])
+            except FileNotFoundError:
+                stamp.append(None)
+        return stamp
+
+    # Marks a stamped file as written, and writes the counters (or their new stamp) if no transaction is open
+    def written(self, name):
+        self.stamp_stale = self.stamp_stale or name in self.STAMPED
+        if not self.depth:
+            self.write_stats()
+
+    # Writes the counters saved in the transaction with the stamp of the files as they are now. If only
+    # the records changed (their counters did not), only the new stamp is appended to the counters' journal.
+    def write_stats(self):
+        pending, self.pending_stats = self.pending_stats, None
+        if pending is not None:
+            stats, keys = pending
+            stamped = collections.ChainMap({'stamp': self.stamp()}, stats)
+            if keys is None:
+                save_data(stamped, CIRCULATION_STATS_FILE)
+            else:
+                save_records(stamped, CIRCULATION_STATS_FILE, list(keys) + ['stamp'])
+        elif self.stamp_stale and os.path.exists(CIRCULATION_STATS_FILE):
+            append_to_journal([('set', 'stamp', self.stamp())], CIRCULATION_STATS_FILE)
+        self.stamp_stale = False
+
+    def load(self, name):
+        data = load_data(DATA_FILES[name], record_type=RECORD_TYPES[name], repair=True)
+        # Creates the file if not present yet
+        if not data and not os.path.exists(DATA_FILES[name]):
+            save_data({}, DATA_FILES[name])
+            self.written(name)
+        return data
+
+    def save(self, name, data):
+        self.pending.pop(name, None)  # The snapshot already holds the pending records
+        save_data(data, DATA_FILES[name])
+        self.written(name)
+
+    def save_record(self, name, data, record_id):
+        if self.depth:
+            # A record saved twice in the transaction is written once, as it is when the transaction ends
+            self.pending.setdefault(name, (data, {}))[1][record_id] = None
+        else:
+            save_record(data, DATA_FILES[name], record_id)
+            self.written(name)
+
+    def save_records(self, name, data, record_ids):
+        self.pending.pop(name, None)
+        # One snapshot costs less than journaling (and compacting) many records
+        save_data(data, DATA_FILES[name])
+        self.written(name)
+
+    def iter_records(self, name):
+        return iter_data(DATA_FILES[name])
+
+    def load_counters(self):
+        if not os.path.exists(ID_COUNTERS_FILE):
+            return {}
+        return load_data(ID_COUNTERS_FILE, repair=True)
+
+    def save_counters(self, counters):
+        save_data(counters, ID_COUNTERS_FILE)
+
+    def load_stats(self):
+        if not os.path.exists(CIRCULATION_STATS_FILE):
+            return {}
+        stats = load_data(CIRCULATION_STATS_FILE, repair=True)
+        if stats.pop('stamp', None) != self.stamp():
+            return {}  # Saved before (or without) the last records they count
+        return stats
+
+    def save_stats(self, stats, keys=None):
+        # Written with the stamp once the records are (see write_stats)
+        if keys is not None:
+            keys = list(keys)
+            if self.pending_stats is not None:
+                pending_keys = self.pending_stats[1]
+                keys = None if pending_keys is None else pending_keys + keys
+        self.pending_stats = (stats, keys)
+        if not self.depth:
+            self.write_stats()
+
+class SQLiteBackend(StorageBackend):
+    """
+    Stores the dictionaries in a SQLite database, one row per record, with indexes on the columns the reports query.
+    Only the Person Name of log entries is encrypted, field by field. Saves made in a transaction() block
+    are committed together, and the queries of the reports run as SQL.
+    """
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS books (
+            book_id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            date_published TEXT NOT NULL,
+            status TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS books_title_author ON books (title, author);
+        CREATE INDEX IF NOT EXISTS books_status ON books (status);
+        CREATE TABLE IF NOT EXISTS book_borrowers (
+            book_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            log_id TEXT NOT NULL,
+            PRIMARY KEY (book_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS borrows (
+            borrow_id TEXT PRIMARY KEY,
+            book_id TEXT NOT NULL,
+            log_id TEXT NOT NULL,
+            date_return TEXT NOT NULL,
+            date_return_ordinal INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS borrows_book ON borrows (book_id);
+        CREATE INDEX IF NOT EXISTS borrows_log ON borrows (log_id);
+        CREATE INDEX IF NOT EXISTS borrows_date_return ON borrows (date_return_ordinal);
+        CREATE TABLE IF NOT EXISTS logbook (
+            log_id TEXT PRIMARY KEY,
+            person_name BLOB NOT NULL,
+            date TEXT NOT NULL,
+            date_ordinal INTEGER,
+            time TEXT NOT NULL,
+            purpose TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS logbook_date ON logbook (date_ordinal);
+        CREATE TABLE IF NOT EXISTS id_counters (
+            name TEXT PRIMARY KEY,
+            next_number INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS circulation_stats (
+            stat TEXT PRIMARY KEY,
+            person_name BLOB,
+            value INTEGER NOT NULL
+        );
+    """
+
+    # Joins every book with the Log_ID of its last borrower (NULL when it has none)
+    LAST_BORROWERS = """
+        SELECT b.rowid AS book_row, b.book_id, b.title, b.author, b.date_published, b.status, bb.log_id AS last_log_id
+        FROM books b
+        LEFT JOIN book_borrowers bb ON bb.book_id = b.book_id
+            AND bb.position = (SELECT MAX(position) FROM book_borrowers WHERE book_id = b.book_id)
+    """
+
+    # Joins borrow entries with their book and log entry, in the columns of StorageBackend.borrow_row
+    BORROW_ROWS = """
+        SELECT br.borrow_id, b.title, b.author, b.date_published, b.status, br.date_return, l.person_name, br.date_return_ordinal
+        FROM borrows br
+        JOIN books b ON b.book_id = br.book_id
+        JOIN logbook l ON l.log_id = br.log_id
+    """
+
+    # SQLite's own setting for each DURABILITY level (SQLite writes its files safely and syncs its directory itself)
+    SYNCHRONOUS = {'none': 'OFF', 'fsync-file': 'NORMAL', 'fsync-dir': 'FULL'}
+
+    def __init__(self, database_file=SQLITE_FILE):
+        self.database_file = database_file
+        self.database = None  # Opened on first use
+        self.depth = 0  # How many transaction() blocks are open
+        self.stat_key = None  # Key of the hashes of person names in circulation_stats, derived on first use
+
+    @property
+    def connection(self):
+        if self.database is None:
+            self.database = sqlite3.connect(self.database_file, isolation_level=None, check_same_thread=False)
+            self.database.execute(f"PRAGMA synchronous = {self.SYNCHRONOUS[DURABILITY]}")
+            self.database.executescript(self.SCHEMA)
+        return self.database
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.depth == 0:
+            self.connection.execute("BEGIN")
+        self.depth += 1
+        try:
+            yield
+            if self.depth == 1:
+                if not self.connection.in_transaction:
+                    raise StorageError("The transaction was rolled back by an error inside it.")
+                self.connection.execute("COMMIT")
+        except BaseException:
+            # An error at any depth rolls back the whole transaction, so a flush is saved whole or not at all
+            if self.connection.in_transaction:
+                self.connection.execute("ROLLBACK")
+            raise
+        finally:
+            self.depth -= 1
+
+    def load(self, name):
+        data = {}
+        if name == 'books':
+            for book_id, title, author, date_published, status in self.connection.execute(
+                    "SELECT book_id, title, author, date_published, status FROM books ORDER BY rowid"):
+                data[book_id] = Book(title, author, date_published, status)
+            for book_id, log_id in self.connection.execute(
+                    "SELECT book_id, log_id FROM book_borrowers ORDER BY book_id, position"):
+                data[book_id].borrowers.append(log_id)
+        elif name == 'borrow_list':
+            for borrow_id, book_id, log_id, date_return in self.connection.execute(
+                    "SELECT borrow_id, book_id, log_id, date_return FROM borrows ORDER BY rowid"):
+                data[borrow_id] = BorrowEntry(book_id, log_id, date_return)
+        else:
+            rows = self.connection.execute("SELECT log_id, person_name, date, time, purpose FROM logbook ORDER BY rowid").fetchall()
+            names = get_cipher().decrypt_many([row[1] for row in rows])
+            for (log_id, _, date, time, purpose), person_name in zip(rows, names):
+                data[log_id] = LogEntry(person_name.decode(), date, time, purpose)
+        return data
+
+    def save(self, name, data):
+        with self.transaction():
+            self.delete_all(name)
+            self.write_records(name, data, data.keys())
+
+    def save_records(self, name, data, record_ids):
+        with self.transaction():
+            self.write_records(name, data, record_ids)
+
+    def save_record(self, name, data, record_id):
+        with self.transaction():
+            if record_id in data:
+                self.write_record(name, record_id, data[record_id])
+            else:
+                self.delete_record(name, record_id)
+
+    def iter_records(self, name):
+        if name == 'books':
+            yield from self.load(name).items()
+        elif name == 'borrow_list':
+            for borrow_id, book_id, log_id, date_return in self.connection.execute(
+                    "SELECT borrow_id, book_id, log_id, date_return FROM borrows ORDER BY rowid"):
+                yield borrow_id, {'Book_ID': book_id, 'Log_ID': log_id, 'Date Return': date_return}
+        else:
+            cursor = self.connection.execute("SELECT log_id, person_name, date, time, purpose FROM logbook ORDER BY rowid")
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    return
+                names = get_cipher().decrypt_many([row[1] for row in rows])
+                for (log_id, _, date, time, purpose), person_name in zip(rows, names):
+                    yield log_id, {'Person Name': person_name.decode(), 'Date': date, 'Time': time, 'Purpose': purpose}
+
+    def load_counters(self):
+        return dict(self.connection.execute("SELECT name, next_number FROM id_counters"))
+
+    def save_counters(self, counters):
+        with self.transaction():
+            self.connection.executemany(
+                "INSERT INTO id_counters (name, next_number) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET next_number = excluded.next_number", counters.items())
+
+    # Returns the row key of a circulation counter. Counters keyed by a person name are stored under
+    # a keyed hash of the name, with the name itself encrypted in the person_name column. The hash is keyed
+    # with a subkey derived from the encryption key, so the encryption key itself is only used by the cipher.
+    def stat_row_key(self, stat):
+        kind, _, key = stat.partition(':')
+        if kind not in NAMED_STATS:
+            return stat
+        if self.stat_key is None:
+            self.stat_key = hmac.new(get_key(), b'circulation-stats', hashlib.sha256).digest()
+        return f"{kind}:{hmac.new(self.stat_key, key.encode(), hashlib.sha256).hexdigest()}"
+
+    def load_stats(self):
+        rows = self.connection.execute("SELECT stat, person_name, value FROM circulation_stats").fetchall()
+        stats = {stat: value for stat, person_name, value in rows if person_name is None}
+        named = [row for row in rows if row[1] is not None]
+        names = get_cipher().decrypt_many([person_name for _, person_name, _ in named])
+        for (stat, _, value), person_name in zip(named, names):
+            stats[f"{stat.partition(':')[0]}:{person_name.decode()}"] = value
+        return stats
+
+    def save_stats(self, stats, keys=None):
+        with self.transaction():
+            if keys is None:
+                self.connection.execute("DELETE FROM circulation_stats")
+                keys = stats
+            keys = list(keys)
+            saved = [stat for stat in keys if stat in stats]
+            named = [stat for stat in saved if stat.partition(':')[0] in NAMED_STATS]
+            names = dict(zip(named, get_cipher().encrypt_many([stat.partition(':')[2] for stat in named])))
+            self.connection.executemany(
+                "DELETE FROM circulation_stats WHERE stat = ?",
+                [(self.stat_row_key(stat),) for stat in keys if stat not in stats])
+            self.connection.executemany(
+                "INSERT INTO circulation_stats (stat, person_name, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (stat) DO UPDATE SET person_name = excluded.person_name, value = excluded.value",
+                [(self.stat_row_key(stat), names.get(stat), stats[stat]) for stat in saved])
+
+    # Inserts or updates many records, encrypting the names of log entries in one batch
+    def write_records(self, name, data, record_ids):
+        if name == 'logbook':
+            record_ids = list(record_ids)
+            names = get_cipher().encrypt_many([data[record_id]['Person Name'] for record_id in record_ids])
+            for record_id, person_name in zip(record_ids, names):
+                self.write_record(name, record_id, data[record_id], person_name)
+        else:
+            for record_id in record_ids:
+                self.write_record(name, record_id, data[record_id])
+
+    # Inserts or updates one record (keeping its rowid, so records keep their order)
+    # The Person Name of a log entry may be passed already encrypted
+    def write_record(self, name, record_id, record, person_name=None):
+        if name == 'books':
+            self.connection.execute(
+                "INSERT INTO books (book_id, title, author, date_published, status) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (book_id) DO UPDATE SET title = excluded.title, author = excluded.author, "
+                "date_published = excluded.date_published, status = excluded.status",
+                (record_id, record['Title'], record['Author'], record['Date Published'], record['Status']))
+            self.connection.execute("DELETE FROM book_borrowers WHERE book_id = ?", (record_id,))
+            self.connection.executemany(
+                "INSERT INTO book_borrowers (book_id, position, log_id) VALUES (?, ?, ?)",
+                [(record_id, position, log_id) for position, log_id in enumerate(record['List of Borrowers'])])
+        elif name == 'borrow_list':
+            self.connection.execute(
+                "INSERT INTO borrows (borrow_id, book_id, log_id, date_return, date_return_ordinal) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (borrow_id) DO UPDATE SET book_id = excluded.book_id, log_id = excluded.log_id, "
+                "date_return = excluded.date_return, date_return_ordinal = excluded.date_return_ordinal",
+                (record_id, record['Book_ID'], record['Log_ID'], record['Date Return'], date_to_ordinal(record['Date Return'])))
+        else:
+            self.connection.execute(
+                "INSERT INTO logbook (log_id, person_name, date, date_ordinal, time, purpose) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (log_id) DO UPDATE SET person_name = excluded.person_name, date = excluded.date, "
+                "date_ordinal = excluded.date_ordinal, time = excluded.time, purpose = excluded.purpose",
+                (record_id, person_name or get_cipher().encrypt(record['Person Name']), record['Date'], date_to_ordinal(record['Date']),
+                 record['Time'], record['Purpose']))
+
+    # Deletes one record
+    def delete_record(self, name, record_id):
+        if name == 'books':
+            self.connection.execute("DELETE FROM books WHERE book_id = ?", (record_id,))
+            self.connection.execute("DELETE FROM book_borrowers WHERE book_id = ?", (record_id,))
+        elif name == 'borrow_list':
+            self.connection.execute("DELETE FROM borrows WHERE borrow_id = ?", (record_id,))
+        else:
+            self.connection.execute("DELETE FROM logbook WHERE log_id = ?", (record_id,))
+
+    # Deletes every record of a dictionary
+    def delete_all(self, name):
+        if name == 'books':
+            self.connection.execute("DELETE FROM books")
+            self.connection.execute("DELETE FROM book_borrowers")
+        elif name == 'borrow_list':
+            self.connection.execute("DELETE FROM borrows")
+        else:
+            self.connection.execute("DELETE FROM logbook")
+
+    def pending_books(self):
+        rows = []
+        for _, book_id, title, author, date_published, status, last_log_id, borrow_id, date_return, person_name in self.connection.execute(
+                "SELECT lb.*, br.borrow_id, br.date_return, l.person_name FROM (" + self.LAST_BORROWERS + ") lb "
+                "LEFT JOIN borrows br ON br.rowid = (SELECT MAX(rowid) FROM borrows WHERE log_id = lb.last_log_id) "
+                "LEFT JOIN logbook l ON l.log_id = lb.last_log_id "
+                "WHERE lb.status = 'Unavailable' ORDER BY lb.book_row"):
+            rows.append({
+                'Book_ID': book_id,
+                'Title': title,
+                'Author': author,
+                'Date Published': date_published,
+                'Status': status,
+                'Last Borrower Log_ID': last_log_id,
+                'Borrow_ID': borrow_id,
+                'Date Return': date_return,
+                'Last Borrower': decrypt(person_name, get_cipher()) if borrow_id and person_name else None
+            })
+        return rows
+
+    def borrow_entries(self, outstanding_only=False):
+        if outstanding_only:
+            query = (self.BORROW_ROWS +
+                     "JOIN (" + self.LAST_BORROWERS + ") lb ON lb.book_id = br.book_id AND lb.last_log_id = br.log_id "
+                     "WHERE b.status = 'Unavailable' ORDER BY br.rowid")
+        else:
+            query = self.BORROW_ROWS + "ORDER BY br.rowid"
+        return [self.borrow_row(row) for row in self.connection.execute(query)]
+
+    def returns_due(self, first, last):
+        return [self.borrow_row(row) for row in self.connection.execute(
+            self.BORROW_ROWS + "WHERE br.date_return_ordinal BETWEEN ? AND ? ORDER BY br.date_return_ordinal, br.rowid",
+            (first, last))]
+
+    def overdue_loans(self, today):
+        rows = []
+        for row in self.connection.execute(
+                self.BORROW_ROWS +
+                "JOIN (" + self.LAST_BORROWERS + ") lb ON lb.book_id = br.book_id AND lb.last_log_id = br.log_id "
+                "WHERE b.status = 'Unavailable' AND br.date_return_ordinal < ? "
+                "ORDER BY br.date_return_ordinal, br.rowid", (today,)):
+            borrow_row = self.borrow_row(row)
+            borrow_row['Days Overdue'] = today - row[7]
+            rows.append(borrow_row)
+        return rows
+
+    def transactions_on(self, ordinal):
+        return [
+            {'Log_ID': log_id, 'Person Name': decrypt(person_name, get_cipher()), 'Date': date, 'Time': time, 'Purpose': purpose}
+            for log_id, person_name, date, time, purpose in self.connection.execute(
+                "SELECT log_id, person_name, date, time, purpose FROM logbook WHERE date_ordinal = ? ORDER BY rowid",
+                (ordinal,))
+        ]
+
+    # Converts a row of BORROW_ROWS into the row of StorageBackend.borrow_row
+    def borrow_row(self, row):
+        borrow_id, title, author, date_published, status, date_return, person_name = row[:7]
+        return {
+            'Borrow_ID': borrow_id,
+            'Title': title,
+            'Author': author,
+            'Date Published': date_published,
+            'Status': status,
+            'Date Return': date_return,
+            'Borrower': decrypt(person_name, get_cipher())
+        }
+
+STORAGE_BACKENDS = {'files': FlatFileBackend, 'sqlite': SQLiteBackend}
+
+def copy_storage(source, target):
+    """
+    Imports every dictionary from one storage backend into another, replacing what the target held.
+
+    Args:
+        source (StorageBackend): The backend to read from.
+        target (StorageBackend): The backend to write to.
+    """
+    for name in DATA_FILES:
+        data = source.load(name)
+        target.save(name, data)
+        print(f"{name}: {len(data)} records copied from {source.name} to {target.name}.")
+    target.save_counters(source.load_counters())
+    target.save_stats(source.load_stats())
+
+class Dataset(dict):
+    """
+    A loaded dataset (books, borrow_list or logbook): a plain dictionary that knows its name in storage.
+    """
+    __slots__ = ('name',)
+    loaded = True
+
+    def load(self):
+        return self
+
+    def unload(self):
+        """
+        Drops the records, so the dataset is loaded again from storage the next time it is used.
+        """
+        dict.clear(self)
+        self.__class__ = LazyDataset
+
+class LazyDataset(Dataset):
+    """
+    A dataset that is loaded from storage the first time it is used, so a command only pays for the datasets it touches.
+    Every dictionary method first loads the records and then turns the object into a plain Dataset,
+    so once loaded the dataset costs the same to use as a dictionary.
+    """
+    __slots__ = ()
+    loaded = False
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def load(self):
+        data = storage.load(self.name)
+        self.__class__ = Dataset
+        dict.update(self, data)
+        return self
+
+# Builds a LazyDataset method that loads the records and then calls the dictionary method
+def lazy_method(method_name):
+    def method(self, *args, **kwargs):
+        self.load()
+        return getattr(self, method_name)(*args, **kwargs)
+    method.__name__ = method_name
+    return method
+
+for method_name in ('__getitem__', '__setitem__', '__delitem__', '__contains__', '__iter__', '__len__', '__eq__', '__repr__',
+                    'keys', 'values', 'items', 'get', 'pop', 'popitem', 'clear', 'setdefault', 'update', 'copy'):
+    setattr(LazyDataset, method_name, lazy_method(method_name))
+
+# Initializes dictionaries (loaded on first use)
+storage = STORAGE_BACKENDS[STORAGE_BACKEND]()
+books = LazyDataset('books')
+borrow_list = LazyDataset('borrow_list')
+logbook = LazyDataset('logbook')
+
+def stream_records(dataset):
+    """
+    Streams the (record ID, record) pairs of a dataset: from memory if it is loaded,
+    otherwise straight from storage without loading it.
+
+    Args:
+        dataset (Dataset): books, borrow_list or logbook.
+    """
+    if dataset.loaded:
+        # Iterates a copy of the IDs, so records can be added or deleted while the stream is read (see LibraryService.page)
+        return ((record_id, dataset[record_id]) for record_id in list(dataset) if record_id in dataset)
+    return storage.iter_records(dataset.name)
+
+def use_storage(backend):
+    """
+    Switches to another storage backend. The datasets and indexes are loaded again from it the next time they are used.
+
+    Args:
+        backend (StorageBackend): The backend to use.
+    """
+    global storage
+    flush_manager.flush()
+    storage = backend
+    for dataset in (books, borrow_list, logbook):
+        dataset.unload()
+    for index in (book_index, return_date_index, log_date_index, log_columns, search_index):
+        index.reset()
+    id_allocator.reset()
+    circulation_stats.reset()
+
+def migrate_data_files(serializer=None):
+    """
+    Rewrites books.txt, borrow_list.txt and logbook.txt (and compacts their journals) with the chosen serializer.
+    Files saved by older versions as str() dictionaries are read safely by load_data, so this is all it takes to migrate them.
+
+    Args:
+        serializer (str): The name of the serializer to use. Defaults to SERIALIZER, or DEFAULT_SERIALIZER.
+    """
+    serializer = serializer or SERIALIZER or DEFAULT_SERIALIZER
+    for data, data_file in ((books, ENCRYPTED_BOOKS_FILE), (borrow_list, ENCRYPTED_BORROW_LIST_FILE), (logbook, ENCRYPTED_LOGBOOK_FILE)):
+        data.load()  # Before the file is rewritten, since loading a missing file creates it
+        save_data(data, data_file, serializer)
+        print(f"{data_file}: {len(data)} records saved as {serializer}.")
+    
+# Flush Module
+# Changed records are not saved by the code that changes them. It marks them as dirty in the flush manager,
+# which saves every dirty record of every dictionary together in one storage transaction (a flush). A record
+# changed several times before a flush is saved once. With FLUSH_DELAY set to None the changes are flushed
+# as soon as each operation ends. With a delay they are flushed by a background thread once the oldest change
+# is that many seconds old, or once FLUSH_SIZE changes are waiting, so operations do not wait for the disk.
+# Anything still waiting is flushed by close(), which main() calls on its way out.
+# A flush that fails (e.g. the disk is full) raises StorageError to the operation that flushed, after marking
+# its records as dirty again, so they are saved by the next flush; the background thread reports it and retries.
+
+# Seconds a change may wait before it is flushed (None flushes at the end of every operation)
+FLUSH_DELAY = None
+# Number of waiting changes that triggers a flush before the delay is over
+FLUSH_SIZE = 1000
+
+class FlushManager:
+    """
+    Tracks the dirty records of books, borrow_list and logbook and flushes them to storage.
+    Code that changes the dictionaries does so inside a changes() block, which holds the manager's lock
+    so a flush running on the background thread never sees a half-made change.
+    """
+
+    def __init__(self, delay=FLUSH_DELAY, size=FLUSH_SIZE):
+        self.delay = delay
+        self.size = size
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.dirty = {}  # Dictionary name -> IDs of the dirty records, or None when the whole dictionary is to be saved
+        self.waiting = 0  # Number of changes marked since the last flush
+        self.first_change = None  # time.monotonic() of the oldest change not flushed yet
+        self.depth = 0  # How many changes() blocks are open
+        self.thread = None
+        self.closing = False
+        self.flushes = 0  # Number of flushes that saved something
+
+    @contextlib.contextmanager
+    def changes(self, flush=True):
+        """
+        Groups the changes made inside a with block into one operation. When the outermost block ends,
+        the dirty records are flushed right away, or handed to the background thread if there is a delay.
+
+        Args:
+            flush (bool): False leaves the flush to the caller when there is no delay (see LibraryServer.write_loop).
+        """
+        with self.lock:
+            self.depth += 1
+            try:
+                yield
+            finally:
+                self.depth -= 1
+                if self.depth == 0 and self.dirty:
+                    if self.delay is None:
+                        if flush:
+                            self.flush()
+                    else:
+                        self.start()
+                        self.condition.notify()
+
+    @contextlib.contextmanager
+    def synced(self):
+        """
+        Flushes every waiting change and keeps the lock for the with block, so a query that reads
+        from storage sees every change made so far.
+        """
+        with self.lock:
+            self.flush()
+            yield
+
+    def mark(self, name, record_id=None):
+        """
+        Marks a record of a dictionary as dirty, or the whole dictionary if no record ID is given.
+
+        Args:
+            name (str): 'books', 'borrow_list' or 'logbook', 'id_counters' for the counters of id_allocator,
+                or 'circulation_stats' for the counters of circulation_stats.
+            record_id (str): The ID of the record that was added, changed or deleted (the key of a circulation counter).
+        """
+        with self.lock:
+            if self.first_change is None:
+                self.first_change = time.monotonic()
+            record_ids = self.dirty.setdefault(name, {})
+            if record_id is None:
+                self.dirty[name] = None
+            elif record_ids is not None:
+                record_ids[record_id] = None
+            self.waiting += 1
+
+    def flush(self):
+        """
+        Saves every dirty record in one storage transaction.
+
+        Raises:
+            StorageError: If the records could not be saved. They are marked as dirty again.
+        """
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            waiting, self.waiting = self.waiting, 0
+            first_change, self.first_change = self.first_change, None
+            if not dirty:
+                return
+            datasets = {'books': books, 'borrow_list': borrow_list, 'logbook': logbook}
+            try:
+                with storage.transaction():
+                    for name, record_ids in dirty.items():
+                        if name == 'id_counters':
+                            storage.save_counters(id_allocator.limits)
+                        elif name == 'circulation_stats':
+                            storage.save_stats(circulation_stats, record_ids)
+                        elif record_ids is None:
+                            storage.save(name, datasets[name])
+                        else:
+                            for record_id in record_ids:
+                                storage.save_record(name, datasets[name], record_id)
+            except Exception as error:
+                # Saving a record again is harmless, so every record of the flush is marked as dirty again
+                self.dirty, self.waiting, self.first_change = dirty, waiting, first_change
+                raise StorageError(f"The changes could not be saved ({error}).") from error
+            self.flushes += 1
+
+    def start(self):
+        """
+        Starts the background thread if it is not running yet.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='library-flush', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        with self.lock:
+            while not self.closing:
+                if not self.dirty:
+                    self.condition.wait()
+                    continue
+                wait = self.first_change + (self.delay or 0) - time.monotonic()
+                if wait > 0 and self.waiting < self.size:
+                    self.condition.wait(wait)
+                    continue
+                try:
+                    self.flush()
+                except StorageError as error:
+                    print("Error:", error)
+                    self.condition.wait(self.delay or 1)  # Tries again after the delay instead of at once
+
+    def close(self):
+        """
+        Stops the background thread and flushes every change still waiting.
+
+        Raises:
+            StorageError: If the changes could not be saved.
+        """
+        with self.lock:
+            self.closing = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+        self.closing = False
+        self.flush()
+
+flush_manager = FlushManager()
+
+# ID Allocation Module
+# Record IDs are a prefix and a number (B12, BL3, L7) handed out by an allocator whose counters only go up,
+# so the ID of a deleted record is never given to a new one. The counters are saved by the storage backend
+# (id_counters.txt for 'files', the id_counters table for 'sqlite') in the same flush as the records that
+# use them. An allocator reserves ID_BLOCK_SIZE numbers at a time and only saves its counter when a block
+# runs out, and reserve() hands out a whole range at once, so bulk imports and busy writers save one counter
+# per block instead of one per record. Numbers left in a block when the program stops are skipped.
+# When a dataset is first used the allocator also starts past its highest existing ID, so data saved
+# before the counters existed (or a counter lost in a crash) can never lead to an ID being reused.
+
+# Prefix of the IDs of each dictionary
+ID_PREFIXES = {'books': 'B', 'borrow_list': 'BL', 'logbook': 'L'}
+# Numbers reserved (and saved) at a time, so the counter file is rewritten once per block of new records
+ID_BLOCK_SIZE = 100
+ID_COUNTERS_FILE = 'id_counters.txt'
+
+# Returns the highest number of the IDs of a dictionary (0 if it has none)
+def highest_id_number(data, prefix):
+    numbers = (record_id[len(prefix):] for record_id in data if record_id.startswith(prefix))
+    return max((int(number) for number in numbers if number.isdigit()), default=0)
+
+class IdAllocator:
+    """
+    Allocates the record IDs of books, borrow_list and logbook.
+    The counters are loaded from storage on first use and saved through the flush manager.
+    """
+
+    def __init__(self, block_size=ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self.limits = None  # Dictionary name -> first number past the reserved block (the saved counter)
+        self.next_numbers = {}  # Dictionary name -> number of the next ID to hand out
+
+    def reserve(self, name, count=1):
+        """
+        Reserves a range of consecutive ID numbers of a dictionary.
+
+        Args:
+            name (str): 'books', 'borrow_list' or 'logbook'.
+            count (int): How many numbers to reserve.
+
+        Returns:
+            range: The reserved numbers.
+        """
+        with flush_manager.lock:
+            if self.limits is None:
+                self.limits = storage.load_counters()
+            if name not in self.next_numbers:
+                data = {'books': books, 'borrow_list': borrow_list, 'logbook': logbook}[name]
+                self.next_numbers[name] = max(self.limits.get(name, 1), highest_id_number(data, ID_PREFIXES[name]) + 1)
+            first = self.next_numbers[name]
+            self.next_numbers[name] = first + count
+            if self.next_numbers[name] > self.limits.get(name, 0):
+                self.limits[name] = self.next_numbers[name] + self.block_size - 1
+                flush_manager.mark('id_counters')
+            return range(first, first + count)
+
+    def new_id(self, name):
+        """
+        Returns a new ID of a dictionary, e.g. 'B12' for books.
+        """
+        return f'{ID_PREFIXES[name]}{self.reserve(name)[0]}'
+
+    def new_ids(self, name, count):
+        """
+        Returns a list of count new IDs of a dictionary, reserved together.
+        """
+        return [f'{ID_PREFIXES[name]}{number}' for number in self.reserve(name, count)]
+
+    def reset(self):
+        """
+        Drops the counters, so they are loaded again from storage the next time an ID is needed.
+        """
+        self.limits = None
+        self.next_numbers = {}
+
+id_allocator = IdAllocator()
+
+# Indexes Module
+# Indexes are kept in memory only. They are rebuilt from the dictionaries at startup
+# and updated by every function that changes books or borrow_list.
+
+# Adds a record ID to a bucket of an index (buckets are dictionaries used as ordered sets)
+def add_to_bucket(index, bucket_key, record_id):
+    bucket = index.get(bucket_key)
+    if bucket is None:
+        bucket = index[bucket_key] = {}
+    bucket[record_id] = None
+
+# Removes a record ID from a bucket of an index, dropping the bucket once it is empty
+def remove_from_bucket(index, bucket_key, record_id):
+    bucket = index.get(bucket_key)
+    if bucket is not None:
+        bucket.pop(record_id, None)
+        if not bucket:
+            del index[bucket_key]
+
+class BookIndex:
+    """
+    Secondary indexes over books and borrow_list, so books and loans can be looked up without scanning every record.
+        - by_title_author: (title, author) -> IDs of the books (copies) with that title and author
+        - by_title: title -> IDs of the books with that title
+        - by_status: 'Available' or 'Unavailable' -> IDs of the books with that status
+        - borrows_by_book: book ID -> IDs of the borrow entries of that book
+        - borrow_by_log: Log_ID of a borrow -> ID of its borrow entry
+        - open_loans: book ID -> ID of the borrow entry of the loan that is still outstanding
+    Titles and authors are indexed without leading and trailing whitespace.
+    """
+
+    def __init__(self):
+        self.by_title_author = {}
+        self.by_title = {}
+        self.by_status = {}
+        self.borrows_by_book = {}
+        self.borrow_by_log = {}
+        self.open_loans = {}
+        self.book_keys = {}  # book ID -> (title, author, status) the book is indexed under
+        self.borrow_keys = {}  # borrow ID -> (book ID, Log_ID) the entry is indexed under
+
+    def rebuild(self, books, borrow_list):
+        """
+        Rebuilds every index from scratch.
+
+        Args:
+            books (dict): The books dictionary.
+            borrow_list (dict): The borrow list dictionary.
+        """
+        self.__init__()
+        for book_id, book in books.items():
+            self.add_book(book_id, book)
+        for borrow_id, entry in borrow_list.items():
+            self.add_borrow(borrow_id, entry)
+        # A book is out on the loan of its last borrower
+        for book_id in self.with_status(Status.UNAVAILABLE):
+            borrowers = books[book_id]['List of Borrowers']
+            borrow_id = self.borrow_of_log(borrowers[-1]) if borrowers else None
+            if borrow_id is not None:
+                self.open_loans[book_id] = borrow_id
+
+    def add_book(self, book_id, book):
+        """
+        Indexes a new or edited book. A book that is already indexed under the same ID is re-indexed, keeping its outstanding loan.
+        """
+        self.unindex_book(book_id)
+        title, author, status = book['Title'].strip(), book['Author'].strip(), book['Status']
+        self.book_keys[book_id] = (title, author, status)
+        add_to_bucket(self.by_title_author, (title, author), book_id)
+        add_to_bucket(self.by_title, title, book_id)
+        add_to_bucket(self.by_status, status, book_id)
+
+    def remove_book(self, book_id):
+        """
+        Removes a book from the title, author and status indexes and closes its outstanding loan.
+        """
+        self.open_loans.pop(book_id, None)
+        self.unindex_book(book_id)
+
+    # Removes a book from the title, author and status indexes only
+    def unindex_book(self, book_id):
+        keys = self.book_keys.pop(book_id, None)
+        if keys is None:
+            return
+        title, author, status = keys
+        remove_from_bucket(self.by_title_author, (title, author), book_id)
+        remove_from_bucket(self.by_title, title, book_id)
+        remove_from_bucket(self.by_status, status, book_id)
+
+    def update_status(self, book_id, status):
+        """
+        Moves a book to the bucket of its new status.
+        """
+        title, author, old_status = self.book_keys[book_id]
+        remove_from_bucket(self.by_status, old_status, book_id)
+        add_to_bucket(self.by_status, status, book_id)
+        self.book_keys[book_id] = (title, author, status)
+
+    def add_borrow(self, borrow_id, entry):
+        """
+        Indexes a borrow entry under its book and under the Log_ID of the borrow.
+        """
+        self.remove_borrow(borrow_id)
+        self.borrow_keys[borrow_id] = (entry['Book_ID'], entry['Log_ID'])
+        add_to_bucket(self.borrows_by_book, entry['Book_ID'], borrow_id)
+        self.borrow_by_log[entry['Log_ID']] = borrow_id
+
+    def remove_borrow(self, borrow_id):
+        """
+        Removes a borrow entry from the index, closing its loan if it is still outstanding.
+        """
+        keys = self.borrow_keys.pop(borrow_id, None)
+        if keys is None:
+            return
+        book_id, log_id = keys
+        remove_from_bucket(self.borrows_by_book, book_id, borrow_id)
+        if self.borrow_by_log.get(log_id) == borrow_id:
+            del self.borrow_by_log[log_id]
+        if self.open_loans.get(book_id) == borrow_id:
+            del self.open_loans[book_id]
+
+    def open_loan(self, book_id, borrow_id):
+        """
+        Records the borrow entry of a book that was just borrowed as its outstanding loan.
+        """
+        self.open_loans[book_id] = borrow_id
+
+    def close_loan(self, book_id):
+        """
+        Closes the outstanding loan of a book that was returned.
+        """
+        self.open_loans.pop(book_id, None)
+
+    def borrow_of_log(self, log_id):
+        """
+        Returns the ID of the borrow entry made with the given Log_ID, or None if there is none.
+        """
+        return self.borrow_by_log.get(log_id)
+
+    def outstanding_loans(self):
+        """
+        Returns the IDs of the borrow entries of all outstanding loans, oldest first.
+        """
+        return list(self.open_loans.values())
+
+    def find(self, title, author, status=None):
+        """
+        Finds the first book with the given title and author, optionally with the given status.
+
+        Returns:
+            str: The ID of the book found, or None if there is no such book.
+        """
+        for book_id in self.by_title_author.get((title.strip(), author.strip()), ()):
+            if status is None or self.book_keys[book_id][2] == status:
+                return book_id
+        return None
+
+    def find_by_title(self, title):
+        """
+        Finds the first book with the given title.
+
+        Returns:
+            str: The ID of the book found, or None if there is no such book.
+        """
+        return next(iter(self.by_title.get(title.strip(), ())), None)
+
+    def with_status(self, status):
+        """
+        Returns the IDs of all books with the given status.
+        """
+        return list(self.by_status.get(status, ()))
+
+    def borrows_of(self, book_id):
+        """
+        Returns the IDs of all borrow entries of a book.
+        """
+        return list(self.borrows_by_book.get(book_id, ()))
+
+# Converts a date string such as '9 Jan 2020' into its ordinal (1 Jan of year 1 is day 1)
+def date_to_ordinal(date_str):
+    return parse_date(date_str)
+
+class DateIndex:
+    """
+    Date-bucketed index of the records of a dictionary by one of their date fields.
+    Each date is parsed once into an ordinal. Buckets keyed by ordinal give O(1) lookups of a single day,
+    and the sorted list of ordinals lets date ranges be found with bisect instead of scanning every record.
+    Records with a date that cannot be parsed are not indexed.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.buckets = {}  # ordinal -> IDs of the records on that date
+        self.ordinals = []  # sorted ordinals of the dates that have records
+        self.record_ordinals = {}  # record ID -> ordinal the record is indexed under
+
+    def rebuild(self, data):
+        """
+        Rebuilds the index from scratch.
+
+        Args:
+            data (dict): The dictionary whose records are to be indexed.
+        """
+        self.__init__(self.field)
+        for record_id, record in data.items():
+            self.add(record_id, record)
+
+    def add(self, record_id, record):
+        """
+        Indexes a new or changed record.
+        """
+        self.remove(record_id)
+        if isinstance(record, Record):
+            ordinal = record.ordinal(self.field)
+        else:
+            ordinal = date_to_ordinal(record[self.field])
+        if ordinal is None:
+            return
+        if ordinal not in self.buckets:
+            bisect.insort(self.ordinals, ordinal)
+        add_to_bucket(self.buckets, ordinal, record_id)
+        self.record_ordinals[record_id] = ordinal
+
+    def remove(self, record_id):
+        """
+        Removes a record from the index.
+        """
+        ordinal = self.record_ordinals.pop(record_id, None)
+        if ordinal is None:
+            return
+        remove_from_bucket(self.buckets, ordinal, record_id)
+        if ordinal not in self.buckets:
+            del self.ordinals[bisect.bisect_left(self.ordinals, ordinal)]
+
+    def on(self, ordinal):
+        """
+        Returns the IDs of the records on the given date.
+        """
+        return list(self.buckets.get(ordinal, ()))
+
+    def between(self, first=None, last=None):
+        """
+        Returns the IDs of the records from the first to the last date (both included), in date order.
+        A missing first or last date leaves that end of the range open.
+        """
+        start = 0 if first is None else bisect.bisect_left(self.ordinals, first)
+        stop = len(self.ordinals) if last is None else bisect.bisect_right(self.ordinals, last)
+        return [record_id for ordinal in self.ordinals[start:stop] for record_id in self.buckets[ordinal]]
+
+class LazyIndex:
+    """
+    Builds an index the first time it is used and then passes every attribute through to it.
+
+    Args:
+        build (function): Builds and returns the index from the datasets it covers.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.index = None
+
+    def __getattr__(self, name):
+        if self.index is None:
+            self.index = self.build()
+        return getattr(self.index, name)
+
+    def reset(self):
+        """
+        Drops the index, so it is built again the next time it is used.
+        """
+        self.index = None
+
+    @property
+    def built(self):
+        """
+        Whether the index has been built (and so has to be kept up to date).
+        """
+        return self.index is not None
+
+# Builds an index of books and borrow_list
+def build_book_index():
+    index = BookIndex()
+    index.rebuild(books, borrow_list)
+    return index
+
+# Builds an index of the records of a dataset by one of their date fields
+def build_date_index(data, field):
+    index = DateIndex(field)
+    index.rebuild(data)
+    return index
+
+book_index = LazyIndex(build_book_index)
+return_date_index = LazyIndex(lambda: build_date_index(borrow_list, 'Date Return'))
+log_date_index = LazyIndex(lambda: build_date_index(logbook, 'Date'))
+
+# Analytics Module
+# The reports below count log entries by day, hour, purpose and person. They run over a columnar copy
+# of the logbook: one compact array per field, with dates as ordinals, times as minutes since midnight,
+# purposes as codes and people as IDs into a list of names. Counting then takes a few passes over
+# arrays (vectorized with NumPy when it is installed) instead of a Python loop over every entry.
+
+# Code stored in LogColumns.purposes for each purpose (entries with any other purpose get -1)
+PURPOSE_CODES = {Purpose.VISIT: 0, Purpose.BORROW: 1, Purpose.RETURN: 2}
+
+class LogColumns:
+    """
+    Columnar copy of the logbook, built from it and extended by every new log entry.
+        - days: date ordinal of each entry (0 if its date is not valid)
+        - minutes: minutes since midnight of each entry (-1 if its time is not valid)
+        - purposes: purpose code of each entry (see PURPOSE_CODES)
+        - people: person ID of each entry, an index into person_names
+    """
+
+    def __init__(self):
+        self.days = array.array('i')
+        self.minutes = array.array('h')
+        self.purposes = array.array('b')
+        self.people = array.array('i')
+        self.person_names = []
+        self.person_ids = {}  # name -> person ID
+
+    def rebuild(self, logbook):
+        """
+        Rebuilds the columns from scratch.
+
+        Args:
+            logbook (dict): The logbook dictionary.
+        """
+        self.__init__()
+        for log_id, entry in logbook.items():
+            self.add(log_id, entry)
+
+    def add(self, log_id, entry):
+        """
+        Appends a new log entry to the columns.
+        """
+        ordinal = entry.ordinal('Date') if isinstance(entry, Record) else date_to_ordinal(entry['Date'])
+        self.days.append(ordinal or 0)
+        minutes = parse_time(entry['Time'])
+        self.minutes.append(-1 if minutes is None else minutes)
+        self.purposes.append(PURPOSE_CODES.get(entry['Purpose'], -1))
+        name = entry['Person Name']
+        if name not in self.person_ids:
+            self.person_ids[name] = len(self.person_names)
+            self.person_names.append(name)
+        self.people.append(self.person_ids[name])
+
+    def summary(self, first=None, last=None, top=10):
+        """
+        Counts the log entries made from the first to the last date ordinal (both included, None for no limit).
+
+        Returns:
+            dict: Entries (the number of entries), Purposes (entries per purpose), Per Day ([date, entries]
+            for every day with entries, in date order), Per Hour ([hour, entries] for the 24 hours of the day),
+            Busiest Hours (the three hours with most entries) and Top Borrowers ([name, borrows] for the top people).
+        """
+        if numpy is not None:
+            counts = self.count_with_numpy(first, last)
+        else:
+            counts = self.count_with_arrays(first, last)
+        entries, purpose_counts, day_counts, minute_counts, borrow_counts = counts
+        hour_counts = [0] * 24
+        for minute, count in minute_counts:
+            if minute >= 0:
+                hour_counts[minute // 60] += count
+        per_hour = [[hour, count] for hour, count in enumerate(hour_counts)]
+        return {
+            'Entries': entries,
+            'Purposes': {purpose: purpose_counts.get(code, 0) for purpose, code in PURPOSE_CODES.items()},
+            'Per Day': [[format_date(day), count] for day, count in sorted(day_counts) if day > 0],
+            'Per Hour': per_hour,
+            'Busiest Hours': sorted((row for row in per_hour if row[1]), key=lambda row: -row[1])[:3],
+            'Top Borrowers': [[self.person_names[person], count] for person, count in
+                              sorted(borrow_counts, key=lambda item: (-item[1], item[0]))[:top]]
+        }
+
+    # Counts with NumPy: every column is viewed as an array without being copied
+    def count_with_numpy(self, first, last):
+        days = numpy.frombuffer(self.days, dtype=numpy.intc)
+        purposes = numpy.frombuffer(self.purposes, dtype=numpy.int8)
+        selected = numpy.ones(len(days), dtype=bool)
+        if first is not None:
+            selected &= days >= first
+        if last is not None:
+            selected &= days <= last
+        minutes = numpy.frombuffer(self.minutes, dtype=numpy.short)[selected]
+        purpose_codes, purpose_totals = numpy.unique(purposes[selected], return_counts=True)
+        day_values, day_totals = numpy.unique(days[selected], return_counts=True)
+        minute_values, minute_totals = numpy.unique(minutes, return_counts=True)
+        borrowers = numpy.frombuffer(self.people, dtype=numpy.intc)[selected & (purposes == PURPOSE_CODES[Purpose.BORROW])]
+        borrower_ids, borrow_totals = numpy.unique(borrowers, return_counts=True)
+        return (int(selected.sum()),
+                dict(zip(purpose_codes.tolist(), purpose_totals.tolist())),
+                zip(day_values.tolist(), day_totals.tolist()),
+                zip(minute_values.tolist(), minute_totals.tolist()),
+                zip(borrower_ids.tolist(), borrow_totals.tolist()))
+
+    # Counts with the standard library: Counter, compress and map run their loops in C
+    def count_with_arrays(self, first, last):
+        if first is None and last is None:
+            selected = None
+            entries = len(self.days)
+        else:
+            low = -1 if first is None else first
+            high = 2 ** 31 - 1 if last is None else last
+            selected = bytes(map(operator.and_, map(operator.ge, self.days, itertools.repeat(low)),
+                                 map(operator.le, self.days, itertools.repeat(high))))
+            entries = selected.count(1)
+        select = (lambda column: column) if selected is None else (lambda column: itertools.compress(column, selected))
+        is_borrow = map(operator.eq, self.purposes, itertools.repeat(PURPOSE_CODES[Purpose.BORROW]))
+        borrowers = itertools.compress(self.people, is_borrow if selected is None else map(operator.and_, is_borrow, selected))
+        return (entries,
+                collections.Counter(select(self.purposes)),
+                collections.Counter(select(self.days)).items(),
+                collections.Counter(select(self.minutes)).items(),
+                collections.Counter(borrowers).items())
+
+# Builds the columnar copy of the logbook
+def build_log_columns():
+    columns = LogColumns()
+    columns.rebuild(logbook)
+    return columns
+
+log_columns = LazyIndex(build_log_columns)
+
+# Circulation Stats Module
+# Counters for the questions the circulation reports ask most: how many times each book was borrowed,
+# how many books each person has out right now, and how many visits were logged each day. Every borrow,
+# return, visit and deletion updates them, and they are saved in the same flush as the records that changed them
+# (circulation_stats.txt for 'files', the circulation_stats table for 'sqlite'), so only the changed counters
+# are written and the reports read them without walking the borrow list or the logbook. They are only counted
+# again from the records when storage holds none yet (e.g. the first run after an upgrade) or when asked to
+# with `python library_system.py rebuild-stats`, e.g. after restoring a data file from a backup.
+
+# Version of the saved counters; counters saved without it (or with another version) are counted again
+CIRCULATION_STATS_VERSION = 2
+CIRCULATION_STATS_FILE = 'circulation_stats.txt'
+# Kinds of counters, each saved under the key '<kind>:<book ID, person name or date ordinal>'
+STAT_KINDS = ('borrows', 'loans', 'visits')
+# Kinds of counters keyed by a person name, which the 'sqlite' backend stores encrypted
+NAMED_STATS = ('loans',)
+
+# Orders counters by count, highest first, then by key
+def by_count(item):
+    return -item[1], item[0]
+
+class CirculationStats(collections.abc.Mapping):
+    """
+    Circulation counters, kept up to date by the LibraryService methods that change the library.
+        - borrows: book ID -> times the book was borrowed
+        - loans: person name -> books the person has borrowed and not returned yet
+        - visits: date ordinal -> visits logged that day
+    As a mapping it holds the counters the way they are saved ('borrows:B12' -> 3, 'visits:738891' -> 5,
+    and 'version' -> CIRCULATION_STATS_VERSION), so storage saves them like the records of a dictionary.
+    Counters that drop to 0 are removed.
+    """
+
+    def __init__(self):
+        self.counters = None  # Kind -> key -> count, None until loaded
+        self.totals = {}  # Kind -> sum of its counters
+
+    def load(self):
+        """
+        Loads the counters from storage the first time they are needed, counting them from the records if storage holds none.
+        Call before changing the records a counter follows, so a first count does not see the change twice.
+
+        Returns:
+            dict: Kind -> key -> count.
+        """
+        if self.counters is None:
+            with flush_manager.changes():
+                saved = storage.load_stats()
+                if saved.get('version') != CIRCULATION_STATS_VERSION:
+                    self.rebuild()
+                else:
+                    counters = {kind: {} for kind in STAT_KINDS}
+                    for stat, count in saved.items():
+                        kind, _, key = stat.partition(':')
+                        if kind in counters:
+                            counters[kind][int(key) if kind == 'visits' else key] = count
+                    self.use(counters)
+        return self.counters
+
+    # Replaces the counters and sums their totals
+    def use(self, counters):
+        self.counters = counters
+        self.totals = {kind: sum(counters[kind].values()) for kind in STAT_KINDS}
+
+    def rebuild(self):
+        """
+        Counts every counter again from books, borrow_list and logbook, and marks them all to be saved.
+        """
+        counters = {kind: {} for kind in STAT_KINDS}
+        borrows, loans, visits = counters['borrows'], counters['loans'], counters['visits']
+        for entry in borrow_list.values():
+            borrows[entry['Book_ID']] = borrows.get(entry['Book_ID'], 0) + 1
+        for borrow_id in book_index.outstanding_loans():
+            person_name = logbook[borrow_list[borrow_id]['Log_ID']]['Person Name']
+            loans[person_name] = loans.get(person_name, 0) + 1
+        for entry in logbook.values():
+            ordinal = entry.ordinal('Date') if entry['Purpose'] == Purpose.VISIT else None
+            if ordinal:
+                visits[ordinal] = visits.get(ordinal, 0) + 1
+        self.use(counters)
+        flush_manager.mark('circulation_stats')
+
+    def reset(self):
+        """
+        Drops the counters, so they are loaded again from storage the next time they are needed.
+        """
+        self.counters = None
+        self.totals = {}
+
+    def add(self, kind, key, amount=1):
+        """
+        Adds to a counter (subtracts if amount is negative) and marks it to be saved.
+        Call inside a flush_manager.changes() block.
+        """
+        counters = self.load()[kind]
+        old = counters.get(key, 0)
+        new = max(old + amount, 0)
+        if new:
+            counters[key] = new
+        else:
+            counters.pop(key, None)
+        self.totals[kind] += new - old
+        flush_manager.mark('circulation_stats', f'{kind}:{key}')
+
+    def count_visit(self, entry):
+        """
+        Counts a new log entry if it is a visit with a valid date.
+        """
+        self.load()
+        ordinal = entry.ordinal('Date') if entry['Purpose'] == Purpose.VISIT else None
+        if ordinal:
+            self.add('visits', ordinal)
+
+    def remove_book(self, book_id, borrower=None):
+        """
+        Drops the borrow count of a deleted book, and the loan of the person who had it out, if anyone.
+        """
+        self.add('borrows', book_id, -self.load()['borrows'].get(book_id, 0))
+        if borrower is not None:
+            self.add('loans', borrower, -1)
+
+    def clear(self, *kinds):
+        """
+        Drops every counter of the given kinds, e.g. after every book was deleted.
+        """
+        counters = self.load()
+        for kind in kinds:
+            counters[kind].clear()
+            self.totals[kind] = 0
+        flush_manager.mark('circulation_stats')
+
+    def summary(self, top=10):
+        """
+        Reads the totals and the top counters. Only picking the top counters goes over the counters
+        (books, borrowers and days); nothing goes over the borrow list or the logbook.
+
+        Returns:
+            dict: Borrows, Books Borrowed, Loans, Borrowers, Visits and Days Visited (the totals and the number of
+            counters of each kind), and Most Borrowed ([Book_ID, borrows]), Most Loans ([name, loans])
+            and Busiest Days ([date, visits]), top first.
+        """
+        counters = self.load()
+        return {
+            'Borrows': self.totals['borrows'],
+            'Books Borrowed': len(counters['borrows']),
+            'Loans': self.totals['loans'],
+            'Borrowers': len(counters['loans']),
+            'Visits': self.totals['visits'],
+            'Days Visited': len(counters['visits']),
+            'Most Borrowed': [list(item) for item in heapq.nsmallest(top, counters['borrows'].items(), key=by_count)],
+            'Most Loans': [list(item) for item in heapq.nsmallest(top, counters['loans'].items(), key=by_count)],
+            'Busiest Days': [[format_date(day), count] for day, count in
+                             heapq.nsmallest(top, counters['visits'].items(), key=by_count)]
+        }
+
+    def visits_between(self, first=None, last=None):
+        """
+        Returns [date, visits] for every day with visits from the first to the last date ordinal
+        (both included, None for no limit), in date order.
+        """
+        visits = self.load()['visits']
+        if first is not None and last is not None and last - first < len(visits):
+            days = [day for day in range(first, last + 1) if day in visits]
+        else:
+            days = sorted(day for day in visits if (first is None or day >= first) and (last is None or day <= last))
+        return [[format_date(day), visits[day]] for day in days]
+
+    def __getitem__(self, stat):
+        if stat == 'version':
+            return CIRCULATION_STATS_VERSION
+        kind, _, key = stat.partition(':')
+        try:
+            return self.counters[kind][int(key) if kind == 'visits' else key]
+        except (KeyError, ValueError):
+            raise KeyError(stat) from None
+
+    def __iter__(self):
+        yield 'version'
+        for kind, counters in self.counters.items():
+            for key in counters:
+                yield f'{kind}:{key}'
+
+    def __len__(self):
+        return 1 + sum(len(counters) for counters in self.counters.values())
+
+circulation_stats = CirculationStats()
+
+# Search Module
+# search_index finds books by the words of their title and author, forgiving typos. It maps every word to the
+# books that contain it (an inverted index) and every trigram (three-letter piece of a word) to the words that
+# contain it. A query word that is not indexed is matched to the indexed words sharing most of its trigrams,
+# so 'hobit' still finds 'hobbit'. Books are ranked by how closely, how rarely and in which field their words
+# match. Like the other indexes it is built on first use and then kept up to date as books change.
+
+# Smallest similarity (shared trigrams / all trigrams of both words) for an indexed word to match a query word
+FUZZY_THRESHOLD = 0.25
+# Most indexed words a misspelled query word is matched to
+FUZZY_MATCHES = 5
+# Weight of a word found in the title and of a word found in the author
+FIELD_WEIGHTS = {'Title': 1.0, 'Author': 0.6}
+
+# Splits a text into lower-case words
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+# Returns the trigrams of a word, padded with spaces so its first and last letters count too
+def trigrams(word):
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    """
+    Word and trigram indexes over the titles and authors of books.
+        - by_word: word -> {book ID: weight of the field the word is in}
+        - by_trigram: trigram -> set of the indexed words that contain it
+        - book_words: book ID -> words the book is indexed under
+    """
+
+    def __init__(self):
+        self.by_word = {}
+        self.by_trigram = {}
+        self.book_words = {}
+
+    def rebuild(self, books):
+        """
+        Rebuilds the indexes from scratch.
+
+        Args:
+            books (dict): The books dictionary.
+        """
+        self.__init__()
+        for book_id, book in books.items():
+            self.add_book(book_id, book)
+
+    def add_book(self, book_id, book):
+        """
+        Indexes a new or edited book under the words of its title and author.
+        """
+        self.remove_book(book_id)
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in tokenize(book[field]):
+                weights[word] = max(weights.get(word, 0), weight)
+        self.book_words[book_id] = tuple(weights)
+        for word, weight in weights.items():
+            postings = self.by_word.get(word)
+            if postings is None:
+                postings = self.by_word[word] = {}
+                for trigram in trigrams(word):
+                    self.by_trigram.setdefault(trigram, set()).add(word)
+            postings[book_id] = weight
+
+    def remove_book(self, book_id):
+        """
+        Removes a book from the indexes, dropping the words no other book has.
+        """
+        for word in self.book_words.pop(book_id, ()):
+            postings = self.by_word[word]
+            del postings[book_id]
+            if not postings:
+                del self.by_word[word]
+                for trigram in trigrams(word):
+                    words = self.by_trigram[trigram]
+                    words.discard(word)
+                    if not words:
+                        del self.by_trigram[trigram]
+
+    def matches(self, word):
+        """
+        Returns the indexed words that match a query word, as (word, similarity) pairs: the word itself
+        if it is indexed, or else the FUZZY_MATCHES words most similar to it.
+        """
+        if word in self.by_word:
+            return [(word, 1.0)]
+        query = trigrams(word)
+        shared = collections.Counter()
+        for trigram in query:
+            shared.update(self.by_trigram.get(trigram, ()))
+        similar = []
+        for candidate, count in shared.items():
+            similarity = count / (len(query) + len(candidate) - count)
+            if similarity >= FUZZY_THRESHOLD:
+                similar.append((candidate, similarity))
+        return heapq.nlargest(FUZZY_MATCHES, similar, key=lambda match: match[1])
+
+    def search(self, query, limit=10):
+        """
+        Ranks the books by how well their title and author match the words of a query.
+
+        Returns:
+            list: Up to limit (book ID, score) pairs, best match first.
+        """
+        matched_words = [self.matches(word) for word in dict.fromkeys(tokenize(query))]
+        if len(matched_words) == 1:
+            return self.top_books(matched_words[0], limit)
+        # Rarest query words first, each with the most it can add to a book's score. Once limit books score at
+        # least what the words left can add together, a book none of the earlier words matched can no longer
+        # make the top, so a common word only adds to the books already found instead of scanning its postings
+        matched_words.sort(key=lambda matches: sum(len(self.by_word[word]) for word, _ in matches))
+        total = len(self.book_words)
+        rarities = [{word: math.log(1 + total / len(self.by_word[word])) for word, _ in matches} for matches in matched_words]
+        bounds = [max((similarity * rarity[word] for word, similarity in matches), default=0) * max(FIELD_WEIGHTS.values())
+                  for matches, rarity in zip(matched_words, rarities)]
+        scores = {}
+        for position, (matches, rarity) in enumerate(zip(matched_words, rarities)):
+            candidates_only = (len(scores) >= limit and
+                               heapq.nlargest(limit, scores.values())[-1] >= sum(bounds[position:]))
+            word_scores = {}  # Best score of each book for this query word
+            for word, similarity in matches:
+                postings = self.by_word[word]
+                if candidates_only and len(postings) > len(scores):
+                    pairs = ((book_id, postings[book_id]) for book_id in scores if book_id in postings)
+                else:
+                    pairs = postings.items()
+                for book_id, weight in pairs:
+                    if candidates_only and book_id not in scores:
+                        continue
+                    score = similarity * rarity[word] * weight
+                    if score > word_scores.get(book_id, 0):
+                        word_scores[book_id] = score
+            for book_id, score in word_scores.items():
+                scores[book_id] = scores.get(book_id, 0) + score
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    # Ranks the books of a one-word query. Every book matching an indexed word in a given field scores the same,
+    # so the (word, field) pairs are taken best score first and only until limit books are found
+    def top_books(self, matches, limit):
+        total = len(self.book_words)
+        tiers = sorted(((similarity * math.log(1 + total / len(self.by_word[word])) * weight, word, weight)
+                        for word, similarity in matches for weight in FIELD_WEIGHTS.values()), reverse=True)
+        found = {}
+        for score, word, weight in tiers:
+            for book_id, book_weight in self.by_word[word].items():
+                if book_weight == weight and book_id not in found:
+                    found[book_id] = score
+                    if len(found) == limit:
+                        return list(found.items())
+        return list(found.items())
+
+# Builds the search index of books
+def build_search_index():
+    index = SearchIndex()
+    index.rebuild(books)
+    return index
+
+search_index = LazyIndex(build_search_index)
+
+# Date and Time Parsing
+# Dates ('9 Jan 2020') and times ('10:30 AM') are parsed by parse_date and parse_time, which validate a string
+# and turn it into a number in one step: the date's ordinal, or the minutes since midnight. A short hand-written
+# parser handles the usual spellings; anything it does not accept is handed to datetime.strptime, so exactly
+# the strings strptime accepts are valid. Results are kept in a bounded cache (least recently used strings are
+# dropped first), so repeated dates and times, which is most of them, are parsed once.
+
+# Most date strings (and, separately, time strings) whose parse results are cached
+PARSE_CACHE_SIZE = 65536
+# Month number of each lower-case month abbreviation
+MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(MONTH_NAMES, start=1)}
+
+# Parses 'Day Mon Year' with single spaces and ASCII digits, or returns None for strptime to decide
+def fast_parse_date(date_str):
+    parts = date_str.split(' ')
+    if len(parts) != 3:
+        return None
+    day, month, year = parts
+    month_number = MONTH_NUMBERS.get(month.lower())
+    if month_number is None or len(day) > 2 or len(year) != 4 or not (day + year).isascii() or not (day + year).isdigit():
+        return None
+    try:
+        return datetime.date(int(year), month_number, int(day)).toordinal()
+    except ValueError:
+        return None
+
+# Parses 'hour:minutes AM/PM' with a single space and ASCII digits, or returns None for strptime to decide
+def fast_parse_time(time_str):
+    clock, _, period = time_str.partition(' ')
+    hour, colon, minute = clock.partition(':')
+    period = period.upper()
+    if (not colon or period not in ('AM', 'PM') or len(hour) > 2 or len(minute) > 2
+            or not (hour + minute).isascii() or not hour.isdigit() or not minute.isdigit()):
+        return None
+    hour, minute = int(hour), int(minute)
+    if not 1 <= hour <= 12 or minute > 59:
+        return None
+    return (hour % 12 + (12 if period == 'PM' else 0)) * 60 + minute
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_date(date_str):
+    """
+    Parses a date in the 'Day Month Year' format (e.g. 9 Jan 2020).
+
+    Args:
+        date_str (str): The date string.
+
+    Returns:
+        int: The ordinal of the date (1 Jan of year 1 is day 1), or None if the string is not a valid date.
+    """
+    ordinal = fast_parse_date(date_str)
+    if ordinal is None:
+        try:
+            ordinal = datetime.datetime.strptime(date_str, '%d %b %Y').toordinal()
+        except ValueError:
+            pass
+    return ordinal
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_time(time_str):
+    """
+    Parses a time in the 'hour:minutes AM/PM' format (e.g. 10:30 AM).
+
+    Args:
+        time_str (str): The time string.
+
+    Returns:
+        int: The minutes since midnight, or None if the string is not a valid time.
+    """
+    minutes = fast_parse_time(time_str)
+    if minutes is None:
+        try:
+            parsed = datetime.datetime.strptime(time_str, '%I:%M %p')
+            minutes = parsed.hour * 60 + parsed.minute
+        except ValueError:
+            pass
+    return minutes
+
+# Functions to validate date and time format
+
+def validate_date(date_str):
+    """
+    Validates if the input date string is in the correct format.
+    
+    Args:
+        date_str (str): The input date string.
+        
+    Returns:
+        bool: True if the date string is in the correct format, False otherwise.
+    """
+    return parse_date(date_str) is not None
+
+def validate_time(time_str):
+    """
+    Validates if the input time string is in the correct format.
+    
+    Args:
+        time_str (str): The input time string.
+        
+    Returns:
+        bool: True if the time string is in the correct format, False otherwise.
+    """
+    return parse_time(time_str) is not None
+
+
+# Bulk Import Module
+
+# Columns read from each row of an import file
+IMPORT_FIELDS = {
+    'books': ('Title', 'Author', 'Date Published'),
+    'logbook': ('Person Name', 'Date', 'Time', 'Purpose')
+}
+PURPOSES = (Purpose.VISIT, Purpose.BORROW, Purpose.RETURN)
+
+def read_import_file(path, file_format=None):
+    """
+    Streams the rows of a CSV file (with a header row) or a JSONL file (one JSON object per line).
+
+    Args:
+        path (str): The path to the file.
+        file_format (str): 'csv' or 'jsonl'. Defaults to the file's extension.
+
+    Yields:
+        tuple: (row, error) for each row. row is a dictionary keyed by column name, or None if the line
+        could not be parsed, in which case error tells why.
+    """
+    if file_format is None:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            for row in csv.DictReader(file):
+                yield row, None
+        else:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    yield None, f"Invalid JSON: {error}."
+                    continue
+                if isinstance(row, dict):
+                    yield row, None
+                else:
+                    yield None, "Each line must be a JSON object."
+
+# Reads the import fields of a row as stripped strings, whatever type the file gave them (e.g. numbers in JSONL)
+def import_values(row, kind):
+    return {field: ('' if row.get(field) is None else str(row.get(field))).strip() for field in IMPORT_FIELDS[kind]}
+
+def bulk_import(kind, path, file_format=None):
+    """
+    Imports books or log entries from a CSV or JSONL file without any prompts.
+    Rows are streamed from the file and validated, with each distinct date and time parsed only once (see parse_date).
+    Rows that cannot be parsed or fail validation are skipped. The valid rows get their IDs in one reserved block and are saved with
+    a single save_records call, i.e. one encrypted write for the 'files' backend and one transaction for 'sqlite'.
+
+    Args:
+        kind (str): 'books' or 'logbook'.
+        path (str): The path to the file.
+        file_format (str): 'csv' or 'jsonl'. Defaults to the file's extension.
+
+    Returns:
+        dict: A report with the number of rows imported and skipped, the errors of the skipped rows,
+        the time taken and the throughput.
+    """
+    start = time.perf_counter()
+    records = []
+    errors = []
+    for line_number, (row, error) in enumerate(read_import_file(path, file_format), start=1):
+        if error:
+            errors.append((line_number, error))
+            continue
+        values = import_values(row, kind)
+        if kind == 'books':
+            date = values['Date Published']
+            if not values['Title'] or not values['Author']:
+                errors.append((line_number, "Title and Author are required."))
+                continue
+        else:
+            date = values['Date']
+            values['Purpose'] = values['Purpose'] or Purpose.VISIT
+            if not values['Person Name']:
+                errors.append((line_number, "Person Name is required."))
+                continue
+            if values['Purpose'] not in PURPOSES:
+                errors.append((line_number, f"Unknown purpose '{values['Purpose']}'."))
+                continue
+            if not validate_time(values['Time']):
+                errors.append((line_number, f"Invalid time '{values['Time']}'."))
+                continue
+        if not validate_date(date):
+            errors.append((line_number, f"Invalid date '{date}'."))
+            continue
+        if kind == 'books':
+            records.append(Book(values['Title'], values['Author'], values['Date Published']))
+        else:
+            records.append(LogEntry(values['Person Name'], values['Date'], values['Time'], values['Purpose']))
+    parsed = time.perf_counter()
+
+    data = books if kind == 'books' else logbook
+    with flush_manager.synced():
+        record_ids = id_allocator.new_ids(kind, len(records))
+        if kind == 'logbook':
+            circulation_stats.load()
+        data.update(zip(record_ids, records))
+        if records:
+            try:
+                storage.save_records(kind, data, record_ids)
+            except Exception:
+                flush_manager.mark(kind)  # Tried again (whole) by the flush below, which reports the error
+        if kind == 'logbook':
+            for record in records:
+                circulation_stats.count_visit(record)
+        flush_manager.flush()  # Saves the counter of the reserved IDs and the changed circulation counters
+    # The indexes of the dataset are rebuilt the next time they are used
+    if kind == 'books':
+        book_index.reset()
+        search_index.reset()
+    else:
+        log_date_index.reset()
+        log_columns.reset()
+    end = time.perf_counter()
+
+    return {
+        'imported': len(records),
+        'skipped': len(errors),
+        'errors': errors,
+        'read_seconds': parsed - start,
+        'save_seconds': end - parsed,
+        'records_per_second': (len(records) + len(errors)) / max(end - start, 1e-9)
+    }
+
+# Library Service Module
+# LibraryService holds the business logic of every menu option. Its methods take plain arguments and
+# return dictionaries (or lists of them) instead of prompting and printing, so the system can be driven
+# by scripts, batch jobs and load tests. The menu functions below only prompt, call the module-level
+# `library` service and print what it returns. Anything with the same methods can stand in for it.
+
+class LibraryError(Exception):
+    """
+    Raised by LibraryService when an operation cannot be carried out, e.g. when a book is not found.
+    The message is meant to be shown to the user as is.
+    """
+
+# Messages of invalid dates and times
+INVALID_DATE = "Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020)."
+INVALID_TIME = "Invalid time format. Please enter the time in the format 'hour:minutes AM/PM' (e.g., 9:30 AM)."
 
-# Saves the encryption key to a file
-def save_key(key, key_file):
-    with open(key_file, "wb") as file:
-        file.write(key)
+# Raises a LibraryError if a date is not in the 'Day Month Year' format
+def check_date(date_str):
+    if not validate_date(date_str):
+        raise LibraryError(INVALID_DATE)
 
-# Encrypts data using the encryption key
-def encrypt(data, key):
-    cipher = Fernet(key)
-    return cipher.encrypt(data.encode())
+# Raises a LibraryError if a time is not in the 'hour:minutes AM/PM' format
+def check_time(time_str):
+    if not validate_time(time_str):
+        raise LibraryError(INVALID_TIME)
 
-# Decrypts data using the encryption key
-def decrypt(encrypted_data, key):
-    cipher = Fernet(key)
-    return cipher.decrypt(encrypted_data).decode()
+# Rows shown per page of a listing (0 shows every row at once)
+PAGE_SIZE = 20
+# Most listings being paged at once; the cursor of the oldest is dropped when another one starts
+MAX_CURSORS = 100
+# Service methods that list rows, and can be paged and searched
+LISTINGS = ('all_books', 'borrow_entries', 'log_entries')
 
-# Encrypts data and save it to a file
-def encrypt_and_save(data, key, key_file):
-    encrypted_data = encrypt(data, key)
-    with open(key_file, "wb") as file:
-        file.write(encrypted_data)
+# Keeps the rows with a field containing the search text (ignoring case), or every row if there is no text
+def search_rows(rows, text=None):
+    if not text:
+        return rows
+    text = text.lower()
+    return (row for row in rows if any(text in str(value).lower() for value in row.values()))
 
-# Loads encrypted data from a file and decrypts it
-def load_and_decrypt(key_file, key):
-    with open(key_file, "rb") as file:
-        encrypted_data = file.read()
-    return decrypt(encrypted_data, key)
+class LibraryService:
+    """
+    Non-interactive interface to the library: books, borrowing and returning, visits and reports.
+    Works on the module's dictionaries, indexes and storage backend, so it always follows use_storage().
+    """
 
-# Constants for file paths
-ENCRYPTED_BOOKS_FILE = 'books.txt'
-ENCRYPTED_BORROW_LIST_FILE = 'borrow_list.txt'
-ENCRYPTED_LOGBOOK_FILE = 'logbook.txt'
+    def __init__(self):
+        self.cursors = {}  # Cursor -> (first row of the next page, iterator of the rows after it), oldest first
+        self.cursor_numbers = itertools.count(1)
 
-# Generates or loads encryption key
-key_file = "encryption_key.key"
-try:
-    key = load_key(key_file)
-except FileNotFoundError:
-    key = generate_key()
-    save_key(key, key_file)
+    def count(self, name):
+        """
+        Returns the number of records in a dictionary ('books', 'borrow_list' or 'logbook').
+        """
+        return len({'books': books, 'borrow_list': borrow_list, 'logbook': logbook}[name])
 
-# Modify the function to encrypt data before saving
-def save_data(data, key_file):
+    def find_book(self, title, author=None, status=None):
+        """
+        Finds a book by title, or by title and author, optionally only among books with a given status.
+
+        Returns:
+            str: The book ID, or None if no book matches.
+        """
+        if author is None:
+            return book_index.find_by_title(title)
+        return book_index.find(title, author, status)
+
+    # Book Management
+
+    def add_book(self, title, author, date_published):
+        """
+        Adds a new, available book to the library inventory.
+
+        Returns:
+            dict: The new book's Book_ID.
+        """
+        check_date(date_published)
+        with flush_manager.changes():
+            book_id = id_allocator.new_id('books')
+            books[book_id] = Book(title, author, date_published)
+            book_index.add_book(book_id, books[book_id])
+            if search_index.built:
+                search_index.add_book(book_id, books[book_id])
+            flush_manager.mark('books', book_id)
+        return {'Book_ID': book_id}
+
+    def delete_book(self, title, author):
+        """
+        Deletes a book, and every borrow entry of the book, based on title and author.
+
+        Returns:
+            dict: The Book_ID of the deleted book and the Borrow_IDs of its deleted borrow entries.
+        """
+        with flush_manager.changes():
+            book_id = book_index.find(title, author)
+            if not book_id:
+                raise LibraryError("Book not found.")
+            circulation_stats.remove_book(book_id, self.borrower_of(book_id))
+            del books[book_id]
+            book_index.remove_book(book_id)
+            if search_index.built:
+                search_index.remove_book(book_id)
+            flush_manager.mark('books', book_id)
+
+            # Remove the book from borrow_list as well
+            borrow_ids_to_delete = book_index.borrows_of(book_id)
+            for borrow_id in borrow_ids_to_delete:
+                del borrow_list[borrow_id]
+                book_index.remove_borrow(borrow_id)
+                return_date_index.remove(borrow_id)
+                flush_manager.mark('borrow_list', borrow_id)  # Save updated borrow list
+        return {'Book_ID': book_id, 'Borrow_IDs': borrow_ids_to_delete}
+
+    def delete_all_books(self):
+        """
+        Deletes all books and all borrow entries.
+
+        Returns:
+            dict: The number of books and borrow entries deleted.
+        """
+        with flush_manager.changes():
+            result = {'Books': len(books), 'Borrow Entries': len(borrow_list)}
+            circulation_stats.clear('borrows', 'loans')
+            books.clear()
+            borrow_list.clear()  # Clear the borrow list as well
+            book_index.rebuild(books, borrow_list)
+            return_date_index.rebuild(borrow_list)
+            search_index.reset()
+            flush_manager.mark('books')
+            flush_manager.mark('borrow_list')  # Save updated (cleared) borrow list
+        return result
+
+    def edit_book(self, title, new_title, new_author, new_date_published):
+        """
+        Replaces the title, author and date published of the book with the given title.
+        Its status and list of borrowers are kept.
+
+        Returns:
+            dict: The Book_ID of the edited book.
+        """
+        check_date(new_date_published)
+        with flush_manager.changes():
+            book_id = book_index.find_by_title(title)
+            if not book_id:
+                raise LibraryError("Book not found.")
+            book = books[book_id]
+            books[book_id] = Book(new_title, new_author, new_date_published, book['Status'], book['List of Borrowers'])
+            book_index.add_book(book_id, books[book_id])
+            if search_index.built:
+                search_index.add_book(book_id, books[book_id])
+            flush_manager.mark('books', book_id)
+        return {'Book_ID': book_id}
+
+    def get_book(self, title):
+        """
+        Looks up the book with the given title.
+
+        Returns:
+            dict: The book's Book_ID, Title, Author, Date Published, Status and the names of its Borrowers.
+        """
+        book_id = book_index.find_by_title(title)
+        if not book_id:
+            raise LibraryError("Book not found.")
+        book = books[book_id]
+        return {
+            'Book_ID': book_id,
+            'Title': book['Title'],
+            'Author': book['Author'],
+            'Date Published': book['Date Published'],
+            'Status': book['Status'],
+            'Borrowers': [logbook[log_id]['Person Name'] for log_id in book['List of Borrowers']]
+        }
+
+    def search_books(self, query, limit=10):
+        """
+        Finds the books whose title and author best match the words of a query, forgiving misspelled words.
+
+        Returns:
+            list: Up to limit books, best match first, each with its Book_ID, Title, Author, Date Published, Status and Score.
+        """
+        rows = []
+        for book_id, score in search_index.search(query, limit):
+            book = books[book_id]
+            rows.append({
+                'Book_ID': book_id,
+                'Title': book['Title'],
+                'Author': book['Author'],
+                'Date Published': book['Date Published'],
+                'Status': book['Status'],
+                'Score': round(score, 3)
+            })
+        return rows
+
+    def all_books(self, text=None):
+        """
+        Yields every stored book (or every book with a field containing the search text)
+        as a dictionary with its Book_ID, Title, Author, Date Published and Status.
+        """
+        rows = ({
+            'Book_ID': book_id,
+            'Title': book['Title'],
+            'Author': book['Author'],
+            'Date Published': book['Date Published'],
+            'Status': book['Status']
+        } for book_id, book in stream_records(books))
+        return search_rows(rows, text)
+
+    def pending_books(self):
+        """
+        Returns the rows of every unavailable book with its last borrower and expected return date.
+        """
+        with flush_manager.synced():
+            return storage.pending_books()
+
+    # Borrow and Return Books
+
+    def log_entry(self, person_name, date, time, purpose):
+        """
+        Adds an entry to the logbook and marks it as dirty. Call inside a flush_manager.changes() block.
+
+        Returns:
+            str: The new Log_ID.
+        """
+        log_id = id_allocator.new_id('logbook')
+        entry = LogEntry(person_name, date, time, purpose)
+        circulation_stats.count_visit(entry)
+        logbook[log_id] = entry
+        log_date_index.add(log_id, logbook[log_id])
+        if log_columns.built:
+            log_columns.add(log_id, logbook[log_id])
+        flush_manager.mark('logbook', log_id)
+        return log_id
+
+    def borrow(self, person_name, date, time, title, author, date_return):
+        """
+        Lends an available book to a person, logging the borrow and making the book unavailable.
+
+        Returns:
+            dict: The Book_ID of the book, and the Borrow_ID and Log_ID of the new borrow and log entries.
+        """
+        check_date(date)
+        check_time(time)
+        check_date(date_return)
+        with flush_manager.changes():
+            book_id = book_index.find(title, author, Status.AVAILABLE)
+            if not book_id:
+                raise LibraryError("Book not available or not found.")
+            circulation_stats.add('borrows', book_id)
+            circulation_stats.add('loans', person_name)
+            log_id = self.log_entry(person_name, date, time, Purpose.BORROW)
+            book = books[book_id]
+            borrow_id = id_allocator.new_id('borrow_list')
+            borrow_list[borrow_id] = BorrowEntry(book_id, log_id, date_return)  # Ensure the key is stored as a string
+            # Update book status and list of borrowers
+            book['Status'] = Status.UNAVAILABLE
+            book['List of Borrowers'].append(log_id)
+            book_index.update_status(book_id, Status.UNAVAILABLE)
+            book_index.add_borrow(borrow_id, borrow_list[borrow_id])
+            book_index.open_loan(book_id, borrow_id)
+            return_date_index.add(borrow_id, borrow_list[borrow_id])
+            # Save updated data to files (all three in one flush)
+            flush_manager.mark('books', book_id)
+            flush_manager.mark('borrow_list', borrow_id)
+        return {'Book_ID': book_id, 'Borrow_ID': borrow_id, 'Log_ID': log_id}
+
+    def return_book(self, person_name, date, time, title, author):
+        """
+        Takes back a borrowed book, logging the return and making the book available again.
+
+        Returns:
+            dict: The Book_ID of the book and the Log_ID of the new log entry.
+        """
+        check_date(date)
+        check_time(time)
+        with flush_manager.changes():
+            book_id = book_index.find(title, author, Status.UNAVAILABLE)
+            if not book_id:
+                raise LibraryError("Book not found or already available.")
+            borrower = self.borrower_of(book_id)
+            if borrower is not None:
+                circulation_stats.add('loans', borrower, -1)
+            log_id = self.log_entry(person_name, date, time, Purpose.RETURN)
+            books[book_id]['Status'] = Status.AVAILABLE
+            book_index.update_status(book_id, Status.AVAILABLE)
+            book_index.close_loan(book_id)
+            flush_manager.mark('books', book_id)
+        return {'Book_ID': book_id, 'Log_ID': log_id}
+
+    # Returns the name of the person a book is out with, or None if it is not out on a loan
+    def borrower_of(self, book_id):
+        borrow_id = book_index.open_loans.get(book_id)
+        if borrow_id is None:
+            return None
+        return logbook[borrow_list[borrow_id]['Log_ID']]['Person Name']
+
+    def borrow_entries(self, outstanding_only=False, text=None):
+        """
+        Returns the rows of every borrow entry, or only of the outstanding loans,
+        keeping only the rows with a field containing the search text if one is given.
+        """
+        with flush_manager.synced():
+            rows = storage.borrow_entries(outstanding_only)
+        return list(search_rows(rows, text))
+
+    def expected_returns(self, date):
+        """
+        Returns the rows of the borrow entries due on a date.
+        """
+        check_date(date)
+        ordinal = date_to_ordinal(date)
+        with flush_manager.synced():
+            return storage.returns_due(ordinal, ordinal)
+
+    def returns_due_in_week(self, date):
+        """
+        Returns the rows of the borrow entries due in the seven days starting on a date, in date order.
+        """
+        check_date(date)
+        first = date_to_ordinal(date)
+        with flush_manager.synced():
+            return storage.returns_due(first, first + 6)
+
+    def overdue_loans(self, date):
+        """
+        Returns the rows of the outstanding loans that were due before a date, with their Days Overdue.
+        """
+        check_date(date)
+        with flush_manager.synced():
+            return storage.overdue_loans(date_to_ordinal(date))
+
+    # Logbook
+
+    def visit(self, person_name, date, time):
+        """
+        Records a visit to the library.
+
+        Returns:
+            dict: The Log_ID of the new log entry.
+        """
+        check_date(date)
+        check_time(time)
+        with flush_manager.changes():
+            log_id = self.log_entry(person_name, date, time, Purpose.VISIT)
+        return {'Log_ID': log_id}
+
+    def log_entries(self, text=None):
+        """
+        Yields every log entry (or every entry with a field containing the search text)
+        as a dictionary with its Log_ID, Person Name, Date, Time and Purpose.
+        If the logbook is not loaded yet, it is streamed from storage instead of being loaded whole.
+        """
+        rows = (dict(entry, Log_ID=log_id) for log_id, entry in stream_records(logbook))
+        return search_rows(rows, text)
+
+    def page(self, listing, cursor=None, page_size=PAGE_SIZE, text=None):
+        """
+        Returns one page of the rows of all_books, borrow_entries or log_entries, searched for text if given.
+        The first page (cursor None) starts the listing and the Next Cursor of each page resumes it where the page
+        ended, so a page costs the same however far into the listing it is. Records added or deleted while a
+        listing is paged never make a row show up twice or be skipped. Only MAX_CURSORS listings are kept open.
+
+        Returns:
+            dict: The Rows of the page and the Next Cursor (None after the last page).
+        """
+        if listing not in LISTINGS:
+            raise LibraryError(f"Unknown listing '{listing}'.")
+        if cursor is None:
+            rows = iter(getattr(self, listing)(text=text))
+            page = list(itertools.islice(rows, page_size + 1))
+        else:
+            if cursor not in self.cursors:
+                raise LibraryError("This listing has expired. Please start again from the first page.")
+            first_row, rows = self.cursors.pop(cursor)
+            page = [first_row] + list(itertools.islice(rows, page_size))
+        if len(page) <= page_size:
+            return {'Rows': page, 'Next Cursor': None}
+        next_cursor = f'{listing}-{next(self.cursor_numbers)}'
+        self.cursors[next_cursor] = (page[page_size], rows)
+        if len(self.cursors) > MAX_CURSORS:
+            del self.cursors[next(iter(self.cursors))]
+        return {'Rows': page[:page_size], 'Next Cursor': next_cursor}
+
+    def transactions_on(self, date):
+        """
+        Returns every log entry of a date.
+        """
+        check_date(date)
+        with flush_manager.synced():
+            return storage.transactions_on(date_to_ordinal(date))
+
+    def logbook_statistics(self, first_date=None, last_date=None, top=10):
+        """
+        Counts the log entries made from the first to the last date (both included, None for no limit)
+        by purpose, day and hour, and the borrows of the top borrowers. See LogColumns.summary.
+        """
+        limits = []
+        for date in (first_date, last_date):
+            if date is not None:
+                check_date(date)
+                date = date_to_ordinal(date)
+            limits.append(date)
+        return log_columns.summary(limits[0], limits[1], top)
+
+    def circulation_summary(self, top=10):
+        """
+        Reads the circulation counters: the totals of Borrows, current Loans and Visits, how many Books Borrowed,
+        Borrowers (with a book out) and Days Visited they cover, and the top books, borrowers and days.
+        See CirculationStats.summary.
+
+        Returns:
+            dict: The summary, with Most Borrowed as rows with the Book_ID, Title, Author and Borrows of each book.
+        """
+        summary = circulation_stats.summary(top)
+        summary['Most Borrowed'] = [{
+            'Book_ID': book_id,
+            'Title': books[book_id]['Title'],
+            'Author': books[book_id]['Author'],
+            'Borrows': count
+        } for book_id, count in summary['Most Borrowed']]
+        return summary
+
+    def visits_per_day(self, first_date=None, last_date=None):
+        """
+        Returns [date, visits] for every day with visits from the first to the last date (both included,
+        None for no limit), in date order, read from the circulation counters.
+        """
+        limits = []
+        for date in (first_date, last_date):
+            if date is not None:
+                check_date(date)
+                date = date_to_ordinal(date)
+            limits.append(date)
+        return circulation_stats.visits_between(limits[0], limits[1])
+
+    def rebuild_circulation_stats(self):
+        """
+        Counts the circulation counters again from the books, borrow list and logbook, and saves them.
+
+        Returns:
+            dict: The new totals of Borrows, Loans and Visits.
+        """
+        with flush_manager.changes():
+            circulation_stats.rebuild()
+        return {'Borrows': circulation_stats.totals['borrows'], 'Loans': circulation_stats.totals['loans'],
+                'Visits': circulation_stats.totals['visits']}
+
+    def merge_logbook(self, directory):
+        """
+        Adds the log entries of another branch of the library, a directory with its own logbook.txt and
+        encryption_key.key, that this logbook does not hold yet. Entries are matched by Person Name, Date,
+        Time and Purpose, so the entries both branches started from, and entries merged before, are skipped.
+        The merged entries get new Log_IDs, in the order the branch logged them.
+
+        Returns:
+            dict: The number of entries Merged and Skipped, and the new Log_ID of each merged entry (Log_IDs).
+        """
+        logbook_file = os.path.join(directory, ENCRYPTED_LOGBOOK_FILE)
+        branch_key_file = os.path.join(directory, key_file)
+        for path in (logbook_file, branch_key_file):
+            if not os.path.exists(path):
+                raise LibraryError(f"{path} not found.")
+        branch = load_data(logbook_file, get_cipher(load_key(branch_key_file)), LogEntry)
+        log_ids = {}
+        with flush_manager.changes():
+            # Entries already held, counted so that an entry logged twice in a branch is merged twice
+            held = collections.Counter(tuple(entry.values()) for entry in logbook.values())
+            for branch_log_id, entry in branch.items():
+                fields = tuple(entry.values())
+                if held[fields]:
+                    held[fields] -= 1
+                else:
+                    log_ids[branch_log_id] = self.log_entry(*fields)
+        return {'Merged': len(log_ids), 'Skipped': len(branch) - len(log_ids), 'Log_IDs': log_ids}
+
+    def close(self):
+        """
+        Saves every change that is still waiting to be flushed. Called when the menu exits.
+        """
+        flush_manager.close()
+
+# The service used by the menu
+library = LibraryService()
+
+# Server Module
+# Several circulation desks can share one library by running a server that owns the dictionaries
+# (python library_system.py serve) and connecting each desk to it (python library_system.py --connect ADDRESS).
+# Desks send one JSON request per line, {"id": 1, "method": "borrow", "args": [...]}, and get one JSON
+# response per line, {"id": 1, "result": ...} or {"id": 1, "error": "..."}. Reads are answered as soon as
+# they arrive, from memory. Writes are queued for a single writer task, which runs every write waiting
+# in the queue in one flush_manager.changes() block, so they are saved together in one flush (group commit).
+# The flush runs in a worker thread, so the event loop keeps answering reads while it writes to disk.
+
+# Address the server listens on: 'host:port', or the path of a Unix socket
+SERVER_ADDRESS = '127.0.0.1:7717'
+# Most writes committed together by the writer task
+WRITE_BATCH_SIZE = 256
+
+# LibraryService methods that only read, and methods that change the library
+READ_METHODS = ('count', 'find_book', 'get_book', 'search_books', 'all_books', 'pending_books', 'borrow_entries',
+                'expected_returns', 'returns_due_in_week', 'overdue_loans', 'log_entries', 'transactions_on',
+                'logbook_statistics', 'circulation_summary', 'visits_per_day', 'page')
+WRITE_METHODS = ('add_book', 'delete_book', 'delete_all_books', 'edit_book', 'borrow', 'return_book', 'visit',
+                 'rebuild_circulation_stats')
+# Read methods that query storage (through flush_manager.synced()), so they wait for the flush in progress
+STORAGE_READ_METHODS = ('pending_books', 'borrow_entries', 'expected_returns', 'returns_due_in_week', 'overdue_loans',
+                        'transactions_on', 'page')
+
+# Splits an address into (host, port), or returns it as is if it is the path of a Unix socket
+def parse_address(address):
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit():
+        return host or '127.0.0.1', int(port)
+    return address
+
+class LibraryServer:
     """
-    Encrypts and saves data from the dictionary to the specified file.
+    Serves a LibraryService to many clients over TCP or a Unix socket.
+    All the dictionaries stay in the server's event loop, so requests never see a half-done write.
+    Flushes run in a worker thread, so reads are answered while the writes before them are being saved.
+    """
+
+    def __init__(self, service, address=SERVER_ADDRESS, batch_size=WRITE_BATCH_SIZE):
+        self.service = service
+        self.address = parse_address(address)
+        self.batch_size = batch_size
+        self.writes = None  # Queue of (method, args, future), created in the event loop
+        self.flushing = None  # Future of the flush running in a worker thread, if any
+
+    async def serve(self):
+        self.writes = asyncio.Queue()
+        # Load the dictionaries now rather than on the first request
+        for name in ('books', 'borrow_list', 'logbook'):
+            self.service.count(name)
+        circulation_stats.load()
+        if isinstance(self.address, tuple):
+            server = await asyncio.start_server(self.handle_client, *self.address)
+        else:
+            server = await asyncio.start_unix_server(self.handle_client, self.address)
+        print(f"Library server listening on {self.address}")
+        # Stop cleanly on SIGTERM, so the changes still waiting are flushed
+        stopping = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+        except (NotImplementedError, AttributeError):
+            pass  # Not available on Windows
+        writer = asyncio.create_task(self.write_loop())
+        try:
+            async with server:
+                await stopping.wait()
+        finally:
+            writer.cancel()
+
+    async def handle_client(self, reader, writer):
+        """
+        Answers the requests of one client, in the order they were sent.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                response = {'id': request.get('id')}
+                try:
+                    response['result'] = await self.execute(request['method'], request.get('args', []))
+                except (LibraryError, StorageError) as error:
+                    response['error'] = str(error)
+                except Exception as error:
+                    response['error'] = f"Server error: {error!r}"
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def execute(self, method, args):
+        if method in READ_METHODS:
+            if method in STORAGE_READ_METHODS and self.flushing is not None:
+                await asyncio.wait([self.flushing])  # Storage is only read once the writes before are saved
+            result = getattr(self.service, method)(*args)
+            return list(result) if hasattr(result, '__next__') else result  # Generators are sent as lists
+        if method in WRITE_METHODS:
+            future = asyncio.get_running_loop().create_future()
+            await self.writes.put((method, args, future))
+            return await future
+        raise LibraryError(f"Unknown method '{method}'.")
+
+    async def write_loop(self):
+        """
+        The single writer: takes every write waiting in the queue (up to batch_size), runs them
+        one after the other inside one flush_manager.changes() block and answers them once they are flushed
+        (or handed to the flush thread, when FLUSH_DELAY is set). The flush runs in a worker thread while
+        the event loop goes on answering reads; no other write is applied until it is done, so the flush
+        saves the dictionaries exactly as the batch left them.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.writes.get()]
+            await asyncio.sleep(0)  # Let the clients that are ready queue their writes too
+            while len(batch) < self.batch_size and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            results = []
+            try:
+                with flush_manager.changes(flush=False):
+                    for method, args, future in batch:
+                        try:
+                            results.append((future, getattr(self.service, method)(*args), None))
+                        except Exception as error:
+                            results.append((future, None, error))
+                if flush_manager.delay is None:
+                    self.flushing = loop.run_in_executor(None, flush_manager.flush)
+                    try:
+                        await self.flushing
+                    finally:
+                        self.flushing = None
+            except Exception as error:
+                results = [(future, None, error) for _, _, future in batch]
+            for future, result, error in results:
+                if future.cancelled():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+def serve(address=SERVER_ADDRESS, batch_size=WRITE_BATCH_SIZE):
+    """
+    Runs the library server until it is interrupted.
 
     Args:
-        data (dict): The data to be saved.
-        key_file (str): The path to the file where encrypted data is to be saved.
+        address (str): 'host:port', or the path of a Unix socket.
+        batch_size (int): The most writes committed together.
     """
     try:
-        # Convert data to string before encrypting (if necessary)
-        data_str = str(data)
-        encrypt_and_save(data_str, key, key_file)
-    except Exception as e:
-        print("Error encrypting and saving data:", e)
+        asyncio.run(LibraryServer(library, address, batch_size).serve())
+    except KeyboardInterrupt:
+        pass
+    library.close()
+    print("Library server stopped.")
 
-# Modify the functions to encrypt and decrypt data before saving and loading
-def load_data(key_file):
+class LibraryClient:
+    """
+    Connects to a library server and calls the LibraryService methods on it.
+    It has the same methods as LibraryService, so the menu can use it in place of the local service.
     """
-    Loads and decrypts data from the specified file into a dictionary.
-    If the file is not found or decryption fails, an empty dictionary is returned.
 
-    Args:
-        key_file (str): The path to the file from which data is to be loaded.
+    def __init__(self, address=SERVER_ADDRESS):
+        address = parse_address(address)
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        self.file = self.socket.makefile('rwb')
+        self.request_id = 0
 
-    Returns:
-        dict: A dictionary containing the decrypted data loaded from the file or an empty dictionary if file is not found or decryption fails.
-    """
-    try:
-        decrypted_data = load_and_decrypt(key_file, key)
-        return eval(decrypted_data)  # Use eval to convert string representation of dictionary back to dictionary
-    except Exception as e:
-        print("--------CREATING FILE--------")
-        return {}
-
-# Initializes dictionaries
-books = load_data(ENCRYPTED_BOOKS_FILE) or {}
-borrow_list = load_data(ENCRYPTED_BORROW_LIST_FILE) or {}
-logbook = load_data(ENCRYPTED_LOGBOOK_FILE) or {}
-
-# Creates files if not present yet
-if not books:
-    save_data({}, ENCRYPTED_BOOKS_FILE)
-if not borrow_list:
-    save_data({}, ENCRYPTED_BORROW_LIST_FILE)
-if not logbook:
-    save_data({}, ENCRYPTED_LOGBOOK_FILE)
-if not logbook:
-    save_data({}, ENCRYPTED_LOGBOOK_FILE)
-    
-# Functions to validate date and time format
+    def call(self, method, *args):
+        """
+        Calls a LibraryService method on the server and waits for its result.
+        Raises LibraryError if the server reports an error.
+        """
+        self.request_id += 1
+        self.file.write(json.dumps({'id': self.request_id, 'method': method, 'args': args}).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise LibraryError("Connection to the library server was closed.")
+        response = json.loads(line)
+        if 'error' in response:
+            raise LibraryError(response['error'])
+        return response['result']
 
-def validate_date(date_str):
+    def __getattr__(self, method):
+        if method not in READ_METHODS and method not in WRITE_METHODS:
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+# Output Module
+# The listings are printed through print_rows, which renders a whole page of rows into one string and writes
+# it with a single call instead of one print() per field. With a page size it stops after every page until
+# the user asks for the next one, so a long listing can be stopped (q, or Ctrl+C) at any page. export_listing
+# streams a listing to a CSV or JSONL file through the same batches, one write per ROWS_PER_WRITE rows.
+
+# Rows rendered into one write when a listing is not paginated, or is exported
+ROWS_PER_WRITE = 1000
+SEPARATOR = "-----------------------------------\n"
+
+# Fields of the rows of each listing, as (label, key) pairs
+LISTING_COLUMNS = {
+    'all_books': (('Book ID', 'Book_ID'), ('Title', 'Title'), ('Author', 'Author'),
+                  ('Date Published', 'Date Published'), ('Status', 'Status')),
+    'borrow_entries': (('Borrow_ID', 'Borrow_ID'), ('Title', 'Title'), ('Author', 'Author'),
+                       ('Date Published', 'Date Published'), ('Date Return', 'Date Return'), ('Borrower', 'Borrower')),
+    'log_entries': (('Log_ID', 'Log_ID'), ('Person Name', 'Person Name'), ('Date', 'Date'), ('Time', 'Time'), ('Purpose', 'Purpose'))
+}
+
+# Renders a row as the block of lines the listings print for it
+def render_row(row, columns):
+    return SEPARATOR + ''.join(f"{label}: {row[key]}\n" for label, key in columns) + SEPARATOR
+
+def print_rows(rows, columns, page_size=None):
     """
-    Validates if the input date string is in the correct format.
-    
+    Prints rows as they are produced, a page at a time, with one write per page.
+
     Args:
-        date_str (str): The input date string.
-        
+        rows (iterable): The rows (dictionaries) to print. A generator is only read as far as it is printed.
+        columns (tuple): The (label, key) pairs of the fields to print.
+        page_size (int): Rows printed before asking whether to go on. Defaults to PAGE_SIZE; 0 prints every row.
+
     Returns:
-        bool: True if the date string is in the correct format, False otherwise.
+        int: The number of rows printed.
     """
+    page_size = PAGE_SIZE if page_size is None else page_size
+    rows = iter(rows)
+    printed = 0
     try:
-        datetime.datetime.strptime(date_str, '%d %b %Y')
-        return True
-    except ValueError:
-        return False
+        while True:
+            page = list(itertools.islice(rows, page_size or ROWS_PER_WRITE))
+            if not page:
+                break
+            sys.stdout.write(''.join(render_row(row, columns) for row in page))
+            sys.stdout.flush()
+            printed += len(page)
+            if page_size and len(page) == page_size:
+                next_row = next(rows, None)
+                if next_row is None:
+                    break
+                rows = itertools.chain([next_row], rows)
+                answer = input(f"Showing {printed - len(page) + 1}-{printed}. Press Enter for more, or q to stop: ")
+                if answer.strip().lower() == 'q':
+                    break
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    return printed
 
-def validate_time(time_str):
+def export_listing(listing, path, file_format=None, text=None):
     """
-    Validates if the input time string is in the correct format.
-    
+    Streams the rows of a listing to a CSV file (with a header row) or a JSONL file (one JSON object per line).
+    The rows are rendered in batches of ROWS_PER_WRITE and the file replaces any old one only once it is complete.
+
     Args:
-        time_str (str): The input time string.
-        
+        listing (str): 'all_books', 'borrow_entries' or 'log_entries'.
+        path (str): The path of the file to write.
+        file_format (str): 'csv' or 'jsonl'. Defaults to the file's extension.
+        text (str): Only export the rows with a field containing this text.
+
     Returns:
-        bool: True if the time string is in the correct format, False otherwise.
+        int: The number of rows exported.
     """
-    try:
-        datetime.datetime.strptime(time_str, '%I:%M %p')
-        return True
-    except ValueError:
-        return False
-
+    if file_format is None:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    keys = [key for _, key in LISTING_COLUMNS[listing]]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if file_format == 'csv':
+        writer.writerow(keys)
+    exported = 0
+    if listing == 'borrow_entries':
+        rows = library.borrow_entries(False, text)
+    else:
+        rows = getattr(library, listing)(text)
+    with atomic_write(path) as file:
+        for exported, row in enumerate(rows, start=1):
+            if file_format == 'csv':
+                writer.writerow([row[key] for key in keys])
+            else:
+                buffer.write(json.dumps({key: row[key] for key in keys}) + '\n')
+            if exported % ROWS_PER_WRITE == 0:
+                file.write(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+        file.write(buffer.getvalue().encode('utf-8'))
+    return exported
 
 # Book Management Module
 
@@ -164,16 +3828,8 @@ def add_book():
         print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
         date_published = input("Enter date published: ")
         
-    book_id = f'B{len(books) + 1}'
-    books[book_id] = {
-        'Title': title,
-        'Author': author,
-        'Date Published': date_published,
-        'Status': 'Available',
-        'List of Borrowers': []
-    }
-    save_data(books, ENCRYPTED_BOOKS_FILE)
-    print(f"Book {book_id} added successfully.")
+    result = library.add_book(title, author, date_published)
+    print(f"Book {result['Book_ID']} added successfully.")
 
 def delete_book():
     """
@@ -183,26 +3839,12 @@ def delete_book():
     """
     title = input("Enter title of the book to delete: ").strip()  # Remove leading and trailing whitespace
     author = input("Enter author of the book to delete: ").strip()  # Remove leading and trailing whitespace
-    book_id = None
-    for id, book in books.items():
-        # Strip leading and trailing whitespace for comparison
-        if book['Title'].strip() == title and book['Author'].strip() == author:
-            book_id = id
-            break
-    if book_id:
-        del books[book_id]
-        
-        # Remove the book from borrow_list as well
-        borrow_ids_to_delete = [borrow_id for borrow_id, entry in borrow_list.items() if entry['Book_ID'] == book_id]
-        for borrow_id in borrow_ids_to_delete:
-            del borrow_list[borrow_id]
-        
-        save_data(books, ENCRYPTED_BOOKS_FILE)
-        save_data(borrow_list, ENCRYPTED_BORROW_LIST_FILE)  # Save updated borrow list
-
+    try:
+        library.delete_book(title, author)
         print(f"Book '{title}' by {author} was deleted successfully.")
-    else:
-        print("Book not found.")
+    except LibraryError as error:
+        print(error)
+        suggest_books(f"{title} {author}")
 
 def delete_all_books():
     """
@@ -212,10 +3854,7 @@ def delete_all_books():
     """
     confirm = input("Are you sure you want to delete all books? (yes/no): ")
     if confirm.lower() == 'yes':
-        books.clear()
-        borrow_list.clear()  # Clear the borrow list as well
-        save_data(books, ENCRYPTED_BOOKS_FILE)
-        save_data(borrow_list, ENCRYPTED_BORROW_LIST_FILE)  # Save updated (cleared) borrow list
+        library.delete_all_books()
         print("All books were deleted successfully.")
     else:
         print("Operation canceled.")
@@ -227,19 +3866,21 @@ def view_book():
     Prompts the user for the book title and displays its details if found.
     """
     title = input("Enter title of the book to view: ")
-    for book in books.values():
-        if book['Title'] == title:
-            print("-----------------------------------")
-            print(f"Title: {book['Title']}")
-            print(f"Author: {book['Author']}")
-            print(f"Date Published: {book['Date Published']}")
-            print(f"Status: {book['Status']}")
-            print("List of Borrowers:")
-            for borrower_id in book['List of Borrowers']:
-                print("-",logbook[borrower_id]['Person Name'])
-            print("-----------------------------------")
-            return
-    print("Book not found.")
+    try:
+        book = library.get_book(title)
+    except LibraryError as error:
+        print(error)
+        suggest_books(title)
+        return
+    print("-----------------------------------")
+    print(f"Title: {book['Title']}")
+    print(f"Author: {book['Author']}")
+    print(f"Date Published: {book['Date Published']}")
+    print(f"Status: {book['Status']}")
+    print("List of Borrowers:")
+    for borrower in book['Borrowers']:
+        print("-", borrower)
+    print("-----------------------------------")
 
 def edit_book():
     """
@@ -247,26 +3888,37 @@ def edit_book():
     Prompts the user for the book title and new details, and updates the book information.
     """
     title = input("Enter title of the book to edit: ")
-    for book_id, book in books.items():
-        if book['Title'] == title:
-            new_title = input("Enter new title: ")
-            new_author = input("Enter new author: ")
-            new_date_published = input("Enter new date published (e.g. 9 Jan 2020): ")
-            while not validate_date(new_date_published):
-                print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
-                new_date_published = input("Enter new date published: ")
-                
-            books[book_id] = {
-                'Title': new_title,
-                'Author': new_author,
-                'Date Published': new_date_published,
-                'Status': book['Status'],
-                'List of Borrowers': book['List of Borrowers']
-            }
-            save_data(books, ENCRYPTED_BOOKS_FILE)
-            print("Book updated successfully.")
-            return
-    print("Book not found.")
+    if not library.find_book(title):
+        print("Book not found.")
+        suggest_books(title)
+        return
+    new_title = input("Enter new title: ")
+    new_author = input("Enter new author: ")
+    new_date_published = input("Enter new date published (e.g. 9 Jan 2020): ")
+    while not validate_date(new_date_published):
+        print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
+        new_date_published = input("Enter new date published: ")
+    try:
+        library.edit_book(title, new_title, new_author, new_date_published)
+        print("Book updated successfully.")
+    except LibraryError as error:
+        print(error)
+
+def search_books():
+    """
+    Searches the books by words of their title or author, forgiving typos, and displays the best matches first.
+    """
+    query = input("Enter words of the title or author to search for: ")
+    if not print_rows(library.search_books(query), LISTING_COLUMNS['all_books']):
+        print("No books found.")
+
+# Prints the books that best match a title (and author) that was not found
+def suggest_books(query):
+    suggestions = library.search_books(query, 5)
+    if suggestions:
+        print("Did you mean:")
+        for book in suggestions:
+            print(f"- {book['Title']} by {book['Author']}")
 
 def view_pending():
     """
@@ -274,36 +3926,26 @@ def view_pending():
     Displays the book details along with the last borrower's name and expected return date.
     """
     found_pending_books = False  # Flag to track if any pending books are found
-    for book_id, book in books.items():
-        if book['Status'] == 'Unavailable':
-            found_pending_books = True  # Set flag to True if at least one unavailable book is found
-            print("-----------------------------------")
-            print(f"Title: {book['Title']}")
-            print(f"Author: {book['Author']}")
-            print(f"Date Published: {book['Date Published']}")
-            print(f"Status: {book['Status']}")
-            if book['List of Borrowers']:
-                last_borrower_id = book['List of Borrowers'][-1]  # Get the ID of the last borrower's log entry
-                borrow_key = None
-                for bl_id, bl_entry in borrow_list.items():
-                    if bl_entry['Log_ID'] == last_borrower_id:
-                        borrow_key = bl_id
-                        break
-
-                if borrow_key:
-                    borrow_info = borrow_list[borrow_key]
-                    expected_return_date = borrow_info.get('Date Return')
-                    if expected_return_date is not None:
-                        print(f"Expected Date of Return: {expected_return_date}")
-                        last_borrower_name = logbook[last_borrower_id]['Person Name']
-                        print(f"Last Borrower: {last_borrower_name}")
-                        print("-----------------------------------")
-                    else:
-                        print("Error: 'Date Return' not found in borrow list entry.")
+    for row in library.pending_books():
+        found_pending_books = True  # Set flag to True if at least one unavailable book is found
+        print("-----------------------------------")
+        print(f"Title: {row['Title']}")
+        print(f"Author: {row['Author']}")
+        print(f"Date Published: {row['Date Published']}")
+        print(f"Status: {row['Status']}")
+        if row['Last Borrower Log_ID']:
+            if row['Borrow_ID']:
+                expected_return_date = row['Date Return']
+                if expected_return_date is not None:
+                    print(f"Expected Date of Return: {expected_return_date}")
+                    print(f"Last Borrower: {row['Last Borrower']}")
+                    print("-----------------------------------")
                 else:
-                    print("Error: Borrower information not found in borrow list.")
+                    print("Error: 'Date Return' not found in borrow list entry.")
             else:
-                print("No borrower information available.")
+                print("Error: Borrower information not found in borrow list.")
+        else:
+            print("No borrower information available.")
     
     if not found_pending_books:
         print("No pending books.")
@@ -312,17 +3954,9 @@ def view_all_books(): # Extra Functionality written by Aa for Fun
     """
     Views all stored books along with their details.
     """
-    if books:
-        for book_id, book_info in books.items():
-            print("-----------------------------------")
-            print(f"Book ID: {book_id}")
-            print(f"Title: {book_info['Title']}")
-            print(f"Author: {book_info['Author']}")
-            print(f"Date Published: {book_info['Date Published']}")
-            print(f"Status: {book_info['Status']}")
-            print("-----------------------------------")
-    else:
-        print("No books stored.")
+    text = input("Search (blank for all): ")
+    if not print_rows(library.all_books(text), LISTING_COLUMNS['all_books']):
+        print("No books found." if text else "No books stored.")
 
 # Borrow and Return Books Module
 
@@ -340,40 +3974,21 @@ def borrow_book():
         print("Invalid time format. Please enter the time in the format 'hour:minutes AM/PM' (e.g., 9:30 AM).")
         time = input("Enter current time: ")
     
-    purpose = "borrow"
-    log_id = f'L{len(logbook) + 1}'
-    logbook[log_id] = {
-        'Person Name': person_name,
-        'Date': date,
-        'Time': time,
-        'Purpose': purpose
-    }
-    
     title = input("Enter title of the book to borrow: ")
     author = input("Enter author of the book to borrow: ")
-    for book_id, book in books.items():
-        if book['Title'] == title and book['Author'] == author and book['Status'] == 'Available':
-            date_return = input("Enter date of return (e.g. 9 Jan 2020): ")
-            while not validate_date(date_return):
-                print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
-                date_return = input("Enter date of return: ")
-            
-            borrow_id = f'BL{len(borrow_list) + 1}'
-            borrow_list[borrow_id] = {  # Ensure the key is stored as a string
-                'Book_ID': book_id,
-                'Log_ID': log_id,
-                'Date Return': date_return
-            }
-            # Update book status and list of borrowers
-            book['Status'] = 'Unavailable'
-            book['List of Borrowers'].append(log_id)
-            # Save updated data to files
-            save_data(books, ENCRYPTED_BOOKS_FILE)
-            save_data(borrow_list, ENCRYPTED_BORROW_LIST_FILE)
-            save_data(logbook, ENCRYPTED_LOGBOOK_FILE)
-            print(f"Book {book_id} borrowed successfully.")
-            return
-    print("Book not available or not found.")
+    if not library.find_book(title, author, Status.AVAILABLE):
+        print("Book not available or not found.")
+        suggest_books(f"{title} {author}")
+        return
+    date_return = input("Enter date of return (e.g. 9 Jan 2020): ")
+    while not validate_date(date_return):
+        print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
+        date_return = input("Enter date of return: ")
+    try:
+        result = library.borrow(person_name, date, time, title, author, date_return)
+        print(f"Book {result['Book_ID']} borrowed successfully.")
+    except LibraryError as error:
+        print(error)
 
 def return_book():
     """
@@ -388,48 +4003,31 @@ def return_book():
     while not validate_time(time):
         print("Invalid time format. Please enter the time in the format 'hour:minutes AM/PM' (e.g., 9:30 AM).")
         time = input("Enter current time: ")
-    purpose = "return"
-    log_id = f'L{len(logbook) + 1}'
-    logbook[log_id] = {
-        'Person Name': person_name,
-        'Date': date,
-        'Time': time,
-        'Purpose': purpose
-    }
     
     title = input("Enter title of the book to return: ")
     author = input("Enter author of the book to return: ")
-    for book_id, book in books.items():
-        if book['Title'] == title and book['Author'] == author and book['Status'] == 'Unavailable':
-            book['Status'] = 'Available'
-            save_data(books, ENCRYPTED_BOOKS_FILE)
-            save_data(logbook, ENCRYPTED_LOGBOOK_FILE)
-            print(f"Book {book_id} returned successfully.")
-            return
-    print("Book not found or already available.")
+    try:
+        result = library.return_book(person_name, date, time, title, author)
+        print(f"Book {result['Book_ID']} returned successfully.")
+    except LibraryError as error:
+        print(error)
 
 def view_all_entries():
     """
-    Views all borrow entries in the borrow list.
+    Views all borrow entries in the borrow list, or only the entries of outstanding loans.
     Displays details of each borrowed book along with the borrower's name and return date.
     """
-    if not borrow_list:
+    if not library.count('borrow_list'):
         print("No borrow entries found.")
         return
     
-    for borrow_id, entry in borrow_list.items():
-        book_id = entry['Book_ID']
-        log_id = entry['Log_ID']
-        book = books[book_id]
-        log_entry = logbook[log_id]
-        print("-----------------------------------")
-        print(f"Borrow_ID: {borrow_id}")
-        print(f"Title: {book['Title']}")
-        print(f"Author: {book['Author']}")
-        print(f"Date Published: {book['Date Published']}")
-        print(f"Date Return: {entry['Date Return']}")
-        print(f"Borrower: {log_entry['Person Name']}")
-        print("-----------------------------------")
+    outstanding_only = input("View only outstanding loans? (yes/no): ")
+    text = input("Search (blank for all): ")
+    rows = library.borrow_entries(outstanding_only.lower() == 'yes', text)
+    if not rows:
+        print("No matching borrow entries." if text else "No outstanding loans.")
+        return
+    print_rows(rows, LISTING_COLUMNS['borrow_entries'])
 
 def view_expected_returns():
     """
@@ -440,23 +4038,64 @@ def view_expected_returns():
     while not validate_date(date):
         print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
         date = input("Enter Date (e.g. 9 Jan 2020): ")
-    if not borrow_list:
+    if not library.count('borrow_list'):
         print("No expected returns.")
         return
-    for borrow_id, entry in borrow_list.items():
-        if entry['Date Return'] == date:
-            book_id = entry['Book_ID']
-            log_id = entry['Log_ID']
-            book = books[book_id]
-            log_entry = logbook[log_id]
-            print("-----------------------------------")
-            print(f"Borrow_ID: {borrow_id}")
-            print(f"Title: {book['Title']}")
-            print(f"Author: {book['Author']}")
-            print(f"Date Published: {book['Date Published']}")
-            print(f"Status: {book['Status']}")
-            print(f"Borrower: {log_entry['Person Name']}")
-            print("-----------------------------------")
+    for row in library.expected_returns(date):
+        print("-----------------------------------")
+        print(f"Borrow_ID: {row['Borrow_ID']}")
+        print(f"Title: {row['Title']}")
+        print(f"Author: {row['Author']}")
+        print(f"Date Published: {row['Date Published']}")
+        print(f"Status: {row['Status']}")
+        print(f"Borrower: {row['Borrower']}")
+        print("-----------------------------------")
+
+def view_returns_due_in_week():
+    """
+    Views all books expected to be returned within the seven days starting on a specified date.
+    Prompts the user for the first date and displays the borrow entries due in that week, in date order.
+    """
+    date = input("Enter first date of the week (e.g. 9 Jan 2020): ")
+    while not validate_date(date):
+        print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
+        date = input("Enter first date of the week (e.g. 9 Jan 2020): ")
+    rows = library.returns_due_in_week(date)
+    if not rows:
+        print("No returns due in that week.")
+        return
+    for row in rows:
+        print("-----------------------------------")
+        print(f"Borrow_ID: {row['Borrow_ID']}")
+        print(f"Title: {row['Title']}")
+        print(f"Author: {row['Author']}")
+        print(f"Date Return: {row['Date Return']}")
+        print(f"Status: {row['Status']}")
+        print(f"Borrower: {row['Borrower']}")
+        print("-----------------------------------")
+
+def view_overdue_loans():
+    """
+    Views all outstanding loans that were due before a specified date.
+    Prompts the user for today's date and displays each overdue loan with the number of days it is overdue.
+    """
+    date = input("Enter today's date (e.g. 9 Jan 2020): ")
+    while not validate_date(date):
+        print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
+        date = input("Enter today's date: ")
+    rows = library.overdue_loans(date)
+    if not rows:
+        print("No overdue loans.")
+        return
+    for row in rows:
+        print("-----------------------------------")
+        print(f"Borrow_ID: {row['Borrow_ID']}")
+        print(f"Title: {row['Title']}")
+        print(f"Author: {row['Author']}")
+        print(f"Date Return: {row['Date Return']}")
+        print(f"Days Overdue: {row['Days Overdue']}")
+        print(f"Borrower: {row['Borrower']}")
+        print("-----------------------------------")
 
 # Logbook Module
 
@@ -475,30 +4114,17 @@ def visit_library():
         print("Invalid time format. Please enter the time in the format 'hour:minutes AM/PM' (e.g., 9:30 AM).")
         time = input("Enter current time: ")
         
-    purpose = "visit"
-    log_id = f'L{len(logbook) + 1}'
-    logbook[log_id] = {
-        'Person Name': person_name,
-        'Date': date,
-        'Time': time,
-        'Purpose': purpose
-    }
-    save_data(logbook, ENCRYPTED_LOGBOOK_FILE)
-    print(f"Visit logged with Log_ID: {log_id}")
+    result = library.visit(person_name, date, time)
+    print(f"Visit logged with Log_ID: {result['Log_ID']}")
 
 def view_all_log_entries():
     """
     Views all entries in the logbook.
     Displays details of each entry including person name, date, time, and purpose.
     """
-    for log_id, entry in logbook.items():
-        print("-----------------------------------")
-        print(f"Log_ID: {log_id}")
-        print(f"Person Name: {entry['Person Name']}")
-        print(f"Date: {entry['Date']}")
-        print(f"Time: {entry['Time']}")
-        print(f"Purpose: {entry['Purpose']}")
-        print("-----------------------------------")
+    text = input("Search (blank for all): ")
+    if not print_rows(library.log_entries(text), LISTING_COLUMNS['log_entries']) and text:
+        print("No log entries found.")
 
 def view_transactions_per_day():
     """
@@ -509,86 +4135,451 @@ def view_transactions_per_day():
     while not validate_date(date):
         print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
         date = input("Enter Date (e.g. 9 Jan 2020): ")
-    for log_id, entry in logbook.items():
-        if entry['Date'] == date:
-            print("-----------------------------------")
-            print(f"Log_ID: {log_id}")
-            print(f"Person Name: {entry['Person Name']}")
-            print(f"Date: {entry['Date']}")
-            print(f"Time: {entry['Time']}")
-            print(f"Purpose: {entry['Purpose']}")
-            print("-----------------------------------")
+    print_rows(library.transactions_on(date), LISTING_COLUMNS['log_entries'])
+
+def view_logbook_statistics():
+    """
+    Views the logbook statistics: entries per purpose, day and hour, the busiest hours and the top borrowers.
+    Prompts the user for the first and last dates to count, or nothing to count every entry.
+    """
+    dates = []
+    for label in ("first", "last"):
+        date = input(f"Enter {label} date (e.g. 9 Jan 2020, blank for all): ")
+        while date and not validate_date(date):
+            print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
+            date = input(f"Enter {label} date: ")
+        dates.append(date or None)
+    stats = library.logbook_statistics(dates[0], dates[1])
+    print("-----------------------------------")
+    print(f"Entries: {stats['Entries']}")
+    for purpose, count in stats['Purposes'].items():
+        print(f"{purpose}: {count}")
+    print("-----------------------------------")
+    print("Entries per day:")
+    for date, count in stats['Per Day']:
+        print(f"  {date}: {count}")
+    print("Entries per hour:")
+    for hour, count in stats['Per Hour']:
+        if count:
+            print(f"  {hour:02d}:00: {count}")
+    print("Busiest hours: " + ", ".join(f"{hour:02d}:00 ({count})" for hour, count in stats['Busiest Hours']))
+    print("Top borrowers:")
+    for name, count in stats['Top Borrowers']:
+        print(f"  {name}: {count}")
+    print("-----------------------------------")
+
+def view_circulation_summary():
+    """
+    Views the circulation summary: total borrows, current loans and visits, the most borrowed books,
+    the people with the most books out and the busiest days.
+    """
+    summary = library.circulation_summary()
+    print("-----------------------------------")
+    print(f"Borrows: {summary['Borrows']} (of {summary['Books Borrowed']} books)")
+    print(f"Current loans: {summary['Loans']} (with {summary['Borrowers']} borrowers)")
+    print(f"Visits: {summary['Visits']} (on {summary['Days Visited']} days)")
+    print("-----------------------------------")
+    print("Most borrowed books:")
+    for row in summary['Most Borrowed']:
+        print(f"  {row['Title']} by {row['Author']} ({row['Book_ID']}): {row['Borrows']}")
+    print("Most books out:")
+    for name, count in summary['Most Loans']:
+        print(f"  {name}: {count}")
+    print("Busiest days:")
+    for date, count in summary['Busiest Days']:
+        print(f"  {date}: {count}")
+    print("-----------------------------------")
+
+def view_visits_per_day():
+    """
+    Views the number of visits logged on each day.
+    Prompts the user for the first and last dates to show, or nothing to show every day.
+    """
+    dates = []
+    for label in ("first", "last"):
+        date = input(f"Enter {label} date (e.g. 9 Jan 2020, blank for all): ")
+        while date and not validate_date(date):
+            print("Invalid date format. Please enter the date in the format 'Day Month Year' (e.g., 9 Jan 2020).")
+            date = input(f"Enter {label} date: ")
+        dates.append(date or None)
+    rows = library.visits_per_day(dates[0], dates[1])
+    if not rows:
+        print("No visits found.")
+    for date, count in rows:
+        print(f"{date}: {count}")
+
+# Instrumentation Module
+# Opt-in timers for the hot paths, for finding where the time goes. instrumentation.enable() swaps the functions
+# and methods listed below for wrappers that time every call into a counter and a histogram, and record the
+# bytes every save writes. Until it is enabled nothing is wrapped, so it costs nothing when it is off.
+# Times are inclusive: a call's time includes the instrumented calls it makes (a save includes its encryption).
+# Turn it on with --instrument (the stats are printed on exit) or with the hidden menu option 99, which prints
+# the stats when chosen again. --profile FILE and the hidden menu option 98 run cProfile instead.
+
+# Module functions timed under their own name
+INSTRUMENTED_FUNCTIONS = ('save_data', 'load_data', 'save_record', 'save_records', 'append_to_journal', 'load_journal',
+                          'serialize', 'deserialize')
+# Cipher methods timed as 'encrypt' and 'decrypt'
+INSTRUMENTED_CIPHER_METHODS = {'encrypt': 'encrypt', 'encrypt_many': 'encrypt', 'decrypt': 'decrypt', 'decrypt_many': 'decrypt'}
+# Menu options timed as 'menu.<function>'
+MENU_OPERATIONS = ('add_book', 'delete_book', 'delete_all_books', 'edit_book', 'view_book', 'view_pending', 'view_all_books',
+                   'search_books', 'borrow_book', 'return_book', 'view_all_entries', 'view_expected_returns',
+                   'view_returns_due_in_week', 'view_overdue_loans', 'visit_library', 'view_all_log_entries',
+                   'view_transactions_per_day', 'view_logbook_statistics', 'view_circulation_summary',
+                   'view_visits_per_day')
+# File written by each function that writes one, from its key_file argument
+WRITTEN_FILES = {'save_data': lambda key_file: key_file, 'append_to_journal': journal_path}
+# Buckets of the histograms: bucket n counts the calls that took less than 2 ** n microseconds
+HISTOGRAM_BUCKETS = 28
+# Functions listed in a profile report
+PROFILE_LINES = 25
+
+class Instrumentation:
+    """
+    Collects the timers and byte counts of the instrumented functions, and runs cProfile on demand.
+        - timers: name -> [calls, total seconds, slowest call in seconds, histogram of the call times]
+        - bytes_written: name -> bytes written to files by the calls
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.originals = {}  # (owner, attribute) -> the function that was wrapped
+        self.timers = {}
+        self.bytes_written = {}
+        self.profiler = None
+
+    def record(self, name, seconds):
+        """
+        Adds the time of one call to a timer.
+        """
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0, 0.0, 0.0, [0] * HISTOGRAM_BUCKETS]
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds)
+        timer[3][min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    # Replaces a function (or method) with a wrapper that times it, and counts the bytes it writes if it writes a file
+    def wrap(self, owner, attribute, name):
+        function = getattr(owner, attribute)
+        self.originals[(owner, attribute)] = function
+        record = self.record
+        written_file = WRITTEN_FILES.get(attribute)
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            if written_file is not None:
+                path = written_file(args[1])
+                size = 0 if attribute == 'save_data' else file_size(path)  # save_data replaces the file
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+                if written_file is not None:
+                    self.bytes_written[name] = self.bytes_written.get(name, 0) + max(file_size(path) - size, 0)
+        setattr(owner, attribute, timed)
+
+    def enable(self):
+        """
+        Starts timing the instrumented functions.
+        """
+        if self.enabled:
+            return
+        module = sys.modules[__name__]
+        for function_name in INSTRUMENTED_FUNCTIONS:
+            self.wrap(module, function_name, function_name)
+        for method_name, name in INSTRUMENTED_CIPHER_METHODS.items():
+            self.wrap(Cipher, method_name, name)
+        self.wrap(FlushManager, 'flush', 'flush')
+        for method_name in READ_METHODS + WRITE_METHODS:
+            self.wrap(LibraryService, method_name, f'service.{method_name}')
+        for function_name in MENU_OPERATIONS:
+            self.wrap(module, function_name, f'menu.{function_name}')
+        self.enabled = True
+
+    def disable(self):
+        """
+        Puts the original functions back. The stats collected so far are kept.
+        """
+        for (owner, attribute), function in self.originals.items():
+            setattr(owner, attribute, function)
+        self.originals.clear()
+        self.enabled = False
+
+    def reset(self):
+        """
+        Clears the stats collected so far.
+        """
+        self.timers.clear()
+        self.bytes_written.clear()
+
+    def report(self):
+        """
+        Formats the timers (slowest total first) and the bytes written as a table.
+        The percentiles are read from the histograms, so they are upper bounds within a factor of two.
+
+        Returns:
+            str: The report.
+        """
+        lines = [f"{'timer':<36}{'calls':>9}{'total (s)':>11}{'mean (ms)':>11}{'p50 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}"]
+        for name, (calls, total, slowest, histogram) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+            percentiles = []
+            for fraction in (0.5, 0.99):
+                seen = 0
+                for bucket, count in enumerate(histogram):
+                    seen += count
+                    if seen >= calls * fraction:
+                        percentiles.append(min(2 ** bucket / 1e3, slowest * 1e3))
+                        break
+            lines.append(f"{name:<36}{calls:>9}{total:>11.3f}{total / calls * 1e3:>11.3f}"
+                         f"{percentiles[0]:>10.3f}{percentiles[1]:>10.3f}{slowest * 1e3:>10.3f}")
+        for name, written in self.bytes_written.items():
+            calls = self.timers[name][0]
+            lines.append(f"{name} wrote {written:,} bytes in {calls} calls ({written / calls:,.0f} bytes per call)")
+        if not self.timers:
+            lines.append("Nothing was timed yet.")
+        return "\n".join(lines)
+
+    def start_profile(self):
+        """
+        Starts profiling every function call with cProfile.
+        """
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop_profile(self, path=None):
+        """
+        Stops profiling, saves the profile to a file if a path is given (for pstats or snakeviz),
+        and returns the functions that took the longest, cumulative time first.
+
+        Returns:
+            str: The profile report.
+        """
+        self.profiler.disable()
+        if path:
+            self.profiler.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        self.profiler = None
+        return output.getvalue()
+
+instrumentation = Instrumentation()
+
+# Hidden menu option 99: turns instrumentation on, or prints its stats if it is already on
+def toggle_instrumentation():
+    if instrumentation.enabled:
+        print(instrumentation.report())
+    else:
+        instrumentation.enable()
+        print("Instrumentation on. Choose 99 again to see the stats.")
+
+# Hidden menu option 98: starts profiling, or stops and prints the profile
+def toggle_profile():
+    if instrumentation.profiler is None:
+        instrumentation.start_profile()
+        print("Profiling on. Choose 98 again to stop and see the profile.")
+    else:
+        print(instrumentation.stop_profile())
 
 # Main Menu
 
 def main():
-    while True:
-        print("\n" + "=" * 35)
-        print("|  Library Inventory and Logging  |")
-        print("|  System by Llobrera (May 2024)  |")
-        print("=" * 35)
-        print("| MANAGE BOOKS                    |")
-        print("|    1. Add Book                  |")
-        print("|    2. Delete Book               |")
-        print("|    3. Delete All Books          |")
-        print("|    4. Edit Book                 |")
-        print("|    5. View a Book               |")
-        print("|    6. View Unavailable Books    |")
-        print("|    7. View All Stored Books     |")
-        print("| BORROW OR RETURN BOOKS          |")
-        print("|    8. Borrow Book               |")
-        print("|    9. Return Book               |")
-        print("|    10. View All Borrow Entries  |")
-        print("|    11. View Expected Returns    |")
-        print("| VISITATION & ENTRY LOGS         |")
-        print("|    12. Visit Library            |")
-        print("|    13. View All Entries         |")
-        print("|    14. View Transactions/Day    |")
-        print("| EXIT                            |")
-        print("|    15. Exit                     |")
-        print("=" * 35)
-
-        choice = input("Enter your choice: ")
-        if choice == '1':
-            add_book()
-        elif choice == '2':
-            delete_book()
-        elif choice == '3':
-            delete_all_books()
-        elif choice == '4':
-            edit_book()
-        elif choice == '5':
-            view_book()
-        elif choice == '6':
-            view_pending()
-        elif choice == '7':
-            view_all_books()
-        elif choice == '8':
-            borrow_book()
-        elif choice == '9':
-            return_book()
-        elif choice == '10':
-            view_all_entries()
-        elif choice == '11':
-            view_expected_returns()
-        elif choice == '12':
-            visit_library()
-        elif choice == '13':
-            view_all_log_entries()
-        elif choice == '14':
-            view_transactions_per_day()
-        elif choice == '15':
-            print("Thank you for availing this service!")
-            break
-        else:
-            print("No such option.")
-	    
+    """
+    Runs the menu until the user exits. Changes still waiting to be flushed are saved on the way out.
+    """
+    try:
+        while True:
+            print("\n" + "=" * 35)
+            print("|  Library Inventory and Logging  |")
+            print("|  System by Llobrera (May 2024)  |")
+            print("=" * 35)
+            print("| MANAGE BOOKS                    |")
+            print("|    1. Add Book                  |")
+            print("|    2. Delete Book               |")
+            print("|    3. Delete All Books          |")
+            print("|    4. Edit Book                 |")
+            print("|    5. View a Book               |")
+            print("|    6. View Unavailable Books    |")
+            print("|    7. View All Stored Books     |")
+            print("|    19. Search Books             |")
+            print("| BORROW OR RETURN BOOKS          |")
+            print("|    8. Borrow Book               |")
+            print("|    9. Return Book               |")
+            print("|    10. View All Borrow Entries  |")
+            print("|    11. View Expected Returns    |")
+            print("|    16. View Returns Due in Week |")
+            print("|    17. View Overdue Loans       |")
+            print("|    20. View Circulation Summary |")
+            print("| VISITATION & ENTRY LOGS         |")
+            print("|    12. Visit Library            |")
+            print("|    13. View All Entries         |")
+            print("|    14. View Transactions/Day    |")
+            print("|    18. View Logbook Statistics  |")
+            print("|    21. View Visits per Day      |")
+            print("| EXIT                            |")
+            print("|    15. Exit                     |")
+            print("=" * 35)
+
+            choice = input("Enter your choice: ")
+            try:
+                if choice == '1':
+                    add_book()
+                elif choice == '2':
+                    delete_book()
+                elif choice == '3':
+                    delete_all_books()
+                elif choice == '4':
+                    edit_book()
+                elif choice == '5':
+                    view_book()
+                elif choice == '6':
+                    view_pending()
+                elif choice == '7':
+                    view_all_books()
+                elif choice == '8':
+                    borrow_book()
+                elif choice == '9':
+                    return_book()
+                elif choice == '10':
+                    view_all_entries()
+                elif choice == '11':
+                    view_expected_returns()
+                elif choice == '12':
+                    visit_library()
+                elif choice == '13':
+                    view_all_log_entries()
+                elif choice == '14':
+                    view_transactions_per_day()
+                elif choice == '15':
+                    print("Thank you for availing this service!")
+                    break
+                elif choice == '16':
+                    view_returns_due_in_week()
+                elif choice == '17':
+                    view_overdue_loans()
+                elif choice == '18':
+                    view_logbook_statistics()
+                elif choice == '19':
+                    search_books()
+                elif choice == '20':
+                    view_circulation_summary()
+                elif choice == '21':
+                    view_visits_per_day()
+                elif choice == '98':
+                    toggle_profile()
+                elif choice == '99':
+                    toggle_instrumentation()
+                else:
+                    print("No such option.")
+            except StorageError as error:
+                print("Error:", error)
+                print("The changes are kept and will be saved again with the next change, or on exit.")
+    finally:
+        library.close()
+
 if __name__ == "__main__":
     """
     This block of code will only execute if this script is run directly by the Python interpreter. 
     It will not execute if this script is imported as a module into another Python script.
     """
-    main()
+    parser = argparse.ArgumentParser(description="Library Inventory and Logging System")
+    parser.add_argument('--backend', choices=sorted(STORAGE_BACKENDS), default=STORAGE_BACKEND, help="storage backend to use")
+    parser.add_argument('--connect', metavar='ADDRESS', help="run the menu as a desk of the library server at ADDRESS")
+    parser.add_argument('--flush-delay', type=float, metavar='SECONDS', help="save changes in the background, at most SECONDS after they are made")
+    parser.add_argument('--durability', choices=DURABILITY_LEVELS, default=DURABILITY, help="how far saves are synced to disk")
+    parser.add_argument('--serializer', choices=sorted(SERIALIZERS), default=SERIALIZER, help="serializer to save the data files with (default: the one each file was last saved with)")
+    parser.add_argument('--instrument', action='store_true', help="time saves, loads, encryption and menu options, and print the stats on exit")
+    parser.add_argument('--profile', metavar='FILE', help="profile the run with cProfile, save the profile to FILE and print the slowest functions")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help="rows shown per page of a listing (0 shows every row at once)")
+    parser.add_argument('--id-block-size', type=int, default=ID_BLOCK_SIZE, help="record IDs reserved (and their counter saved) at a time (default %(default)s)")
+    commands = parser.add_subparsers(dest='command')
+    serve_parser = commands.add_parser('serve', help="run a library server that several desks can connect to")
+    serve_parser.add_argument('--address', default=SERVER_ADDRESS, help="'host:port' or the path of a Unix socket to listen on")
+    serve_parser.add_argument('--batch-size', type=int, default=WRITE_BATCH_SIZE, help="most writes committed together (1 turns group commit off)")
+    migrate_parser = commands.add_parser('migrate', help="rewrite the data files with a new serializer")
+    migrate_parser.add_argument('--format', choices=sorted(SERIALIZERS), help="serializer to save the files with (default: --serializer, or json)")
+    convert_parser = commands.add_parser('convert', help="import the data of one storage backend into another")
+    convert_parser.add_argument('--from', dest='source', choices=sorted(STORAGE_BACKENDS), default='files', help="backend to read from")
+    convert_parser.add_argument('--to', dest='target', choices=sorted(STORAGE_BACKENDS), default='sqlite', help="backend to write to")
+    import_parser = commands.add_parser('import', help="bulk import books or log entries from a CSV or JSONL file")
+    import_parser.add_argument('kind', choices=sorted(IMPORT_FIELDS), help="what the file holds")
+    import_parser.add_argument('path', help="CSV file with a header row, or JSONL file with one object per line")
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'], help="file format (defaults to the file extension)")
+    export_parser = commands.add_parser('export', help="stream a listing to a CSV or JSONL file")
+    export_parser.add_argument('listing', choices=LISTINGS, help="rows to export")
+    export_parser.add_argument('path', help="file to write (.csv for CSV, anything else for JSONL)")
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'], help="file format (defaults to the file extension)")
+    export_parser.add_argument('--search', help="only export the rows with a field containing this text")
+    merge_parser = commands.add_parser('merge', help="add the log entries of another branch of the library")
+    merge_parser.add_argument('directory', help="directory of the branch, holding its logbook.txt and encryption_key.key")
+    commands.add_parser('rebuild-stats', help="count the circulation counters again from the books, borrow list and logbook")
+    args = parser.parse_args()
+    DURABILITY = args.durability
+    SERIALIZER = args.serializer
+    try:
+        if args.backend != storage.name:
+            use_storage(STORAGE_BACKENDS[args.backend]())
+        if args.flush_delay is not None:
+            flush_manager.delay = args.flush_delay
+        id_allocator.block_size = args.id_block_size
+        PAGE_SIZE = args.page_size
+        if args.instrument:
+            instrumentation.enable()
+        if args.profile:
+            instrumentation.start_profile()
+
+        if args.command == 'migrate':
+            migrate_data_files(args.format)
+        elif args.command == 'convert':
+            copy_storage(STORAGE_BACKENDS[args.source](), STORAGE_BACKENDS[args.target]())
+        elif args.command == 'serve':
+            serve(args.address, args.batch_size)
+        elif args.command == 'export':
+            exported = export_listing(args.listing, args.path, args.format, args.search)
+            print(f"Exported {exported} rows to {args.path}.")
+        elif args.command == 'merge':
+            try:
+                report = library.merge_logbook(args.directory)
+                print(f"Merged {report['Merged']} log entries from {args.directory} ({report['Skipped']} already in the logbook).")
+            except LibraryError as error:
+                print(error)
+            finally:
+                library.close()
+        elif args.command == 'rebuild-stats':
+            try:
+                totals = library.rebuild_circulation_stats()
+                print(f"Circulation counters rebuilt: {totals['Borrows']} borrows, {totals['Loans']} current loans, "
+                      f"{totals['Visits']} visits.")
+            finally:
+                library.close()
+        elif args.command == 'import':
+            report = bulk_import(args.kind, args.path, args.format)
+            for line_number, error in report['errors'][:10]:
+                print(f"Row {line_number} skipped: {error}")
+            if len(report['errors']) > 10:
+                print(f"... and {len(report['errors']) - 10} more rows skipped.")
+            print(f"Imported {report['imported']} {args.kind} records ({report['skipped']} skipped) "
+                  f"in {report['read_seconds'] + report['save_seconds']:.2f}s "
+                  f"(read {report['read_seconds']:.2f}s, save {report['save_seconds']:.2f}s, {report['records_per_second']:,.0f} rows/s).")
+        else:
+            if args.connect:
+                library = LibraryClient(args.connect)
+            main()
+    except DataFileError as error:
+        # Stop instead of starting over with empty data, which would overwrite the file on the next save
+        print("Error:", error)
+        raise SystemExit(1)
+    except StorageError as error:
+        print("Error:", error)
+        print("The changes made since the last successful save were not saved.")
+        raise SystemExit(1)
+    finally:
+        if args.profile and instrumentation.profiler is not None:
+            print(instrumentation.stop_profile(args.profile))
+        if args.instrument:
+            print(instrumentation.report())
 
 ################################################################### 
 
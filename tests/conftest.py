@@ -0,0 +1,33 @@
+# Shared fixtures of the tests: every test runs in its own empty directory with a fresh encryption key,
+# the 'files' backend and fsync turned off, so no test sees the data files of another.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import library_system
+
+
+@pytest.fixture(autouse=True)
+def library(tmp_path, monkeypatch):
+    """
+    Points library_system at an empty data directory and returns the module.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(library_system, 'DURABILITY', 'none')
+    restart(library_system.FlatFileBackend())
+    yield library_system
+    library_system.flush_manager.close()
+    restart(library_system.FlatFileBackend())
+
+
+def restart(backend):
+    """
+    Drops everything held in memory and switches to a backend, as if the program had been started again.
+    """
+    library_system.flush_manager.close()
+    library_system.key = None
+    library_system.use_storage(backend)
+    return backend
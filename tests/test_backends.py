@@ -0,0 +1,53 @@
+# Tests of the storage backends: both save and load the same records, and convert copies them across.
+
+import library_system
+
+
+# Records of a small library: a book out on loan, an available book, the borrow and a visit
+def sample_library():
+    return {
+        'books': {
+            'B1': {'Title': 'Dune', 'Author': 'Herbert', 'Date Published': '1 Aug 1965',
+                   'Status': 'Unavailable', 'List of Borrowers': ['L1']},
+            'B2': {'Title': 'Emma', 'Author': 'Austen', 'Date Published': '1 Jan 1815',
+                   'Status': 'Available', 'List of Borrowers': []},
+        },
+        'borrow_list': {'BL1': {'Book_ID': 'B1', 'Log_ID': 'L1', 'Date Return': '9 Jan 2024'}},
+        'logbook': {
+            'L1': {'Person Name': 'Bob', 'Date': '2 Jan 2024', 'Time': '10:00 AM', 'Purpose': 'borrow'},
+            'L2': {'Person Name': 'Zed', 'Date': '3 Jan 2024', 'Time': '1:00 PM', 'Purpose': 'visit'},
+        },
+    }
+
+
+# Reads every dictionary of a backend as plain dictionaries
+def load_all(backend):
+    return {name: {record_id: dict(record) for record_id, record in backend.load(name).items()}
+            for name in library_system.DATA_FILES}
+
+
+# Saves the sample library through a backend, then edits, deletes and adds records one at a time
+def save_sample(backend):
+    data = sample_library()
+    for name, records in data.items():
+        backend.save(name, records)
+    data['books']['B2']['Title'] = 'Emma II'
+    backend.save_record('books', data['books'], 'B2')
+    del data['logbook']['L2']
+    backend.save_record('logbook', data['logbook'], 'L2')
+    data['logbook']['L3'] = {'Person Name': 'Ann', 'Date': '4 Jan 2024', 'Time': '9:00 AM', 'Purpose': 'visit'}
+    backend.save_record('logbook', data['logbook'], 'L3')
+    return data
+
+
+def test_backends_load_what_was_saved(library):
+    files = save_sample(library.FlatFileBackend())
+    sqlite = save_sample(library.SQLiteBackend())
+    assert load_all(library.FlatFileBackend()) == files
+    assert load_all(library.SQLiteBackend()) == sqlite == files
+
+
+def test_convert_copies_every_record(library):
+    data = save_sample(library.FlatFileBackend())
+    library.copy_storage(library.FlatFileBackend(), library.SQLiteBackend())
+    assert load_all(library.SQLiteBackend()) == data
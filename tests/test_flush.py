@@ -0,0 +1,103 @@
+# Tests of the flush manager: the background thread and close() save the waiting changes, and changes
+# that could not be saved are kept and saved by the next flush.
+
+import errno
+import os
+import sqlite3
+import time
+
+import pytest
+
+from conftest import restart
+
+
+def test_failed_append_keeps_the_changes(library, monkeypatch):
+    service = library.library
+    service.add_book('Dune', 'Herbert', '1 Aug 1965')
+    append_to_journal = library.append_to_journal
+
+    def disk_full(records, key_file, *args):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), library.journal_path(key_file))
+
+    monkeypatch.setattr(library, 'append_to_journal', disk_full)
+    with pytest.raises(library.StorageError):
+        service.borrow('Bob', '2 Jan 2024', '10:00 AM', 'Dune', 'Herbert', '9 Jan 2024')
+    assert set(library.flush_manager.dirty) >= {'books', 'borrow_list', 'logbook'}
+    monkeypatch.setattr(library, 'append_to_journal', append_to_journal)
+    library.flush_manager.flush()
+    assert library.flush_manager.dirty == {}
+    restart(library.FlatFileBackend())
+    assert len(service.borrow_entries(outstanding_only=True)) == 1
+    assert service.count('logbook') == 1
+
+
+def test_failed_sqlite_flush_is_rolled_back(library, monkeypatch):
+    restart(library.SQLiteBackend())
+    service = library.library
+    service.add_book('Dune', 'Herbert', '1 Aug 1965')
+    write_record = library.SQLiteBackend.write_record
+
+    def disk_full(self, name, *args):
+        if name == 'logbook':
+            raise sqlite3.OperationalError("database or disk is full")
+        return write_record(self, name, *args)
+
+    monkeypatch.setattr(library.SQLiteBackend, 'write_record', disk_full)
+    with pytest.raises(library.StorageError):
+        service.borrow('Bob', '2 Jan 2024', '10:00 AM', 'Dune', 'Herbert', '9 Jan 2024')
+    # The book saved before the log entry failed was rolled back with it
+    connection = library.storage.connection
+    assert connection.execute("SELECT status FROM books").fetchall() == [(library.Status.AVAILABLE,)]
+    assert connection.execute("SELECT COUNT(*) FROM borrows").fetchone() == (0,)
+    assert not connection.in_transaction
+    monkeypatch.setattr(library.SQLiteBackend, 'write_record', write_record)
+    library.flush_manager.flush()
+    restart(library.SQLiteBackend())
+    assert len(service.borrow_entries(outstanding_only=True)) == 1
+    assert service.count('logbook') == 1
+
+
+# Waits until the background thread has flushed every change, or fails after a timeout
+def wait_for_flush(flush_manager, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with flush_manager.lock:
+            if not flush_manager.dirty:
+                return
+        time.sleep(0.01)
+    pytest.fail("the background thread did not flush the changes")
+
+
+# Reads the books saved in the data files, leaving the module's datasets alone
+def saved_titles(library):
+    with library.flush_manager.lock:
+        return sorted(book['Title'] for book in library.FlatFileBackend().load('books').values())
+
+
+def test_background_thread_flushes_after_the_delay(library, monkeypatch):
+    monkeypatch.setattr(library.flush_manager, 'delay', 0.5)
+    library.library.add_book('Dune', 'Herbert', '1 Aug 1965')
+    assert library.flush_manager.thread is not None
+    assert saved_titles(library) == []
+    wait_for_flush(library.flush_manager)
+    assert saved_titles(library) == ['Dune']
+
+
+def test_background_thread_flushes_once_enough_changes_wait(library, monkeypatch):
+    monkeypatch.setattr(library.flush_manager, 'delay', 60)
+    monkeypatch.setattr(library.flush_manager, 'size', 1)
+    library.library.add_book('Dune', 'Herbert', '1 Aug 1965')
+    wait_for_flush(library.flush_manager)  # Long before the delay is over
+    assert saved_titles(library) == ['Dune']
+
+
+def test_close_flushes_the_waiting_changes(library, monkeypatch):
+    monkeypatch.setattr(library.flush_manager, 'delay', 60)
+    library.library.add_book('Dune', 'Herbert', '1 Aug 1965')
+    library.library.visit('Ann', '2 Jan 2024', '9:00 AM')
+    assert saved_titles(library) == []
+    library.flush_manager.close()
+    assert library.flush_manager.thread is None
+    restart(library.FlatFileBackend())
+    assert library.library.find_book('Dune', 'Herbert') is not None
+    assert library.library.count('logbook') == 1
@@ -0,0 +1,29 @@
+# Tests of bulk_import: rows that cannot be read are reported and skipped without stopping the import.
+
+import json
+
+
+def test_bad_json_line_is_skipped(library, tmp_path):
+    path = tmp_path / 'books.jsonl'
+    path.write_text('\n'.join([
+        json.dumps({'Title': 'Dune', 'Author': 'Herbert', 'Date Published': '1 Aug 1965'}),
+        '{"Title": "Emma", "Author": ',
+        '["not", "an", "object"]',
+        json.dumps({'Title': 'Ulysses', 'Author': 'Joyce', 'Date Published': '2 Feb 1922'}),
+    ]) + '\n', encoding='utf-8')
+    report = library.bulk_import('books', str(path))
+    assert (report['imported'], report['skipped']) == (2, 2)
+    assert [line_number for line_number, _ in report['errors']] == [2, 3]
+    assert library.library.count('books') == 2
+
+
+def test_non_string_fields_are_read_as_text(library, tmp_path):
+    path = tmp_path / 'books.jsonl'
+    path.write_text('\n'.join([
+        json.dumps({'Title': 1984, 'Author': 'Orwell', 'Date Published': '8 Jun 1949'}),
+        json.dumps({'Title': 'Dune', 'Author': None, 'Date Published': 1965}),
+    ]) + '\n', encoding='utf-8')
+    report = library.bulk_import('books', str(path))
+    assert (report['imported'], report['skipped']) == (1, 1)
+    assert report['errors'][0][0] == 2
+    assert library.library.find_book('1984', 'Orwell') is not None
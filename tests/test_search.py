@@ -0,0 +1,33 @@
+# Tests of the book search: a rare query word must not hide the books only a common word matches.
+
+import random
+
+import pytest
+
+
+@pytest.fixture
+def catalogue(library):
+    for title in ('The Hobbit', 'The Hobbit Illustrated', 'Hobbit Tales'):
+        library.library.add_book(title, 'Tolkien', '21 Sep 1937')
+    library.library.add_book('Cooking Basics', 'Jane Smith', '1 Jan 2000')
+    return library.library
+
+
+@pytest.mark.parametrize('query', ['hobbit smith', 'hobbit smyth'])
+def test_rare_and_common_words_find_every_match(catalogue, query):
+    titles = [row['Title'] for row in catalogue.search_books(query)]
+    assert sorted(titles) == ['Cooking Basics', 'Hobbit Tales', 'The Hobbit', 'The Hobbit Illustrated']
+
+
+def test_top_books_match_scoring_every_book(library):
+    words = ['dune', 'emma', 'hobbit', 'tales', 'river', 'night', 'garden', 'smith', 'jones', 'brown']
+    generator = random.Random(7)
+    for number in range(300):
+        title = ' '.join(generator.choices(words[:6], weights=[30, 10, 5, 3, 2, 1], k=3))
+        library.library.add_book(f'{title} {number}', generator.choice(words[6:]), '1 Jan 1900')
+    index = library.search_index
+    for _ in range(50):
+        query = ' '.join(generator.sample(words, 3))
+        everything = index.search(query, limit=len(library.books))
+        top = index.search(query, limit=5)
+        assert [round(score, 9) for _, score in top] == [round(score, 9) for _, score in everything[:5]]
@@ -0,0 +1,46 @@
+# Tests of LibraryServer: reads are answered while a write is being flushed.
+
+import asyncio
+import json
+import os
+import time
+
+
+# Sends one request on a connection and reads its response
+async def call(connection, method, *args):
+    reader, writer = connection
+    writer.write(json.dumps({'id': 1, 'method': method, 'args': args}).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+def test_reads_are_answered_during_a_slow_flush(library, monkeypatch):
+    flush = library.flush_manager.flush
+
+    def slow_flush():
+        if 'books' in library.flush_manager.dirty:
+            time.sleep(1)
+        flush()
+
+    monkeypatch.setattr(library.flush_manager, 'flush', slow_flush)
+
+    async def run():
+        server = asyncio.create_task(library.LibraryServer(library.library, 'library.sock').serve())
+        while not os.path.exists('library.sock'):
+            await asyncio.sleep(0.01)
+        desks = [await asyncio.open_unix_connection('library.sock') for _ in range(2)]
+        start = time.perf_counter()
+        write = asyncio.create_task(call(desks[0], 'add_book', 'Dune', 'Herbert', '1 Aug 1965'))
+        await asyncio.sleep(0.1)
+        read = await call(desks[1], 'count', 'books')
+        read_seconds = time.perf_counter() - start
+        written = await write
+        for _, writer in desks:
+            writer.close()
+        server.cancel()
+        return read, read_seconds, written
+
+    read, read_seconds, written = asyncio.run(run())
+    assert read == {'id': 1, 'result': 1}
+    assert read_seconds < 0.5
+    assert written['result']['Book_ID'] == 'B1'
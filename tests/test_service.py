@@ -0,0 +1,138 @@
+# Tests of LibraryService: the storage backends, record IDs, paging and merging branches.
+
+import os
+
+import pytest
+
+import library_system
+from conftest import restart
+
+
+# Runs the same borrows, returns, visits and deletions through the service
+def run_operations(service):
+    for title, author in (('Dune', 'Herbert'), ('Emma', 'Austen'), ('Ulysses', 'Joyce'), ('Dune', 'Herbert')):
+        service.add_book(title, author, '1 Jan 1900')
+    service.borrow('Bob', '2 Jan 2024', '10:00 AM', 'Dune', 'Herbert', '9 Jan 2024')
+    service.borrow('Cy', '2 Jan 2024', '11:00 AM', 'Emma', 'Austen', '12 Jan 2024')
+    service.borrow('Ann', '3 Jan 2024', '9:00 AM', 'Dune', 'Herbert', '10 Jan 2024')
+    service.return_book('Bob', '4 Jan 2024', '1:00 PM', 'Dune', 'Herbert')
+    service.visit('Zed', '4 Jan 2024', '2:00 PM')
+    service.edit_book('Ulysses', 'Ulysses II', 'Joyce', '2 Feb 1922')
+    service.delete_book('Emma', 'Austen')
+
+
+# Reads every report of the service
+def reports(service):
+    return {
+        'books': list(service.all_books()),
+        'pending': service.pending_books(),
+        'borrows': service.borrow_entries(),
+        'outstanding': service.borrow_entries(outstanding_only=True),
+        'due': service.returns_due_in_week('6 Jan 2024'),
+        'overdue': service.overdue_loans('11 Jan 2024'),
+        'log': list(service.log_entries()),
+        'transactions': service.transactions_on('2 Jan 2024'),
+        'statistics': service.logbook_statistics(),
+    }
+
+
+def test_sqlite_matches_files(library, tmp_path, monkeypatch):
+    results = {}
+    for backend in (library.FlatFileBackend, library.SQLiteBackend):
+        os.mkdir(tmp_path / backend.name)
+        monkeypatch.chdir(tmp_path / backend.name)
+        restart(backend())
+        run_operations(library.library)
+        before = reports(library.library)
+        restart(backend())
+        assert reports(library.library) == before
+        results[backend.name] = before
+    assert results['files'] == results['sqlite']
+
+
+def test_ids_are_never_reused_across_restarts(library):
+    service = library.library
+    first = service.add_book('Dune', 'Herbert', '1 Aug 1965')['Book_ID']
+    last = service.add_book('Emma', 'Austen', '1 Jan 1815')['Book_ID']
+    service.delete_book('Emma', 'Austen')
+    restart(library.FlatFileBackend())
+    new = service.add_book('Ulysses', 'Joyce', '2 Feb 1922')['Book_ID']
+    numbers = [int(book_id[1:]) for book_id in (first, last, new)]
+    assert numbers == sorted(set(numbers))
+
+
+def test_ids_stay_above_records_saved_without_counters(library):
+    library.save_data({'B7': library.Book('Dune', 'Herbert', '1 Aug 1965')}, 'books.txt')
+    assert library.library.add_book('Emma', 'Austen', '1 Jan 1815')['Book_ID'] == 'B8'
+
+
+def test_merge_is_idempotent(library, tmp_path, monkeypatch):
+    branch = tmp_path / 'branch'
+    os.mkdir(branch)
+    monkeypatch.chdir(branch)
+    restart(library.FlatFileBackend())
+    library.library.visit('Ann', '2 Jan 2024', '9:00 AM')
+    library.library.visit('Bob', '2 Jan 2024', '9:30 AM')
+    library.library.visit('Bob', '2 Jan 2024', '9:30 AM')
+    monkeypatch.chdir(tmp_path)
+    restart(library.FlatFileBackend())
+    library.library.visit('Ann', '2 Jan 2024', '9:00 AM')
+    first = library.library.merge_logbook(str(branch))
+    assert (first['Merged'], first['Skipped']) == (2, 1)
+    second = library.library.merge_logbook(str(branch))
+    assert (second['Merged'], second['Skipped']) == (0, 3)
+    restart(library.FlatFileBackend())
+    assert library.library.count('logbook') == 3
+
+
+def test_paging_resumes_across_changes(library):
+    service = library.library
+    for number in range(10):
+        service.add_book(f'Book {number}', 'Author', '1 Jan 1900')
+    first = service.page('all_books', None, 3)
+    seen = [row['Title'] for row in first['Rows']]
+    service.delete_book('Book 0', 'Author')  # Already paged
+    service.delete_book('Book 5', 'Author')  # Not paged yet
+    service.add_book('Book 10', 'Author', '1 Jan 1900')
+    cursor = first['Next Cursor']
+    while cursor is not None:
+        page = service.page('all_books', cursor, 3)
+        seen += [row['Title'] for row in page['Rows']]
+        cursor = page['Next Cursor']
+    assert seen == [f'Book {number}' for number in range(10) if number != 5]
+    with pytest.raises(library.LibraryError):
+        service.page('all_books', first['Next Cursor'], 3)  # A cursor is used once
+
+
+def test_counters_saved_ahead_of_the_records_are_counted_again(library):
+    library.library.visit('Ann', '2 Jan 2024', '9:00 AM')
+    library.library.visit('Bob', '2 Jan 2024', '9:30 AM')
+    path = library.journal_path(library.ENCRYPTED_LOGBOOK_FILE)
+    with open(path, 'rb') as file:
+        lines = file.readlines()
+    with open(path, 'wb') as file:
+        file.writelines(lines[:-1])  # The crash lost Bob's visit but not its counter
+    restart(library.FlatFileBackend())
+    assert library.library.circulation_summary()['Visits'] == 1
+
+
+def test_counters_saved_behind_the_records_are_counted_again(library):
+    library.library.visit('Ann', '2 Jan 2024', '9:00 AM')
+    paths = (library.CIRCULATION_STATS_FILE, library.journal_path(library.CIRCULATION_STATS_FILE))
+    saved = {}
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                saved[path] = file.read()
+    library.library.visit('Bob', '2 Jan 2024', '9:30 AM')
+    # The crash lost the counter of Bob's visit but not the visit
+    for path in paths:
+        if path in saved:
+            with open(path, 'wb') as file:
+                file.write(saved[path])
+        elif os.path.exists(path):
+            os.remove(path)
+    restart(library.FlatFileBackend())
+    assert library.library.circulation_summary()['Visits'] == 2
+    restart(library.FlatFileBackend())
+    assert library.storage.load_stats()['visits:738887'] == 2  # Saved again, stamped with the records
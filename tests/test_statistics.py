@@ -0,0 +1,73 @@
+# Tests of the logbook statistics: the array and NumPy counts match counting the logbook one entry at a time.
+
+import random
+
+import pytest
+
+
+# Date ranges to count: everything, a closed range, and ranges open at either end
+RANGES = [(None, None), ('3 Jan 2024', '9 Jan 2024'), ('5 Jan 2024', None), (None, '2 Jan 2024')]
+
+
+@pytest.fixture
+def columns(library):
+    generator = random.Random(3)
+    logbook = {}
+    for number in range(500):
+        logbook[f'L{number + 1}'] = {
+            'Person Name': f'Person {generator.randrange(20)}',
+            'Date': f'{generator.randint(1, 12)} Jan 2024',
+            'Time': f'{generator.randint(1, 12)}:{generator.randrange(60):02d} {generator.choice(["AM", "PM"])}',
+            'Purpose': generator.choice(['visit', 'borrow', 'return']),
+        }
+    logbook['L501'] = {'Person Name': 'Person 0', 'Date': 'not a date', 'Time': 'not a time', 'Purpose': 'borrow'}
+    columns = library.LogColumns()
+    columns.rebuild(logbook)
+    return logbook, columns
+
+
+# Puts the counts of LogColumns in one shape, whichever way they were counted
+def normalize(counts):
+    entries, purposes, days, minutes, borrowers = counts
+    return entries, dict(purposes), dict(days), dict(minutes), dict(borrowers)
+
+
+# Counts the entries of the logbook one at a time with plain dictionaries
+def count_with_loop(library, logbook, person_ids, first, last):
+    entries, purposes, days, minutes, borrowers = 0, {}, {}, {}, {}
+    for entry in logbook.values():
+        day = library.date_to_ordinal(entry['Date']) or 0
+        if (first is not None and day < first) or (last is not None and day > last):
+            continue
+        entries += 1
+        minute = library.parse_time(entry['Time'])
+        minute = -1 if minute is None else minute
+        purpose = library.PURPOSE_CODES.get(entry['Purpose'], -1)
+        purposes[purpose] = purposes.get(purpose, 0) + 1
+        days[day] = days.get(day, 0) + 1
+        minutes[minute] = minutes.get(minute, 0) + 1
+        if purpose == library.PURPOSE_CODES[library.Purpose.BORROW]:
+            person = person_ids[entry['Person Name']]
+            borrowers[person] = borrowers.get(person, 0) + 1
+    return entries, purposes, days, minutes, borrowers
+
+
+# Turns a range of dates into the date ordinals LogColumns counts with
+def ordinals(library, first, last):
+    return [None if date is None else library.date_to_ordinal(date) for date in (first, last)]
+
+
+@pytest.mark.parametrize('first, last', RANGES)
+def test_array_counts_match_a_loop(library, columns, first, last):
+    logbook, columns = columns
+    first, last = ordinals(library, first, last)
+    expected = count_with_loop(library, logbook, columns.person_ids, first, last)
+    assert normalize(columns.count_with_arrays(first, last)) == expected
+
+
+@pytest.mark.parametrize('first, last', RANGES)
+def test_numpy_counts_match_the_array_counts(library, columns, first, last, monkeypatch):
+    monkeypatch.setattr(library, 'numpy', pytest.importorskip('numpy'))
+    logbook, columns = columns
+    first, last = ordinals(library, first, last)
+    assert normalize(columns.count_with_numpy(first, last)) == normalize(columns.count_with_arrays(first, last))
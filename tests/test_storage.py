@@ -0,0 +1,189 @@
+# Tests of the data files: snapshots and journals, legacy files and the serializers.
+
+import pytest
+
+import library_system
+
+
+def test_journal_and_snapshot_round_trip(library):
+    data = {'B1': {'Title': 'Dune'}, 'B2': {'Title': 'Emma'}}
+    library.save_data(data, 'books.txt')
+    data['B3'] = {'Title': 'Ulysses'}
+    del data['B1']
+    data['B2'] = {'Title': 'Emma II'}
+    for record_id in ('B3', 'B1', 'B2'):
+        library.save_record(data, 'books.txt', record_id)
+    assert len(library.load_journal('books.txt')) == 3
+    assert library.load_data('books.txt') == data
+    assert list(library.iter_data('books.txt')) == list(data.items())
+    library.save_data(data, 'books.txt')  # Compacts the journal into the snapshot
+    assert library.load_journal('books.txt') == []
+    assert library.load_data('books.txt') == data
+
+
+def test_legacy_str_files_are_read(library):
+    data = {'B1': {'Title': 'Dune', 'Author': 'Herbert', 'Date Published': '1 Aug 1965',
+                   'Status': 'Available', 'List of Borrowers': []}}
+    library.encrypt_and_save(str(data), library.get_key(), 'books.txt')
+    assert library.load_data('books.txt') == data
+
+
+def test_unreadable_snapshot_is_left_untouched(library):
+    with open('books.txt', 'wb') as file:
+        file.write(b'not a data file')
+    with pytest.raises(library.DataFileError):
+        library.load_data('books.txt')
+    with open('books.txt', 'rb') as file:
+        assert file.read() == b'not a data file'
+
+
+
+# Saves a snapshot of two books and a journal of one change, and returns the books and the journal's path
+def journaled_books(library):
+    data = {'B1': {'Title': 'Dune'}, 'B2': {'Title': 'Emma'}}
+    library.save_data(data, 'books.txt')
+    data['B3'] = {'Title': 'Ulysses'}
+    library.save_records(data, 'books.txt', ['B3'])
+    return data, library.journal_path('books.txt')
+
+
+def test_torn_last_record_is_dropped(library):
+    data, path = journaled_books(library)
+    with open(path, 'rb') as file:
+        saved = file.read()
+    with open(path, 'ab') as file:
+        file.write(saved[:20])  # A record cut off by a crash, without its newline
+    assert library.load_data('books.txt') == data
+    assert dict(library.iter_data('books.txt')) == data
+    with open(path, 'rb') as file:
+        assert file.read() == saved + saved[:20]  # Read-only loads leave the journal as it is
+    assert library.load_data('books.txt', repair=True) == data
+    with open(path, 'rb') as file:
+        assert file.read() == saved
+    data['B4'] = {'Title': 'Walden'}
+    library.save_records(data, 'books.txt', ['B4'])
+    assert library.load_data('books.txt') == data
+
+
+def test_damaged_complete_record_is_left_untouched(library):
+    _, path = journaled_books(library)
+    with open(path, 'ab') as file:
+        file.write(b'not a record\n')
+    with open(path, 'rb') as file:
+        saved = file.read()
+    with pytest.raises(library.DataFileError):
+        library.load_data('books.txt', repair=True)
+    with open(path, 'rb') as file:
+        assert file.read() == saved
+
+
+def test_journal_of_another_key_is_left_untouched(library):
+    _, path = journaled_books(library)
+    with open(path, 'rb') as file:
+        saved = file.read()
+    with pytest.raises(library.DataFileError):
+        library.load_journal('books.txt', library.get_cipher(library.generate_key()), repair=True)
+    with open(path, 'rb') as file:
+        assert file.read() == saved
+
+
+@pytest.mark.parametrize('serializer', sorted(library_system.SERIALIZERS))
+def test_serializer_round_trip(library, serializer):
+    data = {'L1': {'Person Name': 'Ann', 'Date': '2 Jan 2024', 'Time': '9:00 AM', 'Purpose': 'visit'},
+            'X': {'Nested': [1, 2.5, None, True, 'é'], 'Empty': {}}}
+    payload = library.serialize(data, serializer)
+    assert library.deserialize(payload) == data
+    assert dict(library.deserialize_stream([b''.join(library.serialize_stream(data, serializer))])) == data
+    record = ('set', 'L1', data['L1'])
+    assert tuple(library.deserialize(library.serialize(record, serializer, record=True), record=True)) == record
+    library.save_data(data, 'logbook.txt', serializer)
+    assert library.load_data('logbook.txt') == data
+
+
+# msgpack encodings of values, using the smallest types as the msgpack package writes them
+MSGPACK_SAMPLES = [
+    (b'\xcc\xc8', 200), (b'\xcd\x01\x2c', 300), (b'\xce\x00\x01\x11\x70', 70000),
+    (b'\xcf\x00\x00\x00\x01\x00\x00\x00\x00', 2 ** 32),
+    (b'\xd0\x80', -128), (b'\xd1\xfe\xd4', -300), (b'\xd2\xff\xfe\xee\x90', -70000),
+    (b'\xca\x3f\xc0\x00\x00', 1.5), (b'\xc4\x02ab', b'ab'), (b'\xc5\x00\x01c', b'c'), (b'\xc6\x00\x00\x00\x00', b''),
+    (b'\x82\xa2id\xcd\x01\x2c\xa4days\x92\xcc\xc8\xd0\x80', {'id': 300, 'days': [200, -128]}),
+]
+
+
+@pytest.mark.parametrize('packed, value', MSGPACK_SAMPLES)
+def test_fallback_unpacker_reads_every_msgpack_type(packed, value):
+    assert library_system.unpack_value(packed, 0) == (value, len(packed))
+
+
+def test_fallback_unpacker_reads_msgpack_package_output():
+    msgpack = pytest.importorskip('msgpack')
+    value = {'L1': {'Person Name': 'Ann', 'Count': 300, 'Delta': -70000, 'Big': 2 ** 40, 'Ratio': 0.25, 'Raw': b'\x00\x01'}}
+    assert library_system.unpack_value(msgpack.packb(value), 0)[0] == value
+
+def test_files_keep_their_serializer(library, monkeypatch):
+    data = {'B1': {'Title': 'Dune'}}
+    library.save_data(data, 'books.txt', 'binary')  # As migrate --format binary does
+    data['B2'] = {'Title': 'Emma'}
+    library.save_record(data, 'books.txt', 'B2')
+    with open(library.journal_path('books.txt'), 'rb') as file:
+        assert library.get_cipher().decrypt(file.readline().rstrip(b'\n'))[:1] == library.SERIALIZERS['binary'].tag
+    library.save_data(data, 'books.txt')
+    assert library.file_serializer('books.txt') == 'binary'
+    assert library.file_serializer('borrow_list.txt') is None
+    library.save_data(data, 'borrow_list.txt')
+    assert library.file_serializer('borrow_list.txt') == library.DEFAULT_SERIALIZER
+    monkeypatch.setattr(library, 'SERIALIZER', 'json')  # As --serializer json does
+    library.save_data(data, 'books.txt')
+    assert library.file_serializer('books.txt') == 'json'
+    assert library.load_data('books.txt') == data
+    library.write_chunks('logbook.txt', library.serialize_stream(data, 'binary'))  # Header without a serializer
+    assert library.file_serializer('logbook.txt') is None
+    assert library.load_data('logbook.txt') == data
+
+def test_chunked_files_detect_missing_chunks(library, monkeypatch):
+    monkeypatch.setattr(library, 'CHUNK_SIZE', 64)
+    data = {f'L{i}': {'Person Name': f'Person {i}'} for i in range(50)}
+    library.save_data(data, 'logbook.txt')
+    with open('logbook.txt', 'rb') as file:
+        lines = file.readlines()
+    assert len(lines) > 3
+    with open('logbook.txt', 'wb') as file:
+        file.writelines(lines[:2] + lines[3:])
+    with pytest.raises(library.DataFileError):
+        library.load_data('logbook.txt')
+
+
+@pytest.mark.parametrize('serializer', sorted(library_system.SERIALIZERS))
+def test_records_are_saved_as_dictionaries(library, serializer):
+    books = {'B1': library.Book('Dune', 'Herbert', '1 Aug 1965')}
+    library.save_data(books, 'books.txt', serializer)
+    loaded = library.load_data('books.txt', record_type=library.Book)
+    assert loaded['B1'].to_dict() == books['B1'].to_dict()
+
+
+# Counts the single-record saves it takes to compact the journal of a snapshot of size records
+def saves_until_compaction(library, size):
+    data = {f'L{i}': {'Person Name': f'Person {i}', 'Date': '2 Jan 2024'} for i in range(size)}
+    library.save_data(data, 'logbook.txt')
+    saves = 0
+    while True:
+        saves += 1
+        library.save_record(data, 'logbook.txt', f'L{saves % size}')
+        if not library.os.path.exists(library.journal_path('logbook.txt')):
+            return saves
+
+
+def test_compaction_is_scaled_to_the_snapshot(library, monkeypatch):
+    monkeypatch.setattr(library, 'JOURNAL_COMPACT_MIN_BYTES', 0)
+    small = saves_until_compaction(library, 200)
+    large = saves_until_compaction(library, 2000)
+    assert small > 1
+    assert 5 * small < large < 20 * small
+
+
+def test_small_journals_are_not_compacted(library):
+    data = {'L1': {'Person Name': 'Ann'}}
+    library.save_data(data, 'logbook.txt')
+    for _ in range(100):
+        library.save_record(data, 'logbook.txt', 'L1')
+    assert len(library.load_journal('logbook.txt')) == 100